@@ -0,0 +1,236 @@
+import threading
+from collections import OrderedDict
+from as_graph import get_graph_index, _as_month
+from db import get_db_connection
+
+# Months of computed cones kept by month_cones(), least recently used dropped.
+CONE_CACHE_MONTHS = 4
+
+_cone_cache = OrderedDict()
+_cone_lock = threading.Lock()
+
+
+def _cone_children(graph):
+    """
+    provider id -> customer ids for one month, merging 'customer' rows
+    (provider -> customer) with inverted 'provider' rows (customer -> provider).
+    """
+    children = {}
+    offsets, targets = graph.cust_offsets, graph.cust_targets
+    for p in range(len(offsets) - 1):
+        start, end = offsets[p], offsets[p + 1]
+        if start != end:
+            children.setdefault(p, set()).update(targets[start:end])
+    offsets, targets = graph.prov_offsets, graph.prov_targets
+    for c in range(len(offsets) - 1):
+        for p in targets[offsets[c]:offsets[c + 1]]:
+            children.setdefault(p, set()).add(c)
+    return children
+
+
+class MonthCones:
+    """
+    Customer cones for every ASN in one snapshot month, computed from our own
+    as_relationships rows. Cones are int bitsets indexed by interned ASN id and
+    include the ASN itself, like CAIDA's numberAsns. ASNs without customers
+    are not stored: their cone is just themselves. ASNs with no customer or
+    provider rows in the month are absent and have an empty cone (count 0).
+    """
+
+    def __init__(self, month, interner, bitsets, present):
+        self.month = month
+        self.interner = interner
+        self._bitsets = bitsets
+        self._present = present
+
+    def __contains__(self, asn):
+        return self.interner.lookup(asn) in self._present
+
+    def _bits(self, asn):
+        asn_id = self.interner.lookup(asn)
+        if asn_id is None or asn_id not in self._present:
+            return 0
+        return self._bitsets.get(asn_id, 1 << asn_id)
+
+    def count(self, asn):
+        return bin(self._bits(asn)).count("1")
+
+    def members(self, asn):
+        bits = self._bits(asn)
+        out = set()
+        while bits:
+            low = bits & -bits
+            out.add(self.interner.asn(low.bit_length() - 1))
+            bits ^= low
+        return out
+
+    def counts(self):
+        """
+        {asn: cone size} for every ASN with at least one customer.
+        """
+        return {self.interner.asn(i): bin(b).count("1") for i, b in self._bitsets.items()}
+
+
+def compute_cones(month, index=None):
+    """
+    Transitive closure over provider -> customer edges for all ASNs in a month.
+    Strongly connected components (relationship loops do occur in the data) are
+    found with an iterative Tarjan pass, which emits them children-first, so
+    each shared sub-cone is computed once and OR-ed into every provider above it.
+    """
+    index = index or get_graph_index()
+    graph = index.month(month)
+    return _closure(graph, index.interner)
+
+
+def month_cones(month, index=None):
+    """
+    compute_cones, cached for the last CONE_CACHE_MONTHS months. An entry is
+    reused only while the index still serves the same MonthGraph, so months
+    the ETL invalidates are recomputed.
+    """
+    index = index or get_graph_index()
+    graph = index.month(month)
+    key = (id(index), graph.month)
+    with _cone_lock:
+        cached = _cone_cache.get(key)
+        if cached is not None and cached[0] is graph:
+            _cone_cache.move_to_end(key)
+            return cached[1]
+    cones = _closure(graph, index.interner)
+    with _cone_lock:
+        _cone_cache[key] = (graph, cones)
+        _cone_cache.move_to_end(key)
+        while len(_cone_cache) > CONE_CACHE_MONTHS:
+            _cone_cache.popitem(last=False)
+    return cones
+
+
+def invalidate_months(months=None, index=None):
+    """
+    Drop the graph index months and cached cones for months whose
+    as_relationships rows changed; None drops everything. Call after every
+    write to as_relationships.
+    """
+    index = index or get_graph_index()
+    if months is None:
+        index.invalidate()
+        with _cone_lock:
+            _cone_cache.clear()
+        return
+    months = {_as_month(m) for m in months}
+    for month in months:
+        index.invalidate(month)
+    with _cone_lock:
+        for key in [k for k in _cone_cache if k[1] in months]:
+            del _cone_cache[key]
+
+
+def _closure(graph, interner):
+    children = _cone_children(graph)
+    present = set(children)
+    for kids in children.values():
+        present.update(kids)
+
+    counter = 0
+    order = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    comp_of = {}
+    comp_bits = []
+    bitsets = {}
+
+    for root in children:
+        if root in order:
+            continue
+        work = [(root, iter(children.get(root, ())))]
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, it = work[-1]
+            advanced = False
+            for child in it:
+                if child not in order:
+                    order[child] = low[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(children.get(child, ()))))
+                    advanced = True
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], order[child])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] != order[node]:
+                continue
+            members = []
+            while True:
+                m = stack.pop()
+                on_stack.discard(m)
+                members.append(m)
+                if m == node:
+                    break
+            comp_id = len(comp_bits)
+            bits = 0
+            for m in members:
+                comp_of[m] = comp_id
+            for m in members:
+                bits |= 1 << m
+                for child in children.get(m, ()):
+                    child_comp = comp_of[child]
+                    if child_comp != comp_id:
+                        bits |= comp_bits[child_comp]
+            comp_bits.append(bits)
+            for m in members:
+                if m in children:
+                    bitsets[m] = bits
+
+    return MonthCones(graph.month, interner, bitsets, present)
+
+
+def cone_loss(asn, lost_asn, m1, m2, index=None):
+    """
+    ASNs that left asn's cone between m1 and m2 and were reached through
+    lost_asn in m1, i.e. the part of the cone the lost customer took with it.
+    Empty when either ASN is absent from m1.
+    """
+    before = month_cones(m1, index)
+    after = month_cones(m2, index)
+    removed = before.members(asn) - after.members(asn)
+    return removed & before.members(lost_asn)
+
+
+SQL_COMPUTED_CONE_UPSERT = """
+    INSERT INTO computed_cones (asn, snapshot_date, cone_asn_count, last_update)
+    VALUES (%s, %s, %s, NOW())
+    ON DUPLICATE KEY UPDATE
+        cone_asn_count = VALUES(cone_asn_count),
+        last_update = NOW()
+"""
+
+
+def fill_computed_cones(month, batch_size=1000):
+    """
+    Compute cones for every ASN with customers in `month` and store their
+    sizes in computed_cones, covering months or ASNs CAIDA did not return.
+    """
+    cones = compute_cones(month)
+    snapshot = cones.month.strftime("%Y-%m-%d")
+    rows = [(a, snapshot, n) for a, n in cones.counts().items()]
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    for i in range(0, len(rows), batch_size):
+        cursor.executemany(SQL_COMPUTED_CONE_UPSERT, rows[i:i + batch_size])
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"[INFO] Stored computed cones for {len(rows)} ASNs in {snapshot}.")
+    return len(rows)
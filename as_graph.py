@@ -0,0 +1,228 @@
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import date, datetime
+from db import get_db_connection
+
+# Upper bound on memory held by loaded months; least recently used months are dropped.
+GRAPH_INDEX_MAX_BYTES = 512 * 1024 * 1024
+
+
+def _as_month(value):
+    if isinstance(value, datetime):
+        return value.date().replace(day=1)
+    if isinstance(value, date):
+        return value.replace(day=1)
+    return datetime.strptime(str(value)[:10], "%Y-%m-%d").date().replace(day=1)
+
+
+class ASNInterner:
+    """
+    Maps ASNs to dense integer ids (and back) so adjacency can live in arrays.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._asns = []
+        self._lock = threading.Lock()
+
+    def id(self, asn):
+        key = str(asn)
+        found = self._ids.get(key)
+        if found is not None:
+            return found
+        with self._lock:
+            found = self._ids.get(key)
+            if found is None:
+                found = len(self._asns)
+                self._asns.append(key)
+                self._ids[key] = found
+            return found
+
+    def lookup(self, asn):
+        return self._ids.get(str(asn))
+
+    def asn(self, asn_id):
+        return self._asns[asn_id]
+
+    def __len__(self):
+        return len(self._asns)
+
+
+def _csr(n, srcs, dsts):
+    """
+    Counting-sort (src, dst) pairs into CSR offsets/targets arrays.
+    """
+    counts = array("I", bytes(4 * (n + 1)))
+    for s in srcs:
+        counts[s + 1] += 1
+    for i in range(n):
+        counts[i + 1] += counts[i]
+    offsets = array("I", counts)
+    cursor = array("I", counts)
+    targets = array("I", bytes(4 * len(dsts)))
+    for s, d in zip(srcs, dsts):
+        targets[cursor[s]] = d
+        cursor[s] += 1
+    return offsets, targets
+
+
+class MonthGraph:
+    """
+    Relationship adjacency for one snapshot month in CSR form.
+    customers: provider -> customer, from relationship_type = 'customer' rows
+    providers: customer -> provider, from relationship_type = 'provider' rows
+    (the same row sets fill_lost_customers_simple and find_competitors query).
+    """
+
+    def __init__(self, month, interner, cust_pairs, prov_pairs):
+        self.month = month
+        self.interner = interner
+        n = len(interner)
+        self.cust_offsets, self.cust_targets = _csr(n, *cust_pairs)
+        self.prov_offsets, self.prov_targets = _csr(n, *prov_pairs)
+
+    @property
+    def nbytes(self):
+        return sum(a.itemsize * len(a) for a in (
+            self.cust_offsets, self.cust_targets, self.prov_offsets, self.prov_targets))
+
+    @staticmethod
+    def _neighbours(offsets, targets, asn_id):
+        if asn_id is None or asn_id + 1 >= len(offsets):
+            return targets[0:0]
+        return targets[offsets[asn_id]:offsets[asn_id + 1]]
+
+    def customer_ids(self, asn):
+        return self._neighbours(self.cust_offsets, self.cust_targets, self.interner.lookup(asn))
+
+    def provider_ids(self, asn):
+        return self._neighbours(self.prov_offsets, self.prov_targets, self.interner.lookup(asn))
+
+    def customers(self, asn):
+        return {self.interner.asn(i) for i in self.customer_ids(asn)}
+
+    def providers(self, asn):
+        return {self.interner.asn(i) for i in self.provider_ids(asn)}
+
+
+class ASGraphIndex:
+    """
+    In-process index over as_relationships. Months are loaded lazily on first
+    use and evicted least-recently-used once GRAPH_INDEX_MAX_BYTES is exceeded.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = GRAPH_INDEX_MAX_BYTES if max_bytes is None else max_bytes
+        self.interner = ASNInterner()
+        self._months = OrderedDict()
+        self._lock = threading.Lock()
+
+    def month(self, month):
+        key = _as_month(month)
+        with self._lock:
+            graph = self._months.get(key)
+            if graph is not None:
+                self._months.move_to_end(key)
+                return graph
+        graph = self._load(key)
+        with self._lock:
+            self._months[key] = graph
+            self._months.move_to_end(key)
+            self._evict()
+        return graph
+
+    def _evict(self):
+        total = sum(g.nbytes for g in self._months.values())
+        while total > self.max_bytes and len(self._months) > 1:
+            _, dropped = self._months.popitem(last=False)
+            total -= dropped.nbytes
+
+    def invalidate(self, month=None):
+        with self._lock:
+            if month is None:
+                self._months.clear()
+            else:
+                self._months.pop(_as_month(month), None)
+
+    def _load(self, month):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT provider_asn, customer_asn, relationship_type
+            FROM as_relationships
+            WHERE snapshot_date = %s
+              AND relationship_type IN ('customer', 'provider')
+        """, (month.strftime("%Y-%m-%d"),))
+        graph = self.build_month(month, cursor)
+        cursor.close()
+        conn.close()
+        return graph
+
+    def build_month(self, month, rows):
+        """
+        MonthGraph from (provider_asn, customer_asn, relationship_type) rows;
+        rows of other types are ignored.
+        """
+        cust_src, cust_dst = array("I"), array("I")
+        prov_src, prov_dst = array("I"), array("I")
+        intern = self.interner.id
+        for provider_asn, customer_asn, rel_type in rows:
+            if rel_type not in ('customer', 'provider'):
+                continue
+            p, c = intern(provider_asn), intern(customer_asn)
+            if rel_type == 'customer':
+                cust_src.append(p)
+                cust_dst.append(c)
+            else:
+                prov_src.append(c)
+                prov_dst.append(p)
+        return MonthGraph(_as_month(month), self.interner, (cust_src, cust_dst), (prov_src, prov_dst))
+
+    def customers(self, asn, month):
+        return self.month(month).customers(asn)
+
+    def providers(self, asn, month):
+        return self.month(month).providers(asn)
+
+    def lost_customers(self, asn, m1, m2):
+        """
+        Customers of asn in m1 that are no longer customers in m2.
+        """
+        before = set(self.month(m1).customer_ids(asn))
+        before.difference_update(self.month(m2).customer_ids(asn))
+        return {self.interner.asn(i) for i in before}
+
+    def provider_rows(self, customer_asn, start, end):
+        """
+        (provider_asn, snapshot_date) rows for customer_asn over months in
+        [start, end), the shape find_competitors reads from SQL.
+        """
+        rows = []
+        month = _as_month(start)
+        end = _as_month(end)
+        while month < end:
+            for provider in self.providers(customer_asn, month):
+                rows.append({"provider_asn": provider, "snapshot_date": month})
+            month = _next_month(month)
+        return rows
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+_shared_index = None
+_shared_lock = threading.Lock()
+
+
+def get_graph_index():
+    """
+    Process-wide ASGraphIndex, created on first use.
+    """
+    global _shared_index
+    if _shared_index is None:
+        with _shared_lock:
+            if _shared_index is None:
+                _shared_index = ASGraphIndex()
+    return _shared_index
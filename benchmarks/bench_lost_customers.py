@@ -0,0 +1,85 @@
+"""
+Compare fill_lost_customers_simple (per-month-pair Python loop) with
+fill_lost_customers_sql (single INSERT ... SELECT) on ASNs already loaded
+into the configured database, and check both produce the same rows.
+
+Usage: python benchmarks/bench_lost_customers.py <asn> [<asn> ...]
+
+The requestor's lost_customers rows are deleted before each engine runs, so
+each comparison only sees the rows that engine produced; the SQL engine's
+rows are left in place afterwards. The high-water mark in
+lost_customers_progress is cleared too, so the next incremental run redoes
+everything. The comparison ignores created_at/updated_at.
+"""
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from etl_lost_competitor import (
+    get_db_connection,
+    fill_lost_customers_simple,
+    fill_lost_customers_sql,
+)
+
+
+def lost_rows(asn):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT requestor_asn, snapshot_date, lost_asn, lost_month, lost_org, lost_cust_cone
+        FROM lost_customers
+        WHERE requestor_asn = %s
+        ORDER BY lost_month, lost_asn
+    """, (asn,))
+    rows = [tuple(str(v) if v is not None else None for v in r) for r in cursor.fetchall()]
+    cursor.close()
+    conn.close()
+    return rows
+
+
+def clear_lost_rows(asn):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM lost_customers WHERE requestor_asn = %s", (asn,))
+    cursor.execute("DELETE FROM lost_customers_progress WHERE requestor_asn = %s", (asn,))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def _timed(fn, asn):
+    started = time.perf_counter()
+    fn(asn)
+    return time.perf_counter() - started
+
+
+def run(asns):
+    results = []
+    for asn in asns:
+        clear_lost_rows(asn)
+        python_s = _timed(fill_lost_customers_simple, asn)
+        python_rows = lost_rows(asn)
+        clear_lost_rows(asn)
+        sql_s = _timed(fill_lost_customers_sql, asn)
+        sql_rows = lost_rows(asn)
+        results.append({
+            "asn": asn,
+            "rows": len(sql_rows),
+            "python_seconds": round(python_s, 4),
+            "sql_seconds": round(sql_s, 4),
+            "speedup": round(python_s / sql_s, 2) if sql_s else None,
+            "identical": python_rows == sql_rows,
+        })
+    return {"benchmark": "lost_customers", "results": results}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: bench_lost_customers.py <asn> [<asn> ...]")
+    report = run(sys.argv[1:])
+    print(json.dumps(report, indent=2))
+    if not all(r["identical"] for r in report["results"]):
+        sys.exit(1)
@@ -0,0 +1,92 @@
+"""
+Peak-RSS comparison of resp.json()-style parsing against the streaming parser
+used by load_caida_data(stream=True).
+
+Usage: python benchmarks/bench_stream_memory.py [--links N] [--months M]
+
+Each mode runs in its own subprocess so ru_maxrss reflects only that mode.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def synthetic_response(links, months):
+    """
+    Build a CAIDA-shaped asns response with `links` asnLinks edges per month.
+    """
+    def asn_obj(a):
+        return {
+            "asn": str(a), "asnName": f"AS{a}", "rank": a,
+            "country": {"iso": "US", "name": "United States", "capital": "Washington",
+                        "population": 331000000, "continent": "North America"},
+            "organization": {"orgName": f"Org {a}"},
+            "cone": {"numberAsns": 1, "numberPrefixes": 2, "numberAddresses": 256},
+            "asnDegree": {"customer": 0, "peer": 1, "transit": 1, "provider": 1},
+        }
+    edges = []
+    for m in range(months):
+        node = asn_obj(1)
+        node["date"] = f"2024-{m % 12 + 1:02d}-01"
+        node["asnLinks"] = {"edges": [
+            {"node": {"numberPaths": i, "relationship": "customer", "asn1": asn_obj(100000 + i)}}
+            for i in range(links)
+        ]}
+        edges.append({"node": node})
+    return {"data": {"asns": {"edges": edges}}}
+
+
+def _child(mode, path):
+    started = time.perf_counter()
+    count = 0
+    if mode == "json":
+        with open(path, "rb") as fh:
+            data = json.load(fh)
+        for edge in data["data"]["asns"]["edges"]:
+            count += 1 + len(edge["node"].get("asnLinks", {}).get("edges", []))
+    else:
+        from etl_lost_competitor import iter_caida_stream_pages
+        with open(path, "rb") as fh:
+            for nodes, _ in iter_caida_stream_pages(fh):
+                count += len(nodes)
+    elapsed = time.perf_counter() - started
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024
+    print(json.dumps({"mode": mode, "items": count, "seconds": round(elapsed, 3), "peak_rss_kib": rss}))
+
+
+def run(links=20000, months=3):
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as fh:
+        json.dump(synthetic_response(links, months), fh)
+        path = fh.name
+    response_bytes = os.path.getsize(path)
+    results = []
+    try:
+        for mode in ("json", "stream"):
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", mode, path],
+                capture_output=True, text=True, check=True
+            )
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    finally:
+        os.unlink(path)
+    return {"benchmark": "stream_memory", "links": links, "months": months,
+            "response_bytes": response_bytes, "results": results}
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args and args[0] == "--child":
+        _child(args[1], args[2])
+        sys.exit(0)
+    links = int(args[args.index("--links") + 1]) if "--links" in args else 20000
+    months = int(args[args.index("--months") + 1]) if "--months" in args else 3
+    print(json.dumps(run(links, months), indent=2))
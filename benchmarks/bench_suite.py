@@ -0,0 +1,184 @@
+"""
+End-to-end benchmark suite at several data sizes, against the configured
+MySQL database and a local fake CAIDA GraphQL server (benchmarks/fake_caida.py).
+
+For each size it times:
+  load_caida_data              etl_lost_competitor.load_caida_data ingest from
+                               the fake API (links x months); note the app's
+                               update jobs use etl_caida.load_caida_data
+  fill_lost_customers_simple   on a synthetic provider (synthetic_data.py)
+  compute_lost_competitor_data the incremental lost-customer + gains stages
+  /api/competitor_analysis     uncached (cache invalidated) and cached
+  /api/download_raw_data       xlsx and csv exports, body fully consumed
+
+Usage: python benchmarks/bench_suite.py [--sizes small,medium] [--repeat 3]
+                                        [--output results.json] [--keep]
+
+Only ASNs in the private-use range (SYNTHETIC_ASN_BASE and up) are written,
+and they are deleted again at the end unless --keep is given. Results are
+printed and written as JSON (default benchmarks/results/suite-<time>.json)
+so runs can be diffed. The ETL SQL is MySQL-specific, so there is no SQLite
+mode: point config.py at a scratch MySQL/MariaDB database.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import etl_lost_competitor
+from etl_lost_competitor import (
+    load_caida_data,
+    fill_lost_customers_simple,
+    compute_lost_competitor_data,
+    invalidate_fingerprints,
+)
+from migrations import migrate
+from response_cache import invalidate_asn
+from fake_caida import FakeCaidaServer, SYNTHETIC_ASN_BASE, months_between
+from synthetic_data import generate, cleanup
+
+# name -> CAIDA links per ASN, months, synthetic customers
+SIZES = {
+    "small": {"links": 100, "months": 6, "customers": 200},
+    "medium": {"links": 1000, "months": 12, "customers": 2000},
+    "large": {"links": 5000, "months": 24, "customers": 10000},
+}
+CHURN = 0.05
+START_MONTH = "2022-01-01"
+
+
+def _summary(runs):
+    return {
+        "runs": [round(r, 4) for r in runs],
+        "min": round(min(runs), 4),
+        "median": round(statistics.median(runs), 4),
+    }
+
+
+def _time(fn, repeat, before=None):
+    runs = []
+    result = None
+    for _ in range(repeat):
+        if before:
+            before()
+        started = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - started)
+    return _summary(runs), result
+
+
+def _end_month(start, months):
+    year, month = int(start[:4]), int(start[5:7])
+    index = year * 12 + month - 1 + months - 1
+    return f"{index // 12:04d}-{index % 12 + 1:02d}-01"
+
+
+def bench_size(name, spec, repeat):
+    result = {"params": dict(spec, churn=CHURN), "timings": {}, "info": {}}
+    timings = result["timings"]
+    end_month = _end_month(START_MONTH, spec["months"])
+
+    # 1) CAIDA ingest from the fake API.
+    caida_asn = str(SYNTHETIC_ASN_BASE + 10)
+    with FakeCaidaServer(links=spec["links"], churn=CHURN) as server:
+        etl_lost_competitor.CAIDA_API_URL = server.url
+        etl_lost_competitor.RESPONSE_CACHE_ENABLED = False
+        timings["load_caida_data"], stats = _time(
+            lambda: load_caida_data(caida_asn, START_MONTH, end_month), repeat,
+            # Otherwise repeat runs skip every as_data row as unchanged.
+            lambda: invalidate_fingerprints(months=months_between(START_MONTH, end_month)))
+        result["info"]["caida_requests"] = server.requests
+        if stats:
+            result["info"]["caida_rows"] = {k: v["rows"] for k, v in stats.items()}
+
+    # 2) Lost customers and competitor gains on a synthetic provider.
+    provider = SYNTHETIC_ASN_BASE + 20000000
+    started = time.perf_counter()
+    result["info"]["synthetic"] = generate(provider, spec["customers"], spec["months"], CHURN, START_MONTH)
+    result["info"]["synthetic"]["generate_seconds"] = round(time.perf_counter() - started, 4)
+    timings["fill_lost_customers_simple"], _ = _time(lambda: fill_lost_customers_simple(provider), repeat)
+    timings["compute_lost_competitor_data_full"], _ = _time(
+        lambda: compute_lost_competitor_data(provider, full=True), repeat)
+
+    # 3) Endpoints through Flask's test client.
+    try:
+        import flask_app
+    except Exception as e:
+        result["info"]["endpoints_skipped"] = f"flask_app import failed: {e}"
+        return result
+    client = flask_app.app.test_client()
+    query = f"requestor_asn={provider}&start_date={START_MONTH[:7]}&end_date={end_month[:7]}"
+
+    def get(url):
+        resp = client.get(url)
+        size = sum(len(chunk) for chunk in resp.response)
+        if resp.status_code != 200:
+            raise RuntimeError(f"{url} returned {resp.status_code}")
+        return {"bytes": size, "queries": resp.headers.get("X-Query-Count")}
+
+    timings["competitor_analysis_uncached"], info = _time(
+        lambda: get(f"/api/competitor_analysis?{query}"), repeat, lambda: invalidate_asn(provider))
+    result["info"]["competitor_analysis"] = info
+    timings["competitor_analysis_cached"], _ = _time(lambda: get(f"/api/competitor_analysis?{query}"), repeat)
+    for fmt in ("xlsx", "csv"):
+        timings[f"download_raw_data_{fmt}"], info = _time(
+            lambda: get(f"/api/download_raw_data?asn={provider}&format={fmt}"), repeat)
+        result["info"][f"download_raw_data_{fmt}"] = info
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=HERE, text=True).strip()
+    except Exception:
+        return None
+
+
+def run(sizes, repeat, keep=False):
+    migrate()
+    cleanup()
+    report = {
+        "benchmark": "suite",
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "repeat": repeat,
+        "sizes": {},
+    }
+    try:
+        for name in sizes:
+            print(f"[INFO] Benchmarking size {name} ...", file=sys.stderr)
+            report["sizes"][name] = bench_size(name, SIZES[name], repeat)
+            if not keep:
+                cleanup()
+    finally:
+        if not keep:
+            cleanup()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="small,medium", help=f"comma-separated, from {', '.join(SIZES)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--keep", action="store_true", help="leave synthetic rows in the database")
+    args = parser.parse_args()
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        sys.exit(f"unknown sizes: {', '.join(unknown)}")
+    report = run(sizes, args.repeat, args.keep)
+    output = args.output or os.path.join(
+        HERE, "results", f"suite-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as fh:
+        json.dump(report, fh, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"[INFO] Results written to {output}", file=sys.stderr)
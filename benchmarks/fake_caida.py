@@ -0,0 +1,176 @@
+"""
+Local stand-in for the CAIDA ASRank v2 GraphQL API, for benchmarks.
+
+Answers the asns(asns:[...], dateStart, dateEnd) queries built by
+build_asns_query, including asnLinks(first, offset) paging and links-only
+follow-up pages. Data is synthetic but deterministic: every ASN has
+`links` neighbours per month, and a `churn` fraction of customers changes
+between months.
+
+Usage: python benchmarks/fake_caida.py [--port 8765] [--links N] [--churn F]
+"""
+import re
+import sys
+import json
+import random
+import argparse
+import functools
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dateutil.relativedelta import relativedelta
+
+# RFC 6996 private-use 32-bit ASNs, so synthetic rows never collide with real ones.
+SYNTHETIC_ASN_BASE = 4200000000
+
+_ASNS_RE = re.compile(r'asns\(asns:\[(.*?)\],\s*dateStart:"([^"]+)",\s*dateEnd:"([^"]+)"\)')
+_PAGE_RE = re.compile(r"asnLinks\(first:(\d+),\s*offset:(\d+)\)")
+
+
+def asn_obj(asn, month_idx=0):
+    asn = int(asn)
+    return {
+        "asn": str(asn),
+        "asnName": f"SYN-{asn}",
+        "rank": asn % 100000 + month_idx,
+        "country": {"iso": "ZZ", "name": "Synthetic", "capital": "Nowhere",
+                    "population": 0, "continent": "None"},
+        "organization": {"orgName": f"Synthetic Org {asn}"},
+        "cone": {"numberAsns": 1 + asn % 50, "numberPrefixes": 1 + asn % 200,
+                 "numberAddresses": 256 * (1 + asn % 200)},
+        "asnDegree": {"customer": asn % 7, "peer": asn % 5, "transit": asn % 11, "provider": 1 + asn % 3},
+    }
+
+
+def months_between(date_start, date_end):
+    month = datetime.strptime(date_start[:7] + "-01", "%Y-%m-%d")
+    last = datetime.strptime(date_end[:7] + "-01", "%Y-%m-%d")
+    out = []
+    while month <= last:
+        out.append(month.strftime("%Y-%m-%d"))
+        month += relativedelta(months=1)
+    return out
+
+
+@functools.lru_cache(maxsize=None)
+def _generation(asn, slot, month_idx, churn):
+    """
+    How many times customer slot `slot` has been replaced by month_idx.
+    """
+    if month_idx == 0:
+        return 0
+    replaced = random.Random(asn * 1000003 + slot * 7919 + month_idx).random() < churn
+    return _generation(asn, slot, month_idx - 1, churn) + replaced
+
+
+def month_links(asn, month_idx, links, churn):
+    """
+    Neighbours of asn in one month: ~70% customers, 20% peers, 10% providers.
+    Customer slot i is held by a different ASN once churn has replaced it.
+    """
+    asn = int(asn)
+    out = []
+    for i in range(links):
+        kind = i % 10
+        if kind < 7:
+            generation = _generation(asn, i, month_idx, churn)
+            neighbour = SYNTHETIC_ASN_BASE + 1000000 + (i * 97 + generation * 7) % 50000000
+            relationship = "customer"
+        elif kind < 9:
+            neighbour = SYNTHETIC_ASN_BASE + 60000000 + i
+            relationship = "peer"
+        else:
+            neighbour = SYNTHETIC_ASN_BASE + 70000000 + i
+            relationship = "provider"
+        out.append({"numberPaths": 1 + (i % 13), "relationship": relationship,
+                    "asn1": asn_obj(neighbour, month_idx)})
+    return out
+
+
+def build_response(query, links, churn):
+    match = _ASNS_RE.search(query)
+    if not match:
+        return {"errors": [{"message": "unsupported query"}]}
+    asns = [a.strip().strip('"') for a in match.group(1).split(",") if a.strip()]
+    months = months_between(match.group(2), match.group(3))
+    page = _PAGE_RE.search(query)
+    links_only = "asnName" not in query.split("asnLinks", 1)[0]
+    edges = []
+    for asn in asns:
+        for idx, month in enumerate(months):
+            node = {"asn": str(asn)} if links_only else asn_obj(asn, idx)
+            node["date"] = month
+            all_links = month_links(asn, idx, links, churn)
+            link_block = {}
+            if page:
+                first, offset = int(page.group(1)), int(page.group(2))
+                selected = all_links[offset:offset + first]
+                link_block["pageInfo"] = {"hasNextPage": offset + first < len(all_links)}
+            else:
+                selected = all_links
+            link_block["edges"] = [{"node": n} for n in selected]
+            node["asnLinks"] = link_block
+            edges.append({"node": node})
+    return {"data": {"asns": {"edges": edges}}}
+
+
+class FakeCaidaServer:
+    """
+    ThreadingHTTPServer on localhost, run in a daemon thread.
+    url is the value to assign to etl_lost_competitor.CAIDA_API_URL.
+    """
+
+    def __init__(self, links=100, churn=0.05, port=0):
+        server_self = self
+        self.links = links
+        self.churn = churn
+        self.requests = 0
+        self._responses = {}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                server_self.requests += 1
+                query = body.get("query", "")
+                # Responses are memoised so repeated runs time the ETL, not this server.
+                payload = server_self._responses.get(query)
+                if payload is None:
+                    payload = json.dumps(build_response(
+                        query, server_self.links, server_self.churn)).encode("utf-8")
+                    server_self._responses[query] = payload
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}/v2/graphql"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--links", type=int, default=100)
+    parser.add_argument("--churn", type=float, default=0.05)
+    args = parser.parse_args()
+    with FakeCaidaServer(args.links, args.churn, args.port) as server:
+        print(f"Fake CAIDA GraphQL listening on {server.url}", file=sys.stderr)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
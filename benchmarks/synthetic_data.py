@@ -0,0 +1,130 @@
+"""
+Synthetic as_data / as_relationships generator for benchmarks.
+
+Writes one provider ASN with `customers` customers per month over `months`
+months. Each month a `churn` fraction of customers leaves for one of a few
+competitor providers (both the provider- and the customer-side rows are
+written, as the ETL would), so lost-customer and competitor analysis have
+real work to do. All ASNs are in the private-use range above
+SYNTHETIC_ASN_BASE and cleanup() removes them again.
+
+Usage: python benchmarks/synthetic_data.py <customers> <months> [--churn F] [--cleanup]
+"""
+import os
+import sys
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from etl_lost_competitor import (
+    get_db_connection,
+    SQL_AS_DATA_UPSERT,
+    SQL_AS_REL_UPSERT,
+    BULK_BATCH_SIZE,
+    as_data_params,
+    invalidate_fingerprints,
+)
+from as_cone import invalidate_months
+from fake_caida import SYNTHETIC_ASN_BASE, asn_obj, months_between
+
+COMPETITORS = 5
+
+
+def _month_list(start_month, months):
+    year, month = int(start_month[:4]), int(start_month[5:7])
+    end_index = year * 12 + month - 1 + months - 1
+    end = f"{end_index // 12:04d}-{end_index % 12 + 1:02d}-01"
+    return months_between(start_month, end)
+
+
+def generate(provider_asn, customers, months, churn=0.05, start_month="2022-01-01", seed=1):
+    """
+    Insert the synthetic dataset; returns a summary dict with row counts.
+    """
+    rng = random.Random(seed)
+    month_list = _month_list(start_month, months)
+    competitors = [provider_asn + 1 + i for i in range(COMPETITORS)]
+    members = [provider_asn + 100000 + i for i in range(customers)]
+    next_asn = provider_asn + 100000 + customers
+    moved = {}  # customer -> competitor it left to
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    data_rows = []
+    rel_rows = []
+
+    def flush(force=False):
+        if data_rows and (force or len(data_rows) >= BULK_BATCH_SIZE):
+            cursor.executemany(SQL_AS_DATA_UPSERT, data_rows)
+            data_rows.clear()
+        if rel_rows and (force or len(rel_rows) >= BULK_BATCH_SIZE):
+            cursor.executemany(SQL_AS_REL_UPSERT, rel_rows)
+            rel_rows.clear()
+
+    totals = {"as_data": 0, "as_relationships": 0, "lost": 0}
+    for idx, month in enumerate(month_list):
+        if idx:
+            leaving = [c for c in members if rng.random() < churn]
+            for c in leaving:
+                moved[c] = rng.choice(competitors)
+            members = [c for c in members if c not in moved]
+            members.extend(range(next_asn, next_asn + len(leaving)))
+            next_asn += len(leaving)
+            totals["lost"] += len(leaving)
+        for asn in [provider_asn] + competitors + members + list(moved):
+            data_rows.append(as_data_params(asn_obj(asn, idx), month))
+        for c in members:
+            rel_rows.append((provider_asn, c, "customer", month, 1))
+            rel_rows.append((provider_asn, c, "provider", month, 1))
+        for c, comp in moved.items():
+            rel_rows.append((comp, c, "customer", month, 1))
+            rel_rows.append((comp, c, "provider", month, 1))
+        totals["as_data"] += 1 + len(competitors) + len(members) + len(moved)
+        totals["as_relationships"] += 2 * (len(members) + len(moved))
+        flush()
+    flush(force=True)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    invalidate_fingerprints(months=month_list)
+    invalidate_months(month_list)
+    totals["months"] = len(month_list)
+    totals["start_month"] = month_list[0]
+    totals["end_month"] = month_list[-1]
+    return totals
+
+
+def cleanup():
+    """
+    Delete every row involving a synthetic ASN.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    base = SYNTHETIC_ASN_BASE
+    for sql, n in (
+        ("DELETE FROM as_relationships WHERE provider_asn >= %s OR customer_asn >= %s", 2),
+        ("DELETE FROM as_data WHERE asn >= %s", 1),
+        ("DELETE FROM as_data_fingerprints WHERE asn >= %s", 1),
+        ("DELETE FROM lost_customers WHERE requestor_asn >= %s", 1),
+        ("DELETE FROM lost_customers_progress WHERE requestor_asn >= %s", 1),
+        ("DELETE FROM competitor_gains WHERE lost_asn >= %s", 1),
+    ):
+        cursor.execute(sql, (base,) * n)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    invalidate_months()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("customers", type=int)
+    parser.add_argument("months", type=int)
+    parser.add_argument("--churn", type=float, default=0.05)
+    parser.add_argument("--cleanup", action="store_true", help="remove synthetic rows and exit")
+    args = parser.parse_args()
+    if args.cleanup:
+        cleanup()
+    else:
+        print(generate(SYNTHETIC_ASN_BASE, args.customers, args.months, args.churn))
@@ -0,0 +1,105 @@
+import os
+import gzip
+import json
+import threading
+
+# Local cache of CAIDA asns edges, one gzip'd JSON file per (asn, month).
+CACHE_DIR = os.environ.get("CAIDA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".caida_cache"))
+# Total size cap; least recently used files are evicted beyond it.
+CACHE_MAX_BYTES = int(os.environ.get("CAIDA_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+
+# put() keeps a running total of the cache size and only walks CACHE_DIR when
+# that total goes over the cap, or every EVICT_RESCAN_PUTS writes to pick up
+# files written or removed by other processes.
+EVICT_RESCAN_PUTS = 1000
+
+_lock = threading.Lock()
+_total_bytes = None
+_puts_since_scan = 0
+
+
+def _path(asn, month):
+    return os.path.join(CACHE_DIR, str(asn), f"{month}.json.gz")
+
+
+def get(asn, month):
+    """
+    Return the cached list of edges for (asn, month), or None on a miss.
+    Reading a file bumps its mtime, which is what LRU eviction orders by.
+    """
+    path = _path(asn, month)
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as fh:
+            edges = json.load(fh)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        # Truncated or corrupt entry: treat as a miss and let it be rewritten.
+        return None
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+    return edges
+
+
+def put(asn, month, edges):
+    """
+    Store the edges for (asn, month), evicting down to CACHE_MAX_BYTES when
+    the cache has grown past it.
+    """
+    global _total_bytes, _puts_since_scan
+    path = _path(asn, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as fh:
+        json.dump(edges, fh)
+    try:
+        replaced = os.stat(path).st_size
+    except OSError:
+        replaced = 0
+    size = os.stat(tmp).st_size
+    os.replace(tmp, path)
+    with _lock:
+        if _total_bytes is not None and _puts_since_scan < EVICT_RESCAN_PUTS:
+            _total_bytes += size - replaced
+            _puts_since_scan += 1
+            if _total_bytes <= CACHE_MAX_BYTES:
+                return
+    evict()
+
+
+def evict(max_bytes=None):
+    """
+    Delete least recently used entries until the cache fits in max_bytes.
+    """
+    global _total_bytes, _puts_since_scan
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    with _lock:
+        _puts_since_scan = 0
+        entries = []
+        total = 0
+        for root, _, files in os.walk(CACHE_DIR):
+            for name in files:
+                if not name.endswith(".json.gz"):
+                    continue
+                full = os.path.join(root, name)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, full))
+                total += st.st_size
+        _total_bytes = total
+        if total <= max_bytes:
+            return
+        entries.sort()
+        for _, size, full in entries:
+            try:
+                os.remove(full)
+            except OSError:
+                continue
+            total -= size
+            if total <= max_bytes:
+                break
+        _total_bytes = total
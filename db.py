@@ -0,0 +1,91 @@
+import os
+import time
+import threading
+from mysql.connector import pooling, errors
+from metrics import InstrumentedConnection
+from config import MYSQL_HOST, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DB
+
+# Shared MySQL connection pool used by flask_app and the ETL modules.
+DB_POOL_NAME = "asrank"
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+# Seconds to wait for a free connection before giving up.
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+
+_pool = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {
+    "acquired": 0,
+    "waited": 0,
+    "wait_seconds": 0.0,
+    "max_wait_seconds": 0.0,
+    "timeouts": 0,
+    "reconnects": 0,
+}
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name=DB_POOL_NAME,
+                    pool_size=DB_POOL_SIZE,
+                    pool_reset_session=True,
+                    host=MYSQL_HOST,
+                    user=MYSQL_USER,
+                    password=MYSQL_PASSWORD,
+                    database=MYSQL_DB
+                )
+    return _pool
+
+
+def get_db_connection():
+    """
+    Borrow a connection from the shared pool. conn.close() returns it.
+    Waits up to DB_POOL_TIMEOUT seconds when the pool is exhausted, and pings
+    the connection first, reconnecting it if the server dropped it. Cursors
+    are instrumented (see metrics.InstrumentedCursor).
+    """
+    pool = _get_pool()
+    started = time.perf_counter()
+    delay = 0.005
+    while True:
+        try:
+            conn = pool.get_connection()
+            break
+        except errors.PoolError:
+            waited = time.perf_counter() - started
+            if waited >= DB_POOL_TIMEOUT:
+                with _stats_lock:
+                    _stats["timeouts"] += 1
+                raise
+            time.sleep(min(delay, DB_POOL_TIMEOUT - waited))
+            delay = min(delay * 2, 0.1)
+    waited = time.perf_counter() - started
+
+    reconnected = False
+    if not conn.is_connected():
+        conn.reconnect(attempts=2, delay=0)
+        reconnected = True
+
+    with _stats_lock:
+        _stats["acquired"] += 1
+        if waited > 0.001:
+            _stats["waited"] += 1
+        _stats["wait_seconds"] += waited
+        _stats["max_wait_seconds"] = max(_stats["max_wait_seconds"], waited)
+        if reconnected:
+            _stats["reconnects"] += 1
+    return InstrumentedConnection(conn)
+
+
+def pool_stats():
+    """
+    Snapshot of pool-wait metrics since process start.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["pool_size"] = DB_POOL_SIZE
+    return stats
@@ -0,0 +1,179 @@
+import sys
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from etl_lost_competitor import (
+    fetch_caida_data_cached,
+    fetch_caida_batch_cached,
+    ingest_caida_nodes,
+    pending_update_range,
+    compute_lost_competitor_data,
+    BULK_BATCH_SIZE,
+)
+
+# Maximum number of CAIDA requests in flight at once.
+FETCH_CONCURRENCY = 4
+# Fetched responses waiting for the writer; bounds memory if MySQL falls behind.
+WRITE_QUEUE_SIZE = 8
+# ASNs packed into one asns(asns:[...]) query; 1 keeps one request per ASN.
+ASNS_PER_REQUEST = 1
+
+_DONE = object()
+
+
+def read_asn_file(path):
+    """
+    Read one ASN per line, ignoring blank lines and # comments.
+    """
+    asns = []
+    with open(path) as fh:
+        for line in fh:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                asns.append(line)
+    return asns
+
+
+def _fetch_one(asn, date_start, date_end, default_start_date, out_queue):
+    if date_start and date_end:
+        date_range = (date_start, date_end)
+    else:
+        date_range = pending_update_range(asn, default_start_date)
+    if date_range is None:
+        print(f"[INFO] ASN {asn} is already current, skipping fetch.")
+        return
+    start, end = date_range
+    try:
+        data = fetch_caida_data_cached(asn, start, end)
+    except Exception as e:
+        out_queue.put((asn, start, end, None, e))
+        return
+    nodes = data.get("data", {}).get("asns", {}).get("edges", [])
+    out_queue.put((asn, start, end, nodes, None))
+
+
+def _fetch_group(asns, start, end, out_queue):
+    try:
+        routed = fetch_caida_batch_cached(asns, start, end)
+    except Exception as e:
+        for asn in asns:
+            out_queue.put((asn, start, end, None, e))
+        return
+    for asn in asns:
+        out_queue.put((asn, start, end, routed.get(str(asn), []), None))
+
+
+def _group_by_range(pool, asns, date_start, date_end, default_start_date, group_size):
+    """
+    Resolve each ASN's date range and pack ASNs sharing a range into groups.
+    """
+    if date_start and date_end:
+        ranges = [(date_start, date_end)] * len(asns)
+    else:
+        ranges = list(pool.map(lambda a: pending_update_range(a, default_start_date), asns))
+    by_range = {}
+    for asn, date_range in zip(asns, ranges):
+        if date_range is None:
+            print(f"[INFO] ASN {asn} is already current, skipping fetch.")
+            continue
+        by_range.setdefault(date_range, []).append(asn)
+    groups = []
+    for (start, end), members in by_range.items():
+        for i in range(0, len(members), group_size):
+            groups.append((members[i:i + group_size], start, end))
+    return groups
+
+
+def _writer_loop(in_queue, results, fill_lost, batch_size):
+    while True:
+        item = in_queue.get()
+        if item is _DONE:
+            return
+        asn, start, end, nodes, error = item
+        if error is not None:
+            print(f"[ERROR] CAIDA fetch failed for ASN {asn}: {error}")
+            results[asn] = {"status": "fetch_failed", "error": str(error)}
+            continue
+        if not nodes:
+            print(f"[WARN] No data returned for ASN {asn} between {start} and {end}")
+            results[asn] = {"status": "empty"}
+            continue
+        try:
+            stats = ingest_caida_nodes(asn, nodes, start, end, batch_size)
+            if fill_lost:
+                compute_lost_competitor_data(asn)
+            results[asn] = {"status": "ok", "stats": stats}
+        except Exception as e:
+            print(f"[ERROR] Ingestion failed for ASN {asn}: {e}")
+            results[asn] = {"status": "write_failed", "error": str(e)}
+
+
+def batch_update(asns, date_start=None, date_end=None, concurrency=FETCH_CONCURRENCY,
+                 default_start_date="2024-01-01", fill_lost=True, batch_size=BULK_BATCH_SIZE,
+                 asns_per_request=ASNS_PER_REQUEST):
+    """
+    Refresh many ASNs at once. Up to `concurrency` worker threads fetch from
+    CAIDA (each reusing a keep-alive session) and hand responses to a single
+    writer thread through a bounded queue, so network and MySQL latency overlap.
+    Without date_start/date_end each ASN is brought up to date like dynamic_update.
+    With asns_per_request > 1, ASNs sharing a date range are fetched together
+    in one GraphQL query (split automatically on timeout or oversize responses).
+    Both modes read historical months from the on-disk CAIDA cache and only
+    request the uncached span.
+    Returns {asn: {"status": ..., ...}}.
+    """
+    results = {}
+    write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+    writer = threading.Thread(
+        target=_writer_loop,
+        args=(write_queue, results, fill_lost, batch_size),
+        daemon=True
+    )
+    writer.start()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            if asns_per_request > 1:
+                groups = _group_by_range(pool, asns, date_start, date_end,
+                                         default_start_date, asns_per_request)
+                futures = [pool.submit(_fetch_group, g, start, end, write_queue)
+                           for g, start, end in groups]
+                labels = [",".join(map(str, g)) for g, _, _ in groups]
+            else:
+                futures = [
+                    pool.submit(_fetch_one, asn, date_start, date_end, default_start_date, write_queue)
+                    for asn in asns
+                ]
+                labels = list(asns)
+            for fut, label in zip(futures, labels):
+                try:
+                    fut.result()
+                except Exception as e:
+                    print(f"[ERROR] Could not fetch ASN(s) {label}: {e}")
+                    for asn in str(label).split(","):
+                        results[asn] = {"status": "fetch_failed", "error": str(e)}
+    finally:
+        write_queue.put(_DONE)
+        writer.join()
+    ok = sum(1 for r in results.values() if r["status"] == "ok")
+    print(f"[INFO] Batch update finished: {ok}/{len(asns)} ASNs ingested.")
+    return results
+
+
+if __name__ == "__main__":
+    # Usage: python etl_batch.py <asn_file | asn ...> [--concurrency N] [--per-request N]
+    args = sys.argv[1:]
+    concurrency = FETCH_CONCURRENCY
+    per_request = ASNS_PER_REQUEST
+    if "--concurrency" in args:
+        idx = args.index("--concurrency")
+        concurrency = int(args[idx + 1])
+        del args[idx:idx + 2]
+    if "--per-request" in args:
+        idx = args.index("--per-request")
+        per_request = int(args[idx + 1])
+        del args[idx:idx + 2]
+    if len(args) == 1 and not args[0].isdigit():
+        target_asns = read_asn_file(args[0])
+    else:
+        target_asns = args
+    batch_update(target_asns, concurrency=concurrency, asns_per_request=per_request)
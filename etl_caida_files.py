@@ -0,0 +1,187 @@
+import os
+import re
+import bz2
+import sys
+import gzip
+from collections import defaultdict
+from etl_lost_competitor import (
+    get_db_connection,
+    normalize_relationship,
+    BulkWriter,
+    BULK_BATCH_SIZE,
+    invalidate_fingerprints,
+)
+from as_cone import invalidate_months, fill_computed_cones
+from response_cache import invalidate_all
+import snapshot_store
+
+# The dataset has no path counts, so keep any already stored from the API.
+SQL_AS_REL_FILE_UPSERT = """
+INSERT INTO as_relationships (
+    provider_asn,
+    customer_asn,
+    relationship_type,
+    snapshot_date,
+    path_count,
+    last_update
+)
+VALUES (
+    %s, %s, %s, %s, NULL, NOW()
+)
+ON DUPLICATE KEY UPDATE
+    relationship_type = VALUES(relationship_type),
+    last_update = NOW()
+"""
+
+# Only the columns the dataset files provide; names/countries already stored
+# from the GraphQL API are left untouched. transit_degree is not derivable
+# from as-rel (CAIDA computes it from the AS paths), so it is left as stored:
+# whatever the API last wrote, or NULL for ASNs only the files know about.
+SQL_AS_DATA_FILE_UPSERT = """
+INSERT INTO as_data (
+    asn,
+    snapshot_date,
+    cone_asn_count,
+    customer_degree,
+    peer_degree,
+    provider_degree,
+    last_update
+)
+VALUES (%s, %s, %s, %s, %s, %s, NOW())
+ON DUPLICATE KEY UPDATE
+    cone_asn_count = COALESCE(VALUES(cone_asn_count), cone_asn_count),
+    customer_degree = VALUES(customer_degree),
+    peer_degree = VALUES(peer_degree),
+    provider_degree = VALUES(provider_degree),
+    last_update = NOW()
+"""
+
+# CAIDA as-rel encodes p2c as -1 and p2p as 0.
+_AS_REL_TYPES = {"-1": "customer", "0": "peer"}
+
+
+def _open_text(path):
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def snapshot_from_filename(path):
+    """
+    CAIDA names files YYYYMMDD.as-rel2.txt.bz2 / YYYYMMDD.ppdc-ases.txt.bz2.
+    """
+    match = re.match(r"(\d{4})(\d{2})\d{2}", os.path.basename(path))
+    if not match:
+        raise ValueError(f"Cannot infer snapshot month from {path}")
+    return f"{match.group(1)}-{match.group(2)}-01"
+
+
+def iter_as_rel(path):
+    """
+    Stream (asn_a, asn_b, relationship) from an as-rel / as-rel2 file, where
+    relationship is 'customer' (asn_b is a customer of asn_a) or 'peer'.
+    """
+    with _open_text(path) as fh:
+        for line in fh:
+            if not line or line[0] == "#":
+                continue
+            parts = line.rstrip("\n").split("|")
+            if len(parts) < 3:
+                continue
+            rel = _AS_REL_TYPES.get(parts[2].strip())
+            if rel is None:
+                continue
+            yield parts[0].strip(), parts[1].strip(), rel
+
+
+def iter_ppdc_ases(path):
+    """
+    Stream (asn, cone_asn_count) from a ppdc-ases file ("<asn> <cone members...>").
+    """
+    with _open_text(path) as fh:
+        for line in fh:
+            if not line or line[0] == "#":
+                continue
+            parts = line.split()
+            if not parts:
+                continue
+            yield parts[0], len(set(parts))
+
+
+def iter_month_file_rows(as_rel_path, ppdc_path, snapshot_date):
+    """
+    Yield (table, params) rows for one month of the dataset: every
+    as_relationships row while streaming the as-rel file, then one as_data
+    row (asn, snapshot_date, cone_asn_count, customer, peer and provider
+    degree) per ASN seen in either file.
+    Each p2c line is written from both endpoints' point of view through
+    normalize_relationship, exactly as load_caida_data would store it when
+    ingesting either ASN, and each p2p line in both directions.
+    """
+    degrees = defaultdict(lambda: [0, 0, 0])  # customer, peer, provider
+    for a, b, rel in iter_as_rel(as_rel_path):
+        if rel == "customer":
+            views = ((a, b, "customer"), (b, a, "provider"))
+            degrees[a][0] += 1
+            degrees[b][2] += 1
+        else:
+            views = ((a, b, "peer"), (b, a, "peer"))
+            degrees[a][1] += 1
+            degrees[b][1] += 1
+        for main_asn, link_asn, relationship in views:
+            provider_asn, customer_asn, rel_type = normalize_relationship(main_asn, link_asn, relationship)
+            yield "as_relationships", (provider_asn, customer_asn, rel_type, snapshot_date)
+
+    cones = {}
+    if ppdc_path:
+        for asn, cone_count in iter_ppdc_ases(ppdc_path):
+            cones[asn] = cone_count
+
+    for asn in set(degrees) | set(cones):
+        cust, peer, prov = degrees.get(asn, (0, 0, 0))
+        yield "as_data", (asn, snapshot_date, cones.get(asn), cust, peer, prov)
+
+
+def load_caida_month_files(as_rel_path, ppdc_path=None, snapshot_date=None, batch_size=BULK_BATCH_SIZE):
+    """
+    Load one month of CAIDA's published relationship dataset in a single pass
+    (see iter_month_file_rows). Degrees come from the as-rel file and cone
+    sizes from the optional ppdc-ases file; without it the cones are computed
+    from the imported relationships into computed_cones, which readers use
+    when as_data has no cone size. The month's as_data fingerprints are
+    cleared so a later API ingest rewrites the rows this import touched.
+    """
+    snapshot_date = snapshot_date or snapshot_from_filename(as_rel_path)
+    print(f"[INFO] Bulk importing CAIDA dataset {as_rel_path} for {snapshot_date}")
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    writer = BulkWriter(cursor, {
+        "as_relationships": SQL_AS_REL_FILE_UPSERT,
+        "as_data": SQL_AS_DATA_FILE_UPSERT
+    }, batch_size)
+    for table, params in iter_month_file_rows(as_rel_path, ppdc_path, snapshot_date):
+        writer.add(table, params)
+
+    writer.flush()
+    conn.commit()
+    cursor.close()
+    conn.close()
+    invalidate_fingerprints(months=[snapshot_date])
+    invalidate_months([snapshot_date])
+    if not ppdc_path:
+        fill_computed_cones(snapshot_date)
+    invalidate_all()
+    snapshot_store.mark_dirty([snapshot_date])
+    for name, st in writer.stats.items():
+        print(f"[INFO] {name}: {st['rows']} rows in {st['flushes']} flushes, {st['flush_seconds']:.3f}s total")
+    return writer.stats
+
+
+if __name__ == "__main__":
+    # Usage: python etl_caida_files.py <YYYYMMDD.as-rel2.txt.bz2> [<YYYYMMDD.ppdc-ases.txt.bz2>]
+    if len(sys.argv) < 2:
+        sys.exit("usage: etl_caida_files.py <as-rel file> [<ppdc-ases file>]")
+    load_caida_month_files(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
@@ -1,19 +1,48 @@
+import time
+import json
+import hashlib
+import threading
 import requests
-import mysql.connector
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-from config import MYSQL_HOST, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DB
+import caida_cache
+import metrics
+import profiling
+import snapshot_store
+from response_cache import invalidate_asn
+from as_graph import get_graph_index
+from as_cone import invalidate_months
+from db import get_db_connection
+
+try:
+    import ijson  # optional, only needed for streaming mode
+except ImportError:
+    ijson = None
 
 # CAIDA GraphQL API endpoint
 CAIDA_API_URL = "https://api.asrank.caida.org/v2/graphql"
+CAIDA_TIMEOUT = 30
+# Serve historical (asn, month) responses from the on-disk cache in caida_cache.
+RESPONSE_CACHE_ENABLED = True
+# CAIDA publishes a month's snapshot some time after it ends; an empty answer
+# for a month this recent may just mean "not published yet" and is not cached.
+CAIDA_PUBLICATION_LAG_MONTHS = 2
+# Response-size budget for multi-ASN queries before the batch is split.
+CAIDA_MAX_RESPONSE_BYTES = 64 * 1024 * 1024
 
-def get_db_connection():
-    return mysql.connector.connect(
-        host=MYSQL_HOST,
-        user=MYSQL_USER,
-        password=MYSQL_PASSWORD,
-        database=MYSQL_DB
-    )
+# One keep-alive HTTP session per thread (requests.Session is not thread-safe).
+_http = threading.local()
+
+def get_http_session():
+    session = getattr(_http, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update({
+            "Content-Type": "application/json",
+            "Accept-Encoding": "gzip"
+        })
+        _http.session = session
+    return session
 
 def normalize_date_to_month(date_str):
     """
@@ -22,9 +51,39 @@ def normalize_date_to_month(date_str):
     dt = datetime.strptime(date_str, "%Y-%m-%d")
     return dt.replace(day=1).strftime("%Y-%m-%d")
 
-def fetch_caida_data(asn, date_start, date_end):
+# Number of asnLinks edges requested per page in paged mode.
+LINK_PAGE_SIZE = 500
+
+_ASN_FIELDS = """
+                    country {
+                      iso
+                      name
+                      capital
+                      population
+                      continent
+                    }
+                    organization {
+                      orgName
+                    }
+                    asn
+                    asnName
+                    rank
+                    cone {
+                      numberAsns
+                      numberPrefixes
+                      numberAddresses
+                    }
+                    asnDegree {
+                      customer
+                      peer
+                      transit
+                      provider
+                    }
+"""
+
+def build_asns_query(asns, date_start, date_end, link_first=None, link_offset=0, links_only=False):
     """
-    Uses an expanded GraphQL query to retrieve:
+    Build the expanded asns(...) GraphQL query for one or more ASNs, retrieving:
       - asn, asnName, rank, date
       - country { iso, name, capital, population, continent }
       - organization { orgName }
@@ -32,67 +91,32 @@ def fetch_caida_data(asn, date_start, date_end):
       - cone { numberAsns, numberPrefixes, numberAddresses }
       - asnLinks { edges { node { ... asn1 { ... } } } }
         including orgName, country, rank, cone, asnDegree for asn1
+    With link_first set, asnLinks is limited to one page (first/offset) and
+    reports pageInfo; links_only drops the main node fields for follow-up pages.
     """
-    query_text = f"""
+    asn_list = ", ".join(f'"{a}"' for a in asns)
+    node_fields = "asn" if links_only else _ASN_FIELDS
+    if link_first:
+        link_args = f"(first:{int(link_first)}, offset:{int(link_offset)})"
+        page_info = "pageInfo { hasNextPage }"
+    else:
+        link_args = ""
+        page_info = ""
+    return f"""
     {{
-      asns(asns:["{asn}"], dateStart:"{date_start}", dateEnd:"{date_end}") {{
+      asns(asns:[{asn_list}], dateStart:"{date_start}", dateEnd:"{date_end}") {{
         edges {{
           node {{
-            asn
-            asnName
-            rank
             date
-            country {{
-              iso
-              name
-              capital
-              population
-              continent
-            }}
-            organization {{
-              orgName
-            }}
-            asnDegree {{
-              customer
-              peer
-              transit
-              provider
-            }}
-            cone {{
-              numberAsns
-              numberPrefixes
-              numberAddresses
-            }}
-            asnLinks {{
+            {node_fields}
+            asnLinks{link_args} {{
+              {page_info}
               edges {{
                 node {{
                   numberPaths
                   relationship
                   asn1 {{
-                    country {{
-                      iso
-                      name
-                      capital
-                      population
-                      continent
-                    }}
-                    organization {{
-                      orgName
-                    }}
-                    asn
-                    asnName
-                    rank
-                    cone {{
-                      numberAsns
-                      numberPrefixes
-                      numberAddresses
-                    }}
-                    asnDegree {{
-                      customer
-                      peer
-                      transit
-                      provider
-                    }}
+                    {_ASN_FIELDS}
                   }}
                 }}
               }}
@@ -103,262 +127,711 @@ def fetch_caida_data(asn, date_start, date_end):
     }}
     """
 
-    headers = {
-        "Content-Type": "application/json",
-        "Accept-Encoding": "gzip"
-    }
-    resp = requests.post(
+@metrics.timer("caida_fetch_seconds", call="asns")
+def fetch_caida_data(asn, date_start, date_end):
+    """
+    Fetch the expanded CAIDA record (see build_asns_query) for a single ASN.
+    """
+    query_text = build_asns_query([asn], date_start, date_end)
+    resp = get_http_session().post(
         CAIDA_API_URL,
         json={"query": query_text},
-        headers=headers,
-        timeout=30
+        timeout=CAIDA_TIMEOUT
     )
     resp.raise_for_status()
     return resp.json()
 
-def load_caida_data(asn, date_start, date_end):
+
+def _months_between(date_start, date_end):
+    month = datetime.strptime(normalize_date_to_month(date_start), "%Y-%m-%d")
+    last = datetime.strptime(normalize_date_to_month(date_end), "%Y-%m-%d")
+    months = []
+    while month <= last:
+        months.append(month.strftime("%Y-%m-%d"))
+        month += relativedelta(months=1)
+    return months
+
+
+def _cache_months():
+    now = datetime.now().replace(day=1)
+    current_month = now.strftime("%Y-%m-%d")
+    settled_month = (now - relativedelta(months=CAIDA_PUBLICATION_LAG_MONTHS)).strftime("%Y-%m-%d")
+    return current_month, settled_month
+
+
+def _cached_months(asn, date_start, date_end):
+    """
+    Split [date_start, date_end] for asn into ({month: cached edges}, missing
+    months) and the (start, end) span to fetch, or None when nothing is missing.
+    """
+    current_month, settled_month = _cache_months()
+    by_month = {}
+    missing = []
+    for month in _months_between(date_start, date_end):
+        cached = caida_cache.get(asn, month) if month < current_month else None
+        if cached is None or (not cached and month >= settled_month):
+            missing.append(month)
+        else:
+            by_month[month] = cached
+    if not missing:
+        return by_month, missing, None
+    month_end = datetime.strptime(missing[-1], "%Y-%m-%d") + relativedelta(months=1, days=-1)
+    span = (max(missing[0], date_start), min(month_end.strftime("%Y-%m-%d"), date_end))
+    return by_month, missing, span
+
+
+def _store_fetched(asn, by_month, missing, fetch_start, edges):
+    """
+    Bucket freshly fetched edges by month into by_month and write the
+    historical ones back to the cache. Empty months within
+    CAIDA_PUBLICATION_LAG_MONTHS are not cached, as they may not be published yet.
+    """
+    current_month, settled_month = _cache_months()
+    fetched = {month: [] for month in missing}
+    for edge in edges:
+        month = normalize_date_to_month(edge.get("node", {}).get("date", fetch_start))
+        fetched.setdefault(month, []).append(edge)
+    for month in missing:
+        if month < current_month and (fetched[month] or month < settled_month):
+            caida_cache.put(asn, month, fetched[month])
+    for month, month_edges in fetched.items():
+        by_month.setdefault(month, month_edges)
+    return [edge for month in sorted(by_month) for edge in by_month[month]]
+
+
+def fetch_caida_data_cached(asn, date_start, date_end):
+    """
+    Same result shape as fetch_caida_data, but historical months are read from
+    the on-disk cache. Only the span covering uncached months (and the current
+    month, which may still change) is requested from CAIDA, and the historical
+    months of that response are written back to the cache.
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return fetch_caida_data(asn, date_start, date_end)
+    by_month, missing, span = _cached_months(asn, date_start, date_end)
+    fetched = []
+    if span:
+        months = len(by_month) + len(missing)
+        print(f"[INFO] CAIDA cache: {len(by_month)}/{months} months cached for ASN {asn}, "
+              f"fetching {span[0]} to {span[1]}")
+        data = fetch_caida_data(asn, *span)
+        fetched = data.get("data", {}).get("asns", {}).get("edges", [])
+    edges = _store_fetched(asn, by_month, missing, span[0] if span else date_start, fetched)
+    return {"data": {"asns": {"edges": edges}}}
+
+
+class ResponseTooLarge(Exception):
+    pass
+
+
+@metrics.timer("caida_fetch_seconds", call="batch")
+def _post_with_budget(query_text, max_bytes):
+    """
+    POST a query, aborting the download once the body exceeds max_bytes.
+    """
+    resp = get_http_session().post(
+        CAIDA_API_URL,
+        json={"query": query_text},
+        timeout=CAIDA_TIMEOUT,
+        stream=True
+    )
+    try:
+        resp.raise_for_status()
+        chunks = []
+        total = 0
+        try:
+            for chunk in resp.iter_content(chunk_size=65536):
+                total += len(chunk)
+                if max_bytes and total > max_bytes:
+                    raise ResponseTooLarge(f"response exceeded {max_bytes} bytes")
+                chunks.append(chunk)
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+            # With stream=True a read timeout while downloading the body comes
+            # out of iter_content as a ConnectionError; report it as a timeout
+            # so fetch_caida_batch splits the batch.
+            raise requests.exceptions.ReadTimeout(
+                f"CAIDA response body read failed after {total} bytes: {e}") from e
+    finally:
+        resp.close()
+    return json.loads(b"".join(chunks))
+
+
+def fetch_caida_batch(asns, date_start, date_end, max_bytes=CAIDA_MAX_RESPONSE_BYTES):
+    """
+    Fetch several ASNs with a single asns(asns:[...]) query.
+    A batch that times out or exceeds max_bytes is split in half and retried;
+    a single ASN that still fails raises.
+    Returns {asn: [edges]} with every requested ASN present (possibly empty).
+    """
+    asns = [str(a) for a in asns]
+    try:
+        data = _post_with_budget(build_asns_query(asns, date_start, date_end), max_bytes)
+    except (requests.exceptions.Timeout, ResponseTooLarge) as e:
+        if len(asns) == 1:
+            raise
+        mid = len(asns) // 2
+        print(f"[WARN] Splitting CAIDA batch of {len(asns)} ASNs ({e})")
+        routed = fetch_caida_batch(asns[:mid], date_start, date_end, max_bytes)
+        routed.update(fetch_caida_batch(asns[mid:], date_start, date_end, max_bytes))
+        return routed
+
+    routed = {a: [] for a in asns}
+    for edge in data.get("data", {}).get("asns", {}).get("edges", []):
+        node_asn = str(edge.get("node", {}).get("asn"))
+        routed.setdefault(node_asn, []).append(edge)
+    return routed
+
+
+def fetch_caida_batch_cached(asns, date_start, date_end, max_bytes=CAIDA_MAX_RESPONSE_BYTES):
+    """
+    fetch_caida_batch backed by the on-disk month cache: each ASN's cached
+    months are read locally, ASNs whose uncached span is the same are fetched
+    together, and the historical months fetched are written back.
+    Returns {asn: [edges]} like fetch_caida_batch.
+    """
+    asns = [str(a) for a in asns]
+    if not RESPONSE_CACHE_ENABLED:
+        return fetch_caida_batch(asns, date_start, date_end, max_bytes)
+    plans = {asn: _cached_months(asn, date_start, date_end) for asn in asns}
+    by_span = {}
+    for asn, (_, _, span) in plans.items():
+        if span:
+            by_span.setdefault(span, []).append(asn)
+    print(f"[INFO] CAIDA cache: {len(asns) - sum(map(len, by_span.values()))}/{len(asns)} "
+          f"ASNs fully cached, {len(by_span)} batch request(s) needed")
+    fetched = {}
+    for (fetch_start, fetch_end), members in by_span.items():
+        fetched.update(fetch_caida_batch(members, fetch_start, fetch_end, max_bytes))
+    routed = {}
+    for asn, (by_month, missing, span) in plans.items():
+        routed[asn] = _store_fetched(asn, by_month, missing, span[0] if span else date_start,
+                                     fetched.get(asn, []))
+    return routed
+
+
+def iter_caida_link_pages(asn, date_start, date_end, page_size=LINK_PAGE_SIZE):
+    """
+    Yield (nodes, include_main) pages for one ASN, requesting at most page_size
+    asnLinks edges per month per request. The first page carries the main node
+    fields; later pages only carry asn, date and the next slice of links.
+    CAIDA pages asnLinks with first/offset, so the offset is the cursor.
+    """
+    offset = 0
+    while True:
+        query_text = build_asns_query([asn], date_start, date_end,
+                                      link_first=page_size, link_offset=offset,
+                                      links_only=offset > 0)
+        with metrics.timer("caida_fetch_seconds", call="links"):
+            resp = get_http_session().post(
+                CAIDA_API_URL,
+                json={"query": query_text},
+                timeout=CAIDA_TIMEOUT
+            )
+            resp.raise_for_status()
+            nodes = resp.json().get("data", {}).get("asns", {}).get("edges", [])
+        del resp
+        if not nodes:
+            return
+        yield nodes, offset == 0
+        has_next = any(
+            ((edge.get("node", {}).get("asnLinks") or {}).get("pageInfo") or {}).get("hasNextPage")
+            for edge in nodes
+        )
+        if not has_next:
+            return
+        offset += page_size
+
+# SQL for inserting as_data with new fields
+SQL_AS_DATA_UPSERT = """
+INSERT INTO as_data (
+    asn,
+    snapshot_date,
+    asn_name,
+    org_name,
+    country_iso,
+    country_name,
+    country_capital,
+    country_population,
+    country_continent,
+    as_rank,
+    cone_asn_count,
+    cone_prefix_count,
+    cone_address_count,
+    customer_degree,
+    peer_degree,
+    transit_degree,
+    provider_degree,
+    last_update
+)
+VALUES (
+    %(asn)s,
+    %(snapshot_date)s,
+    %(asn_name)s,
+    %(org_name)s,
+    %(country_iso)s,
+    %(country_name)s,
+    %(country_capital)s,
+    %(country_population)s,
+    %(country_continent)s,
+    %(as_rank)s,
+    %(cone_asn_count)s,
+    %(cone_prefix_count)s,
+    %(cone_address_count)s,
+    %(cust_deg)s,
+    %(peer_deg)s,
+    %(trans_deg)s,
+    %(provider_deg)s,
+    NOW()
+)
+ON DUPLICATE KEY UPDATE
+    asn_name = VALUES(asn_name),
+    org_name = VALUES(org_name),
+    country_iso = VALUES(country_iso),
+    country_name = VALUES(country_name),
+    country_capital = VALUES(country_capital),
+    country_population = VALUES(country_population),
+    country_continent = VALUES(country_continent),
+    as_rank = VALUES(as_rank),
+    cone_asn_count = VALUES(cone_asn_count),
+    cone_prefix_count = VALUES(cone_prefix_count),
+    cone_address_count = VALUES(cone_address_count),
+    customer_degree = VALUES(customer_degree),
+    peer_degree = VALUES(peer_degree),
+    transit_degree = VALUES(transit_degree),
+    provider_degree = VALUES(provider_degree),
+    last_update = NOW()
+"""
+
+# SQL for inserting as_relationships
+SQL_AS_REL_UPSERT = """
+INSERT INTO as_relationships (
+    provider_asn,
+    customer_asn,
+    relationship_type,
+    snapshot_date,
+    path_count,
+    last_update
+)
+VALUES (
+    %s, %s, %s, %s, %s, NOW()
+)
+ON DUPLICATE KEY UPDATE
+    relationship_type = VALUES(relationship_type),
+    path_count = VALUES(path_count),
+    last_update = NOW()
+"""
+
+SQL_FINGERPRINT_UPSERT = """
+INSERT INTO as_data_fingerprints (asn, snapshot_date, fingerprint, last_update)
+VALUES (%s, %s, %s, NOW())
+ON DUPLICATE KEY UPDATE
+    fingerprint = VALUES(fingerprint),
+    last_update = NOW()
+"""
+
+# Number of rows buffered per statement before a multi-row flush.
+BULK_BATCH_SIZE = 1000
+
+# Fingerprints of as_data payloads already written, keyed by (asn, snapshot_date).
+# When PERSIST_FINGERPRINTS is set they are also kept in as_data_fingerprints so
+# unchanged rows are skipped across process restarts.
+PERSIST_FINGERPRINTS = False
+FINGERPRINT_CACHE_MAX = 500000
+_fingerprint_cache = {}
+_fingerprint_months_loaded = set()
+
+
+class BulkWriter:
+    """
+    Buffers rows per named statement and flushes them with cursor.executemany,
+    which mysql.connector rewrites into a single multi-row INSERT.
+    Keeps row counts and flush timings per statement so the batch size can be tuned.
+    """
+
+    def __init__(self, cursor, statements, batch_size=BULK_BATCH_SIZE):
+        self.cursor = cursor
+        self.statements = statements
+        self.batch_size = max(1, int(batch_size))
+        self.buffers = {name: [] for name in statements}
+        self.stats = {
+            name: {"rows": 0, "skipped": 0, "flushes": 0, "flush_seconds": 0.0, "max_flush_seconds": 0.0}
+            for name in statements
+        }
+
+    def add(self, name, params):
+        buf = self.buffers[name]
+        buf.append(params)
+        if len(buf) >= self.batch_size:
+            self.flush(name)
+
+    def skip(self, name):
+        self.stats[name]["skipped"] += 1
+
+    def flush(self, name=None):
+        names = [name] if name else list(self.buffers)
+        for n in names:
+            buf = self.buffers[n]
+            if not buf:
+                continue
+            started = time.perf_counter()
+            self.cursor.executemany(self.statements[n], buf)
+            elapsed = time.perf_counter() - started
+            st = self.stats[n]
+            st["rows"] += len(buf)
+            st["flushes"] += 1
+            st["flush_seconds"] += elapsed
+            st["max_flush_seconds"] = max(st["max_flush_seconds"], elapsed)
+            self.buffers[n] = []
+
+
+def as_data_params(obj, snapshot_date):
+    """
+    Map a CAIDA asn object (main node or asn1 of a link) to as_data upsert params.
+    """
+    org_obj = obj.get("organization") or {}
+    country_obj = obj.get("country") or {}
+    deg_obj = obj.get("asnDegree") or {}
+    cone_obj = obj.get("cone") or {}
+    return {
+        "asn": obj.get("asn"),
+        "snapshot_date": snapshot_date,
+        "asn_name": obj.get("asnName"),
+        "org_name": org_obj.get("orgName"),
+        "country_iso": country_obj.get("iso"),
+        "country_name": country_obj.get("name"),
+        "country_capital": country_obj.get("capital"),
+        "country_population": country_obj.get("population"),
+        "country_continent": country_obj.get("continent"),
+        "as_rank": obj.get("rank"),
+        "cone_asn_count": cone_obj.get("numberAsns"),
+        "cone_prefix_count": cone_obj.get("numberPrefixes"),
+        "cone_address_count": cone_obj.get("numberAddresses"),
+        "cust_deg": deg_obj.get("customer"),
+        "peer_deg": deg_obj.get("peer"),
+        "trans_deg": deg_obj.get("transit"),
+        "provider_deg": deg_obj.get("provider")
+    }
+
+
+def as_data_fingerprint(params):
+    """
+    Stable digest of an as_data payload, used to detect unchanged rows.
+    """
+    payload = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _load_persisted_fingerprints(cursor, snapshot_date):
+    """
+    Pull stored fingerprints for one snapshot month into the in-process cache.
+    """
+    if snapshot_date in _fingerprint_months_loaded:
+        return
+    cursor.execute(
+        "SELECT asn, fingerprint FROM as_data_fingerprints WHERE snapshot_date = %s",
+        (snapshot_date,)
+    )
+    for row_asn, fingerprint in cursor.fetchall():
+        _fingerprint_cache[(str(row_asn), snapshot_date)] = fingerprint
+    _fingerprint_months_loaded.add(snapshot_date)
+
+
+def _write_as_data(writer, params, pending):
+    """
+    Queue an as_data upsert unless the same payload is already stored.
+    pending collects fingerprints that only enter the cache once committed.
+    """
+    key = (str(params["asn"]), params["snapshot_date"])
+    fingerprint = as_data_fingerprint(params)
+    if pending.get(key, _fingerprint_cache.get(key)) == fingerprint:
+        writer.skip("as_data")
+        return
+    writer.add("as_data", params)
+    if PERSIST_FINGERPRINTS:
+        writer.add("as_data_fingerprints", (key[0], key[1], fingerprint))
+    pending[key] = fingerprint
+
+
+def _commit_fingerprints(pending):
+    if len(_fingerprint_cache) + len(pending) > FINGERPRINT_CACHE_MAX:
+        _fingerprint_cache.clear()
+        _fingerprint_months_loaded.clear()
+    _fingerprint_cache.update(pending)
+
+
+def invalidate_fingerprints(asns=None, months=None):
+    """
+    Forget stored as_data fingerprints so the next ingest rewrites those rows.
+    Anything that writes as_data outside ingest_caida_pages must call this,
+    otherwise an unchanged CAIDA payload is skipped and its values lost.
+    With no arguments everything is cleared; otherwise only rows matching the
+    given ASNs and/or snapshot months.
+    """
+    if asns is not None:
+        asns = {str(a) for a in asns}
+        if not asns:
+            return
+    if months is not None:
+        months = {normalize_date_to_month(str(m)[:10]) for m in months}
+        if not months:
+            return
+    if asns is None and months is None:
+        _fingerprint_cache.clear()
+        _fingerprint_months_loaded.clear()
+    else:
+        for key in list(_fingerprint_cache):
+            if (asns is None or key[0] in asns) and (months is None or key[1] in months):
+                _fingerprint_cache.pop(key, None)
+
+    clauses = []
+    params = []
+    if asns is not None:
+        clauses.append(f"asn IN ({', '.join(['%s'] * len(asns))})")
+        params.extend(sorted(asns))
+    if months is not None:
+        clauses.append(f"snapshot_date IN ({', '.join(['%s'] * len(months))})")
+        params.extend(sorted(months))
+    sql = "DELETE FROM as_data_fingerprints"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def normalize_relationship(main_asn, link_asn, relationship):
+    """
+    Orient a CAIDA link as (provider_asn, customer_asn, relationship_type).
+    """
+    if relationship == 'provider':
+        return link_asn, main_asn, 'provider'
+    elif relationship == 'customer':
+        # In this case, the main node is the provider and asn1 is the customer.
+        return main_asn, link_asn, 'customer'
+    elif relationship == 'peer':
+        # For peers, we store the relationship as "peer" (or choose one direction consistently)
+        return main_asn, link_asn, 'peer'
+    return link_asn, main_asn, relationship or 'unknown'
+
+
+_STREAM_NODE = "data.asns.edges.item.node"
+_STREAM_LINKS = _STREAM_NODE + ".asnLinks"
+_STREAM_LINK_ITEM = _STREAM_LINKS + ".edges.item"
+
+
+def iter_caida_stream_pages(fileobj):
+    """
+    Incrementally parse a CAIDA asns response from a file-like object and yield
+    (nodes, include_main) pages holding a single main node or a single link edge,
+    so memory tracks one edge rather than the whole response.
+    Relies on the query listing asnLinks after the main node fields.
+    """
+    if ijson is None:
+        raise ImportError("streaming mode requires the ijson package")
+    node_builder = None
+    link_builder = None
+    main = None
+    for prefix, event, value in ijson.parse(fileobj):
+        if link_builder is not None:
+            if prefix == _STREAM_LINK_ITEM and event == "end_map":
+                link_node = {"asn": main.get("asn"), "date": main.get("date"),
+                             "asnLinks": {"edges": [link_builder.value]}}
+                yield [{"node": link_node}], False
+                link_builder = None
+            else:
+                link_builder.event(event, value)
+            continue
+        if prefix == _STREAM_LINK_ITEM and event == "start_map":
+            link_builder = ijson.ObjectBuilder()
+            link_builder.event(event, value)
+            continue
+        if prefix == _STREAM_NODE and event == "start_map":
+            node_builder = ijson.ObjectBuilder()
+            node_builder.event(event, value)
+            main = None
+            continue
+        if node_builder is None:
+            continue
+        if prefix == _STREAM_NODE and event == "map_key" and value == "asnLinks":
+            main = node_builder.value
+            yield [{"node": main}], True
+            continue
+        if prefix == _STREAM_NODE and event == "end_map":
+            if main is None:
+                yield [{"node": node_builder.value}], True
+            node_builder = None
+            continue
+        if prefix == _STREAM_LINKS or prefix.startswith(_STREAM_LINKS + "."):
+            continue
+        node_builder.event(event, value)
+
+
+def iter_caida_stream(asn, date_start, date_end):
+    """
+    POST the expanded query with stream=True and parse the body as it arrives.
+    """
+    # Times the request up to the response headers; the body is parsed lazily.
+    with metrics.timer("caida_fetch_seconds", call="stream"):
+        resp = get_http_session().post(
+            CAIDA_API_URL,
+            json={"query": build_asns_query([asn], date_start, date_end)},
+            timeout=CAIDA_TIMEOUT,
+            stream=True
+        )
+    try:
+        resp.raise_for_status()
+        resp.raw.decode_content = True
+        yield from iter_caida_stream_pages(resp.raw)
+    finally:
+        resp.close()
+
+
+def load_caida_data(asn, date_start, date_end, batch_size=BULK_BATCH_SIZE, page_size=None, stream=False):
     """
     Load CAIDA data for the given ASN between date_start and date_end,
     storing expanded fields (org_name, country, etc.) into as_data.
     Also inserts link nodes (asn1) into as_data, so we have org/country info
     for potential lost customers as well.
+
+    Rows are buffered and written with multi-row upserts of batch_size rows.
+    as_data rows whose fingerprint matches what was already stored are skipped.
+    With page_size set, asnLinks are fetched page_size edges at a time and each
+    page is ingested before the next is requested, bounding peak memory.
+    With stream=True the response body is parsed incrementally (needs ijson).
+    The default path reads historical months from the on-disk response cache;
+    the paged and streamed paths are deliberately uncached, since caching
+    would mean holding each month's edges in memory, which they exist to avoid.
+    Returns the BulkWriter stats (row counts and flush timings per table).
     """
     print(f"[INFO] Loading CAIDA data for ASN {asn} from {date_start} to {date_end}")
-    data = fetch_caida_data(asn, date_start, date_end)
+    if stream:
+        return ingest_caida_pages(asn, iter_caida_stream(asn, date_start, date_end),
+                                  date_start, date_end, batch_size)
+    if page_size:
+        return ingest_caida_pages(asn, iter_caida_link_pages(asn, date_start, date_end, page_size),
+                                  date_start, date_end, batch_size)
+    data = fetch_caida_data_cached(asn, date_start, date_end)
     nodes = data.get("data", {}).get("asns", {}).get("edges", [])
     if not nodes:
         print(f"[WARN] No data returned for ASN {asn} between {date_start} and {date_end}")
         return
+    return ingest_caida_nodes(asn, nodes, date_start, date_end, batch_size)
+
+
+def ingest_caida_nodes(asn, nodes, date_start, date_end, batch_size=BULK_BATCH_SIZE):
+    """
+    Write already-fetched CAIDA asns edges to as_data and as_relationships.
+    Split from load_caida_data so fetching and DB writes can run on separate threads.
+    """
+    return ingest_caida_pages(asn, [(nodes, True)], date_start, date_end, batch_size)
+
 
+def ingest_caida_pages(asn, pages, date_start, date_end, batch_size=BULK_BATCH_SIZE):
+    """
+    Write an iterable of (nodes, include_main) pages over one connection.
+    include_main is False for link-only pages, whose nodes lack the main fields.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
+    writer = BulkWriter(cursor, {
+        "as_data": SQL_AS_DATA_UPSERT,
+        "as_relationships": SQL_AS_REL_UPSERT,
+        "as_data_fingerprints": SQL_FINGERPRINT_UPSERT
+    }, batch_size)
+    pending = {}
+    pages_seen = 0
+    months_written = set()
+    asns_written = {str(asn)}
 
-    # SQL for inserting as_data with new fields
-    sql_as_data_insert = """
-    INSERT INTO as_data (
-        asn,
-        snapshot_date,
-        asn_name,
-        org_name,
-        country_iso,
-        country_name,
-        country_capital,
-        country_population,
-        country_continent,
-        as_rank,
-        cone_asn_count,
-        cone_prefix_count,
-        cone_address_count,
-        customer_degree,
-        peer_degree,
-        transit_degree,
-        provider_degree,
-        last_update
-    )
-    VALUES (
-        %(asn)s,
-        %(snapshot_date)s,
-        %(asn_name)s,
-        %(org_name)s,
-        %(country_iso)s,
-        %(country_name)s,
-        %(country_capital)s,
-        %(country_population)s,
-        %(country_continent)s,
-        %(as_rank)s,
-        %(cone_asn_count)s,
-        %(cone_prefix_count)s,
-        %(cone_address_count)s,
-        %(cust_deg)s,
-        %(peer_deg)s,
-        %(trans_deg)s,
-        %(provider_deg)s,
-        NOW()
-    )
-    ON DUPLICATE KEY UPDATE
-        asn_name = VALUES(asn_name),
-        org_name = VALUES(org_name),
-        country_iso = VALUES(country_iso),
-        country_name = VALUES(country_name),
-        country_capital = VALUES(country_capital),
-        country_population = VALUES(country_population),
-        country_continent = VALUES(country_continent),
-        as_rank = VALUES(as_rank),
-        cone_asn_count = VALUES(cone_asn_count),
-        cone_prefix_count = VALUES(cone_prefix_count),
-        cone_address_count = VALUES(cone_address_count),
-        customer_degree = VALUES(customer_degree),
-        peer_degree = VALUES(peer_degree),
-        transit_degree = VALUES(transit_degree),
-        provider_degree = VALUES(provider_degree),
-        last_update = NOW()
-    """
-
-    # SQL for inserting as_relationships
-    sql_as_rel = """
-    INSERT INTO as_relationships (
-        provider_asn,
-        customer_asn,
-        relationship_type,
-        snapshot_date,
-        path_count,
-        last_update
-    )
-    VALUES (
-        %s, %s, %s, %s, %s, NOW()
-    )
-    ON DUPLICATE KEY UPDATE
-        relationship_type = VALUES(relationship_type),
-        path_count = VALUES(path_count),
-        last_update = NOW()
-    """
-
-    for edge in nodes:
-        node = edge.get("node", {})
-        # Convert the node's date to first-of-month
-        snapshot_date = normalize_date_to_month(node.get("date", date_start))
-
-        # Extract main node fields
-        main_asn = node.get("asn")
-        main_asnName = node.get("asnName")
-        main_rank = node.get("rank")
-        org_obj = node.get("organization") or {}
-        main_org = org_obj.get("orgName")
-
-        country_obj = node.get("country") or {}
-        country_iso = country_obj.get("iso")
-        country_name = country_obj.get("name")
-        country_capital = country_obj.get("capital")
-        country_population = country_obj.get("population")
-        country_continent = country_obj.get("continent")
-
-        deg_obj = node.get("asnDegree") or {}
-        cust_deg = deg_obj.get("customer")
-        peer_deg = deg_obj.get("peer")
-        trans_deg = deg_obj.get("transit")
-        provider_deg = deg_obj.get("provider")
-
-        cone_obj = node.get("cone") or {}
-        cone_asn_count = cone_obj.get("numberAsns")
-        cone_prefix_count = cone_obj.get("numberPrefixes")
-        cone_address_count = cone_obj.get("numberAddresses")
-
-        # Insert the main node into as_data
-        params_main = {
-            "asn": main_asn,
-            "snapshot_date": snapshot_date,
-            "asn_name": main_asnName,
-            "org_name": main_org,
-            "country_iso": country_iso,
-            "country_name": country_name,
-            "country_capital": country_capital,
-            "country_population": country_population,
-            "country_continent": country_continent,
-            "as_rank": main_rank,
-            "cone_asn_count": cone_asn_count,
-            "cone_prefix_count": cone_prefix_count,
-            "cone_address_count": cone_address_count,
-            "cust_deg": cust_deg,
-            "peer_deg": peer_deg,
-            "trans_deg": trans_deg,
-            "provider_deg": provider_deg
-        }
-        cursor.execute(sql_as_data_insert, params_main)
-
-        # Insert relationships for link nodes
-        links = node.get("asnLinks", {}).get("edges", [])
-        for link_edge in links:
-            link_node = link_edge.get("node", {})
-            relationship = link_node.get("relationship")
-            number_paths = link_node.get("numberPaths")
-            asn1 = link_node.get("asn1", {})
-            link_asn = asn1.get("asn")
-
-            # Insert the link node's as_data
-            link_org_obj = asn1.get("organization") or {}
-            link_org = link_org_obj.get("orgName")
-
-            link_country_obj = asn1.get("country") or {}
-            link_iso = link_country_obj.get("iso")
-            link_cname = link_country_obj.get("name")
-            link_ccap = link_country_obj.get("capital")
-            link_cpop = link_country_obj.get("population")
-            link_ccont = link_country_obj.get("continent")
-
-            link_deg = asn1.get("asnDegree") or {}
-            link_cust_deg = link_deg.get("customer")
-            link_peer_deg = link_deg.get("peer")
-            link_trans_deg = link_deg.get("transit")
-            link_provider_deg = link_deg.get("provider")
-
-            link_cone = asn1.get("cone") or {}
-            link_cone_asn_count = link_cone.get("numberAsns")
-            link_cone_prefix_count = link_cone.get("numberPrefixes")
-            link_cone_address_count = link_cone.get("numberAddresses")
-
-            link_rank = asn1.get("rank")
-            link_asnName = asn1.get("asnName")
-
-            params_link = {
-                "asn": link_asn,
-                "snapshot_date": snapshot_date,
-                "asn_name": link_asnName,
-                "org_name": link_org,
-                "country_iso": link_iso,
-                "country_name": link_cname,
-                "country_capital": link_ccap,
-                "country_population": link_cpop,
-                "country_continent": link_ccont,
-                "as_rank": link_rank,
-                "cone_asn_count": link_cone_asn_count,
-                "cone_prefix_count": link_cone_prefix_count,
-                "cone_address_count": link_cone_address_count,
-                "cust_deg": link_cust_deg,
-                "peer_deg": link_peer_deg,
-                "trans_deg": link_trans_deg,
-                "provider_deg": link_provider_deg
-            }
-            cursor.execute(sql_as_data_insert, params_link)
-            if relationship == 'provider':
-               final_provider_asn = link_asn
-               final_customer_asn = main_asn
-               final_rel_type = 'provider'
-            elif relationship == 'customer':
-              # In this case, the main node is the provider and asn1 is the customer.
-              final_provider_asn = main_asn
-              final_customer_asn = link_asn
-              final_rel_type = 'customer'
-            elif relationship == 'peer':
-               # For peers, we store the relationship as "peer" (or choose one direction consistently)
-                final_provider_asn = main_asn
-                final_customer_asn = link_asn
-                final_rel_type = 'peer'
-            else:
-               final_provider_asn = link_asn
-               final_customer_asn = main_asn
-               final_rel_type = relationship or 'unknown'
-
-
-            # Insert the relationship into as_relationships
-            rel_params = (
-                final_provider_asn,
-                final_customer_asn,
-                final_rel_type,
-                snapshot_date,
-                number_paths
-            )
-            cursor.execute(sql_as_rel, rel_params)
+    for nodes, include_main in pages:
+        pages_seen += 1
+        for edge in nodes:
+            node = edge.get("node", {})
+            # Convert the node's date to first-of-month
+            snapshot_date = normalize_date_to_month(node.get("date", date_start))
+            main_asn = node.get("asn")
+            months_written.add(snapshot_date)
+            asns_written.add(str(main_asn))
+            if PERSIST_FINGERPRINTS:
+                _load_persisted_fingerprints(cursor, snapshot_date)
+
+            # Insert the main node into as_data
+            if include_main:
+                _write_as_data(writer, as_data_params(node, snapshot_date), pending)
+
+            # Insert relationships for link nodes
+            links = (node.get("asnLinks") or {}).get("edges", [])
+            for link_edge in links:
+                link_node = link_edge.get("node", {})
+                asn1 = link_node.get("asn1", {})
 
+                # Insert the link node's as_data
+                _write_as_data(writer, as_data_params(asn1, snapshot_date), pending)
+                asns_written.add(str(asn1.get("asn")))
+
+                provider_asn, customer_asn, rel_type = normalize_relationship(
+                    main_asn, asn1.get("asn"), link_node.get("relationship"))
+
+                # Insert the relationship into as_relationships
+                writer.add("as_relationships", (
+                    provider_asn,
+                    customer_asn,
+                    rel_type,
+                    snapshot_date,
+                    link_node.get("numberPaths")
+                ))
+
+    writer.flush()
     conn.commit()
     cursor.close()
     conn.close()
+    _commit_fingerprints(pending)
+    if months_written:
+        invalidate_months(months_written)
+        invalidate_responses(asns_written)
+        snapshot_store.mark_dirty(months_written)
+    if not pages_seen:
+        print(f"[WARN] No data returned for ASN {asn} between {date_start} and {date_end}")
+        return
+    for name, st in writer.stats.items():
+        print(f"[INFO] {name}: {st['rows']} rows ({st['skipped']} unchanged) in {st['flushes']} flushes, "
+              f"{st['flush_seconds']:.3f}s total (max {st['max_flush_seconds']:.3f}s, batch {writer.batch_size})")
     print(f"[INFO] CAIDA data ingestion complete for ASN {asn} from {date_start} to {date_end}")
+    return writer.stats
 
 
-def dynamic_update(asn, default_start_date="2024-01-01"):
+def invalidate_responses(asns):
     """
-    Attempts to load new monthly data from CAIDA if we have older snapshots.
-    Then calls fill_lost_customers_simple to detect newly lost customers.
+    Drop cached API responses for every ASN an ingest wrote rows for, and for
+    requestors that lost one of them: their competitor analysis reads the
+    lost ASN's provider rows and its new providers' names.
+    """
+    asns = sorted({str(a) for a in asns if a is not None})
+    affected = set(asns)
+    if asns:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        for i in range(0, len(asns), BULK_BATCH_SIZE):
+            chunk = asns[i:i + BULK_BATCH_SIZE]
+            cursor.execute(
+                f"SELECT DISTINCT requestor_asn FROM lost_customers "
+                f"WHERE lost_asn IN ({', '.join(['%s'] * len(chunk))})",
+                chunk
+            )
+            affected.update(str(r[0]) for r in cursor.fetchall())
+        cursor.close()
+        conn.close()
+    for a in affected:
+        invalidate_asn(a)
+
+
+def pending_update_range(asn, default_start_date="2024-01-01"):
+    """
+    Return (start_date, current_snapshot) still missing from as_data for asn,
+    or None when the latest snapshot is already current.
     """
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -376,12 +849,62 @@ def dynamic_update(asn, default_start_date="2024-01-01"):
 
     current_snapshot = datetime.now().replace(day=1).strftime("%Y-%m-%d")
     if start_date > current_snapshot:
+        return None
+    return start_date, current_snapshot
+
+@profiling.profiled("dynamic_update")
+def dynamic_update(asn, default_start_date="2024-01-01"):
+    """
+    Attempts to load new monthly data from CAIDA if we have older snapshots.
+    Then calls compute_lost_competitor_data to detect newly lost customers
+    and the providers they moved to. That also runs when the ASN is already
+    current, since lost customers' provider rows may have arrived since.
+    """
+    date_range = pending_update_range(asn, default_start_date)
+    if date_range is None:
         print("[INFO] No new data to update. Latest snapshot is current.")
+        compute_lost_competitor_data(asn)
         return
 
+    start_date, current_snapshot = date_range
     load_caida_data(asn, start_date, current_snapshot)
-    # Optionally call fill_lost_customers_simple(asn) here
-    fill_lost_customers_simple(asn)
+    compute_lost_competitor_data(asn)
+
+# "sql" runs fill_lost_customers_sql, "python" the original month-pair loop,
+# "graph" diffs months on the in-memory as_graph index.
+LOST_CUSTOMERS_ENGINE = "sql"
+
+def fill_lost_customers(asn, incremental=True):
+    """
+    Detect lost customers for asn with the engine selected by LOST_CUSTOMERS_ENGINE.
+    With the sql engine, incremental=True only processes month pairs newer than
+    the stored high-water mark (see fill_lost_customers_incremental).
+    """
+    if LOST_CUSTOMERS_ENGINE == "python":
+        return fill_lost_customers_simple(asn)
+    if LOST_CUSTOMERS_ENGINE == "graph":
+        return fill_lost_customers_graph(asn)
+    if incremental:
+        return fill_lost_customers_incremental(asn)
+    return fill_lost_customers_sql(asn)
+
+SQL_LOST_CUSTOMERS_UPSERT = """
+    INSERT INTO lost_customers (
+        requestor_asn,
+        snapshot_date,
+        lost_asn,
+        lost_month,
+        lost_org,
+        lost_cust_cone,
+        created_at,
+        updated_at
+    )
+    VALUES (%s, %s, %s, %s, %s, %s, NOW(), NOW())
+    ON DUPLICATE KEY UPDATE
+        lost_org = VALUES(lost_org),
+        lost_cust_cone = VALUES(lost_cust_cone),
+        updated_at=NOW()
+"""
 
 def fill_lost_customers_simple(asn):
     """
@@ -409,23 +932,7 @@ def fill_lost_customers_simple(asn):
 
     months = [row[0] for row in date_rows]
 
-    insert_sql = """
-        INSERT INTO lost_customers (
-            requestor_asn,
-            snapshot_date,
-            lost_asn,
-            lost_month,
-            lost_org,
-            lost_cust_cone,
-            created_at,
-            updated_at
-        )
-        VALUES (%s, %s, %s, %s, %s, %s, NOW(), NOW())
-        ON DUPLICATE KEY UPDATE
-            lost_org = VALUES(lost_org),
-            lost_cust_cone = VALUES(lost_cust_cone),
-            updated_at=NOW()
-    """
+    insert_sql = SQL_LOST_CUSTOMERS_UPSERT
 
     for i in range(len(months) - 1):
         m1 = months[i]   # e.g. 2024-02-01
@@ -498,9 +1005,357 @@ def fill_lost_customers_simple(asn):
     conn.close()
     print(f"[INFO] fill_lost_customers_simple completed for ASN {asn}.")
 
+def fill_lost_customers_graph(asn):
+    """
+    fill_lost_customers_simple with the month-to-month set differences taken
+    from the in-memory relationship graph, and the org/cone enrichment fetched
+    for all lost ASNs in two queries instead of per ASN.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT DISTINCT snapshot_date
+        FROM as_relationships
+        WHERE provider_asn = %s
+        ORDER BY snapshot_date
+    """, (asn,))
+    months = [row[0] for row in cursor.fetchall()]
+    if len(months) < 2:
+        print(f"[INFO] Not enough snapshots to compute lost customers for ASN {asn}.")
+        cursor.close()
+        conn.close()
+        return
+
+    index = get_graph_index()
+    events = []
+    for m1, m2 in zip(months, months[1:]):
+        lost_set = index.lost_customers(asn, m1, m2)
+        if lost_set:
+            print(f"[DEBUG] Found {len(lost_set)} lost customers going from {m1} to {m2} for ASN {asn}.")
+        events.extend((lost_asn, m1, m2) for lost_asn in lost_set)
+    if not events:
+        cursor.close()
+        conn.close()
+        print(f"[INFO] fill_lost_customers_graph completed for ASN {asn}.")
+        return
+
+    lost_asns = sorted({e[0] for e in events})
+    placeholders = ", ".join(["%s"] * len(lost_asns))
+    cursor.execute(f"""
+        SELECT asn, snapshot_date, org_name, cone_asn_count
+        FROM as_data
+        WHERE asn IN ({placeholders})
+    """, lost_asns)
+    by_month = {}
+    latest = {}
+    for row_asn, snap, org_name, cone in cursor.fetchall():
+        key = str(row_asn)
+        by_month[(key, snap)] = (org_name, cone)
+        if key not in latest or snap > latest[key][0]:
+            latest[key] = (snap, (org_name, cone))
+
+    rows = []
+    for lost_asn, m1, m2 in events:
+        found = by_month.get((lost_asn, m1))
+        if found is None and lost_asn in latest:
+            found = latest[lost_asn][1]
+        lost_org_val, lost_cone_val = found if found is not None else ("Unknown", None)
+        rows.append((asn, m1, lost_asn, m2, lost_org_val, lost_cone_val))
+
+    cursor.executemany(SQL_LOST_CUSTOMERS_UPSERT, rows)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"[INFO] fill_lost_customers_graph completed for ASN {asn} ({len(rows)} lost events).")
+
+SQL_LOST_CUSTOMERS_INSERT_SELECT = """
+    INSERT INTO lost_customers (
+        requestor_asn,
+        snapshot_date,
+        lost_asn,
+        lost_month,
+        lost_org,
+        lost_cust_cone,
+        created_at,
+        updated_at
+    )
+    SELECT
+        p.provider_asn,
+        p.m1,
+        r1.customer_asn,
+        p.m2,
+        CASE WHEN d1.asn IS NOT NULL THEN d1.org_name
+             WHEN dl.asn IS NOT NULL THEN dl.org_name
+             ELSE 'Unknown' END,
+        CASE WHEN d1.asn IS NOT NULL THEN d1.cone_asn_count
+             ELSE dl.cone_asn_count END,
+        NOW(),
+        NOW()
+    FROM (
+        SELECT %(asn)s AS provider_asn,
+               snapshot_date AS m1,
+               LEAD(snapshot_date) OVER (ORDER BY snapshot_date) AS m2
+        FROM (
+            SELECT DISTINCT snapshot_date
+            FROM as_relationships
+            WHERE provider_asn = %(asn)s
+              {month_filter}
+        ) months
+    ) p
+    JOIN as_relationships r1
+      ON r1.provider_asn = p.provider_asn
+     AND r1.snapshot_date = p.m1
+     AND r1.relationship_type = 'customer'
+    LEFT JOIN as_relationships r2
+      ON r2.provider_asn = p.provider_asn
+     AND r2.snapshot_date = p.m2
+     AND r2.customer_asn = r1.customer_asn
+     AND r2.relationship_type = 'customer'
+    LEFT JOIN as_data d1
+      ON d1.asn = r1.customer_asn
+     AND d1.snapshot_date = p.m1
+    LEFT JOIN as_data dl
+      ON dl.asn = r1.customer_asn
+     AND dl.snapshot_date = (
+            SELECT MAX(x.snapshot_date) FROM as_data x WHERE x.asn = r1.customer_asn
+         )
+    WHERE p.m2 IS NOT NULL
+      AND r2.customer_asn IS NULL
+    ON DUPLICATE KEY UPDATE
+        lost_org = VALUES(lost_org),
+        lost_cust_cone = VALUES(lost_cust_cone),
+        updated_at = NOW()
+"""
+
+SQL_LOST_PROGRESS_UPSERT = """
+    INSERT INTO lost_customers_progress (
+        requestor_asn,
+        last_month,
+        months_processed,
+        updated_at
+    )
+    VALUES (%s, %s, %s, NOW())
+    ON DUPLICATE KEY UPDATE
+        last_month = VALUES(last_month),
+        months_processed = VALUES(months_processed),
+        updated_at = NOW()
+"""
+
+def _insert_lost_customers(cursor, asn, since=None):
+    """
+    Run the INSERT ... SELECT, limited to month pairs whose first month is
+    on or after `since` when given. Returns the affected row count.
+    """
+    if since is None:
+        cursor.execute(SQL_LOST_CUSTOMERS_INSERT_SELECT.format(month_filter=""), {"asn": asn})
+    else:
+        cursor.execute(
+            SQL_LOST_CUSTOMERS_INSERT_SELECT.format(month_filter="AND snapshot_date >= %(since)s"),
+            {"asn": asn, "since": since}
+        )
+    return cursor.rowcount
+
+def fill_lost_customers_sql(asn):
+    """
+    Set-based equivalent of fill_lost_customers_simple: LEAD() pairs each
+    snapshot month with the next one, an anti-join finds customers missing from
+    the next month, and the org/cone enrichment (month m1, else latest as_data
+    row, else 'Unknown') is joined in. Everything is written by one INSERT ... SELECT.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    affected = _insert_lost_customers(cursor, asn)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"[INFO] fill_lost_customers_sql completed for ASN {asn} ({affected} rows affected).")
+
+def fill_lost_customers_incremental(asn):
+    """
+    Only diff month pairs newer than the high-water mark stored in
+    lost_customers_progress. The mark also records how many snapshot months
+    existed up to it; if that count changed, older snapshots were backfilled
+    and a full recompute runs instead.
+    Returns the month diffing started from, or None after a full recompute.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT last_month, months_processed
+        FROM lost_customers_progress
+        WHERE requestor_asn = %s
+    """, (asn,))
+    progress = cursor.fetchone()
+
+    cursor.execute("""
+        SELECT COUNT(DISTINCT snapshot_date), MAX(snapshot_date)
+        FROM as_relationships
+        WHERE provider_asn = %s
+    """, (asn,))
+    total_months, latest = cursor.fetchone()
+    if latest is None:
+        print(f"[INFO] Not enough snapshots to compute lost customers for ASN {asn}.")
+        cursor.close()
+        conn.close()
+        return
+
+    since = None
+    if progress:
+        last_month, months_processed = progress
+        cursor.execute("""
+            SELECT COUNT(DISTINCT snapshot_date)
+            FROM as_relationships
+            WHERE provider_asn = %s
+              AND snapshot_date <= %s
+        """, (asn, last_month))
+        if cursor.fetchone()[0] == months_processed:
+            since = last_month
+        else:
+            print(f"[INFO] Backfilled snapshots detected for ASN {asn}, recomputing all lost customers.")
+
+    if since is not None and latest <= since:
+        print(f"[INFO] Lost customers for ASN {asn} already processed through {since}.")
+        cursor.close()
+        conn.close()
+        return since
+
+    affected = _insert_lost_customers(cursor, asn, since)
+    cursor.execute(SQL_LOST_PROGRESS_UPSERT, (asn, latest, total_months))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    mode = "incremental" if since is not None else "full"
+    print(f"[INFO] fill_lost_customers_incremental ({mode}) completed for ASN {asn} ({affected} rows affected).")
+    return since
+
+# Months either side of a lost month searched for a new provider.
+COMPETITOR_WINDOW_MONTHS = 3
+
+SQL_COMPETITOR_GAINS_DELETE = """
+    DELETE cg
+    FROM competitor_gains cg
+    JOIN (
+        SELECT DISTINCT lost_asn, lost_month
+        FROM lost_customers
+        WHERE requestor_asn = %(asn)s
+          {month_filter}
+    ) lc
+      ON cg.lost_asn = lc.lost_asn
+     AND cg.lost_month = lc.lost_month
+    WHERE cg.window_months = %(window)s
+"""
+
+# Incremental rebuild scope: windows reaching past the lost-customer
+# high-water mark, plus windows whose lost ASN has provider rows written since
+# the gains were last built (e.g. the lost ASN itself was ingested later).
+SQL_COMPETITOR_GAINS_SINCE_FILTER = """
+    AND (lost_month > DATE_SUB(%(since)s, INTERVAL %(window)s MONTH)
+         OR EXISTS (
+             SELECT 1
+             FROM as_relationships r
+             WHERE r.customer_asn = lost_customers.lost_asn
+               AND r.relationship_type = 'provider'
+               AND r.snapshot_date >= DATE_SUB(lost_customers.lost_month, INTERVAL %(window)s MONTH)
+               AND r.snapshot_date < DATE_ADD(lost_customers.lost_month, INTERVAL %(window)s MONTH)
+               AND r.last_update >= %(built_at)s
+         ))
+"""
+
+SQL_COMPETITOR_GAINS_INSERT_SELECT = """
+    INSERT INTO competitor_gains (
+        lost_asn,
+        lost_month,
+        window_months,
+        provider_asn,
+        first_seen_month,
+        provider_name,
+        updated_at
+    )
+    SELECT
+        g.lost_asn,
+        g.lost_month,
+        %(window)s,
+        g.provider_asn,
+        g.first_seen,
+        COALESCE(d.asn_name, 'N/A'),
+        NOW()
+    FROM (
+        SELECT lc.lost_asn, lc.lost_month, r.provider_asn, MIN(r.snapshot_date) AS first_seen
+        FROM (
+            SELECT DISTINCT lost_asn, lost_month
+            FROM lost_customers
+            WHERE requestor_asn = %(asn)s
+              {month_filter}
+        ) lc
+        JOIN as_relationships r
+          ON r.customer_asn = lc.lost_asn
+         AND r.relationship_type = 'provider'
+         AND r.snapshot_date >= DATE_SUB(lc.lost_month, INTERVAL %(window)s MONTH)
+         AND r.snapshot_date < DATE_ADD(lc.lost_month, INTERVAL %(window)s MONTH)
+        GROUP BY lc.lost_asn, lc.lost_month, r.provider_asn
+        HAVING MIN(r.snapshot_date) >= lc.lost_month
+    ) g
+    LEFT JOIN as_data d
+      ON d.asn = g.provider_asn
+     AND d.snapshot_date = g.first_seen
+    ON DUPLICATE KEY UPDATE
+        first_seen_month = VALUES(first_seen_month),
+        provider_name = VALUES(provider_name),
+        updated_at = NOW()
+"""
+
+def fill_competitor_gains(asn, since=None, window_months=COMPETITOR_WINDOW_MONTHS):
+    """
+    Materialize, for every lost customer of asn, the providers it gained within
+    window_months of its lost month (first seen on or after the lost month)
+    into competitor_gains. With `since`, only windows reaching a month after
+    `since`, or whose lost ASN gained provider rows since the last build
+    (lost_customers_progress.gains_updated_at), are rebuilt; their old rows
+    are deleted first so reruns are safe. Without a recorded build time the
+    whole set is rebuilt.
+    """
+    params = {"asn": asn, "window": int(window_months)}
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT NOW()")
+    build_started = cursor.fetchone()[0]
+    built_at = None
+    if since is not None:
+        cursor.execute(
+            "SELECT gains_updated_at FROM lost_customers_progress WHERE requestor_asn = %s", (asn,))
+        row = cursor.fetchone()
+        built_at = row[0] if row else None
+    if since is None or built_at is None:
+        since = None
+        month_filter = ""
+    else:
+        month_filter = SQL_COMPETITOR_GAINS_SINCE_FILTER
+        params["since"] = since
+        params["built_at"] = built_at
+    cursor.execute(SQL_COMPETITOR_GAINS_DELETE.format(month_filter=month_filter), params)
+    cursor.execute(SQL_COMPETITOR_GAINS_INSERT_SELECT.format(month_filter=month_filter), params)
+    affected = cursor.rowcount
+    cursor.execute(
+        "UPDATE lost_customers_progress SET gains_updated_at = %s WHERE requestor_asn = %s",
+        (build_started, asn))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    scope = f"windows after {since} or with new provider rows" if since is not None else "all windows"
+    print(f"[INFO] fill_competitor_gains completed for ASN {asn} ({scope}, {affected} rows affected).")
+
+def compute_lost_competitor_data(asn, full=False):
+    """
+    Lost-customer detection followed by the competitor-gain stage.
+    full=True ignores the high-water mark and rebuilds everything.
+    """
+    since = fill_lost_customers(asn, incremental=not full)
+    fill_competitor_gains(asn, None if full else since)
+    invalidate_asn(asn)
+
 if __name__ == "__main__":
     # Example usage:
     target_asn = "7473"
     dynamic_update(target_asn, "2024-01-01")
     # This loads CAIDA data from 2024-01 to current, inserts new fields in as_data,
-    # then calls fill_lost_customers_simple to detect lost events.
+    # then calls compute_lost_competitor_data to detect lost events.
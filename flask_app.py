@@ -1,39 +1,70 @@
+import gzip
 import json
+import time
+import contextvars
 import logging
+import functools
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date
 from dateutil.relativedelta import relativedelta
 from io import BytesIO
 from flask import send_file
-from etl_lost_competitor import enrich_lost_customer_providers
-import mysql.connector
+from etl_lost_competitor import (enrich_lost_customer_providers, COMPETITOR_WINDOW_MONTHS,
+                                 invalidate_fingerprints, pending_update_range,
+                                 compute_lost_competitor_data, invalidate_responses)
 import pandas as pd
 import requests
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context
 from flask_caching import Cache
 from DynamicASNLink import update_missing_snapshots
-from config import MYSQL_HOST, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DB
-from etl_caida import load_caida_data, dynamic_update, fill_lost_customers_simple
+from db import get_db_connection, pool_stats
+from as_graph import get_graph_index
+from as_cone import invalidate_months
+import snapshot_store
+from raw_export import stream_xlsx, stream_csv_zip
+from response_cache import (flask_cache_config, cache_key, record as record_cache_lookup,
+                            cache_stats, invalidate_asn)
+from jobs import (register_job_kind, submit_job, get_job, start_job_monitor,
+                  wait_for_job, recent_job_result, JobLockTimeout)
+from etl_caida import load_caida_data, dynamic_update
 from etl_peeringdb import load_peeringdb_data
+import metrics
+import profiling
+
+load_peeringdb_data = metrics.timer("peeringdb_load_seconds")(load_peeringdb_data)
+# The app runs etl_caida's dynamic_update, not the profiled one in etl_lost_competitor.
+dynamic_update = profiling.profiled("dynamic_update")(dynamic_update)
 
 app = Flask(__name__)
-app.config['CACHE_TYPE'] = 'simple'
+app.config.update(flask_cache_config())
 cache = Cache(app)
 
+# Read competitors from the competitor_gains table maintained by the ETL
+# (both update job kinds refresh it) instead of computing provider windows
+# per request. Lost events without materialized gains are still computed.
+USE_COMPETITOR_GAINS = True
+# Let find_competitors read provider rows from the in-memory as_graph index.
+USE_GRAPH_INDEX = False
+# Serve /api/historical from the columnar snapshot store when it covers the range.
+USE_SNAPSHOT_STORE = False
+# How long "CAIDA has nothing for this ASN" is remembered before asking again.
+NEGATIVE_CACHE_TTL = 3600
+# Longest a cache-miss request may block (?wait=N) on the in-flight update.
+MAX_UPDATE_WAIT = 60
+NO_CAIDA_DATA = "No data from CAIDA"
+# Threads used by /api/dashboard to run its sections concurrently; each
+# section borrows its own pooled connection.
+DASHBOARD_WORKERS = 5
+# Bodies smaller than this are sent uncompressed.
+DASHBOARD_GZIP_MIN_BYTES = 1024
+
 logging.basicConfig(
     filename='asrank_dashboard.log',
     level=logging.DEBUG,
     format='%(asctime)s %(levelname)s: %(message)s'
 )
 
-def get_db_connection():
-    return mysql.connector.connect(
-        host=MYSQL_HOST,
-        user=MYSQL_USER,
-        password=MYSQL_PASSWORD,
-        database=MYSQL_DB
-    )
-
 def maybe_update_peeringdb(asn):
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True, buffered=True)
@@ -54,20 +85,140 @@ def maybe_update_peeringdb(asn):
             return
     try:
         load_peeringdb_data(asn)
+        invalidate_asn(asn)
     except requests.exceptions.HTTPError as e:
         if e.response.status_code == 429:
             print("[WARN] Too many requests to PeeringDB. Skipping update for now.")
         else:
             raise
 
+def cached_endpoint(asn_param):
+    """
+    Cache successful (200) responses in the shared response cache, keyed on
+    the endpoint, the ASN (path or query parameter `asn_param`) and all query
+    parameters. The ETL invalidates an ASN's entries when it writes new data.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            asn = kwargs.get(asn_param) or request.args.get(asn_param)
+            if not asn:
+                return view(*args, **kwargs)
+            key = cache_key(request.endpoint, asn, request.args)
+            try:
+                entry = cache.get(key)
+            except Exception:
+                logging.warning("Response cache read failed: %s", traceback.format_exc())
+                entry = None
+            if entry is not None:
+                record_cache_lookup(hit=True)
+                body, mimetype = entry
+                return Response(body, status=200, mimetype=mimetype)
+            response = app.make_response(view(*args, **kwargs))
+            stored = False
+            if response.status_code == 200 and not response.direct_passthrough:
+                try:
+                    cache.set(key, (response.get_data(), response.mimetype))
+                    stored = True
+                except Exception:
+                    logging.warning("Response cache write failed: %s", traceback.format_exc())
+            record_cache_lookup(hit=False, stored=stored)
+            return response
+        return wrapper
+    return decorator
+
+@app.before_request
+def _start_request_metrics():
+    request.environ["asrank.started"] = time.perf_counter()
+    request.environ["asrank.stats_token"] = metrics.current_request.set(metrics.RequestStats())
+
+@app.after_request
+def _finish_request_metrics(response):
+    started = request.environ.get("asrank.started")
+    stats = metrics.current_request.get()
+    if started is None or stats is None:
+        return response
+    endpoint = request.endpoint or "unmatched"
+    metrics.observe("http_request_seconds", time.perf_counter() - started,
+                    endpoint=endpoint, method=request.method, status=response.status_code)
+    metrics.observe("http_request_queries", stats.queries, endpoint=endpoint)
+    # Makes N+1 query patterns visible from the browser's network tab.
+    response.headers["X-Query-Count"] = str(stats.queries)
+    response.headers["X-Query-Time-Ms"] = f"{stats.sql_seconds * 1000:.1f}"
+    return response
+
+@app.teardown_request
+def _reset_request_metrics(exc):
+    token = request.environ.pop("asrank.stats_token", None)
+    if token is not None:
+        metrics.current_request.reset(token)
+
+@app.before_request
+def _start_request_profiling():
+    if profiling.PROFILE_REQUESTS or (profiling.PROFILE_QUERY_FLAG and request.args.get('profile') == '1'):
+        request.environ["asrank.profiler"] = profiling.start_profile()
+    elif profiling.slow_sampler is not None:
+        request.environ["asrank.sampled"] = profiling.slow_sampler.begin(f"{request.method} {request.path}")
+
+def _close_request_profiling(profiler, sampled, label, started):
+    if profiler is not None:
+        elapsed = time.perf_counter() - started if started is not None else None
+        profiling.save_profile(profiler, label, elapsed)
+    elif sampled:
+        profiling.slow_sampler.end()
+
+@app.after_request
+def _defer_streamed_profiling(response):
+    # Streamed bodies (e.g. /api/download_raw_data) are generated after
+    # teardown, so close their profile when the server closes the response.
+    if response.is_streamed:
+        profiler = request.environ.pop("asrank.profiler", None)
+        sampled = request.environ.pop("asrank.sampled", None)
+        if profiler is not None or sampled:
+            label = f"{request.method} {request.path}"
+            started = request.environ.get("asrank.started")
+            response.call_on_close(lambda: _close_request_profiling(profiler, sampled, label, started))
+    return response
+
+@app.teardown_request
+def _finish_request_profiling(exc):
+    _close_request_profiling(request.environ.pop("asrank.profiler", None),
+                             request.environ.pop("asrank.sampled", None),
+                             f"{request.method} {request.path}",
+                             request.environ.get("asrank.started"))
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    pool = pool_stats()
+    cache_counts = cache_stats()
+    counters = {
+        "db_pool_connections_acquired_total": ("Connections borrowed from the pool.", {(): pool["acquired"]}),
+        "db_pool_wait_seconds_total": ("Time spent waiting for a pooled connection.", {(): pool["wait_seconds"]}),
+        "db_pool_timeouts_total": ("Pool checkouts that timed out.", {(): pool["timeouts"]}),
+        "response_cache_lookups_total": ("Response cache lookups by result.", {
+            (("result", "hit"),): cache_counts["hits"],
+            (("result", "miss"),): cache_counts["misses"],
+        }),
+    }
+    return Response(metrics.render(counters=counters), mimetype="text/plain; version=0.0.4")
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
-@cache.cached(timeout=300, key_prefix=lambda: f"as_data_{request.view_args['asn']}")
+@app.route('/api/db_pool_stats', methods=['GET'])
+def db_pool_stats():
+    return jsonify(pool_stats())
+
+@app.route('/api/cache_stats', methods=['GET'])
+def response_cache_stats():
+    return jsonify(cache_stats())
+
 @app.route('/api/as/<asn>', methods=['GET'])
+@cached_endpoint('asn')
 def get_as_data(asn):
     snapshot_date = request.args.get('snapshot_date')
+    wait = min(request.args.get('wait', 0, type=float), MAX_UPDATE_WAIT)
     try:
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True, buffered=True)
@@ -81,32 +232,45 @@ def get_as_data(asn):
         cursor.close()
         conn.close()
         if not result:
-            logging.debug("No AS data found for ASN %s. Triggering dynamic update.", asn)
+            if recent_job_result("dynamic_update", asn, NO_CAIDA_DATA, NEGATIVE_CACHE_TTL):
+                return jsonify({"error": f"CAIDA has no data for ASN {asn}."}), 404
+            logging.debug("No AS data found for ASN %s. Queueing dynamic update.", asn)
             try:
-                dynamic_update(asn)
+                job_id = submit_job("dynamic_update", asn)
+            except JobLockTimeout as e:
+                logging.warning("Dynamic update for ASN %s not queued: %s", asn, e)
+                return jsonify({"error": "An update for this ASN is being queued, please retry."}), 503
             except Exception as e:
                 logging.error("Dynamic update failed for ASN %s: %s", asn, str(e))
                 return jsonify({"error": f"Dynamic update failed: {str(e)}"}), 500
-            conn = get_db_connection()
-            cursor = conn.cursor(dictionary=True, buffered=True)
-            if snapshot_date:
-                sql = "SELECT * FROM as_data WHERE asn=%s AND snapshot_date=%s"
-                cursor.execute(sql, (asn, snapshot_date))
-            else:
-                sql = "SELECT * FROM as_data WHERE asn=%s ORDER BY snapshot_date DESC LIMIT 1"
-                cursor.execute(sql, (asn,))
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
-            if not result:
-                logging.error("Data update triggered but still no data for ASN %s", asn)
-                return jsonify({"error": "Data update triggered. Please refresh."}), 404
+            if wait > 0:
+                job = wait_for_job(job_id, wait)
+                if job and job["status"] == "succeeded":
+                    if job["message"] == NO_CAIDA_DATA:
+                        return jsonify({"error": f"CAIDA has no data for ASN {asn}."}), 404
+                    conn = get_db_connection()
+                    cursor = conn.cursor(dictionary=True, buffered=True)
+                    if snapshot_date:
+                        cursor.execute("SELECT * FROM as_data WHERE asn=%s AND snapshot_date=%s", (asn, snapshot_date))
+                    else:
+                        cursor.execute("SELECT * FROM as_data WHERE asn=%s ORDER BY snapshot_date DESC LIMIT 1", (asn,))
+                    result = cursor.fetchone()
+                    cursor.close()
+                    conn.close()
+                    if result:
+                        return jsonify(result)
+            return jsonify({
+                "message": "Data update triggered. Please refresh.",
+                "job_id": job_id,
+                "status_url": f"/api/jobs/{job_id}"
+            }), 202
         return jsonify(result)
     except Exception as e:
         logging.error("Error in get_as_data endpoint: %s", traceback.format_exc())
         return jsonify({"error": "Error retrieving AS data", "details": str(e)}), 500
 
 @app.route('/api/historical', methods=['GET'])
+@cached_endpoint('asn')
 def historical_data():
     asn = request.args.get('asn')
     start_date = request.args.get('start_date')
@@ -117,16 +281,24 @@ def historical_data():
         start_date = start_date + "-01"
     if end_date and len(end_date) == 7:
         end_date = end_date + "-01"
+    if USE_SNAPSHOT_STORE and snapshot_store.covers("as_data", start_date, end_date):
+        try:
+            return jsonify(snapshot_store.historical_series(asn, start_date, end_date))
+        except Exception:
+            logging.warning("Snapshot store read failed, falling back to MySQL: %s", traceback.format_exc())
     try:
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True, buffered=True)
         sql = """
-        SELECT snapshot_date, as_rank, cone_asn_count, customer_degree, transit_degree, peer_degree, provider_degree
-        FROM as_data
-        WHERE asn=%s
-          AND snapshot_date >= %s
-          AND snapshot_date <= %s
-        ORDER BY snapshot_date ASC
+        SELECT d.snapshot_date, d.as_rank,
+               COALESCE(d.cone_asn_count, cc.cone_asn_count) AS cone_asn_count,
+               d.customer_degree, d.transit_degree, d.peer_degree, d.provider_degree
+        FROM as_data d
+        LEFT JOIN computed_cones cc ON cc.asn = d.asn AND cc.snapshot_date = d.snapshot_date
+        WHERE d.asn=%s
+          AND d.snapshot_date >= %s
+          AND d.snapshot_date <= %s
+        ORDER BY d.snapshot_date ASC
         """
         cursor.execute(sql, (asn, start_date, end_date))
         rows = cursor.fetchall()
@@ -153,7 +325,30 @@ def historical_data():
         return jsonify({"error": "Error retrieving historical data", "details": str(e)}), 500
 
 
+@app.route('/api/customer_churn', methods=['GET'])
+@cached_endpoint('asn')
+def customer_churn():
+    asn = request.args.get('asn')
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    if not asn or not start_date or not end_date:
+        return jsonify({"error": "asn, start_date, and end_date are required"}), 400
+    if not snapshot_store.available():
+        return jsonify({"error": "Snapshot store unavailable (pyarrow not installed)"}), 501
+    try:
+        stale = snapshot_store.stale_months("as_relationships", start_date, end_date)
+        if stale:
+            return jsonify({
+                "error": "Snapshot store is behind MySQL for this range; run snapshot_store.py to compact it.",
+                "stale_months": stale
+            }), 409
+        return jsonify({"months": snapshot_store.customer_churn(asn, start_date, end_date)})
+    except Exception as e:
+        logging.error("Error in customer_churn: %s", traceback.format_exc())
+        return jsonify({"error": "Error computing customer churn", "details": str(e)}), 500
+
 @app.route('/api/peeringdb/<asn>', methods=['GET'])
+@cached_endpoint('asn')
 def get_peeringdb(asn):
     try:
         conn = get_db_connection()
@@ -169,6 +364,7 @@ def get_peeringdb(asn):
     if not net_record:
         try:
             load_peeringdb_data(asn)
+            invalidate_asn(asn)
         except Exception as e:
             logging.error("Error updating PeeringDB for ASN %s: %s", asn, str(e))
         try:
@@ -212,6 +408,7 @@ def get_peeringdb(asn):
     return jsonify(net_record)
 
 @app.route('/api/available_snapshots', methods=['GET'])
+@cached_endpoint('asn')
 def available_snapshots():
     asn = request.args.get('asn')
     if not asn:
@@ -230,6 +427,86 @@ def available_snapshots():
         logging.error("Error in available_snapshots: %s", traceback.format_exc())
         return jsonify({"error": "Error retrieving available snapshots", "details": str(e)}), 500
 
+def _record_manual_etl(asn, start_date, end_date):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    sql = "INSERT INTO etl_metadata (process_name, status, details) VALUES (%s, %s, %s)"
+    params = (f"Manual_ETL for ASN {asn}", "successful", f"Manual update for ASN {asn} from {start_date} to {end_date}")
+    cursor.execute(sql, params)
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+def _snapshot_months(start_date, end_date):
+    month = datetime.strptime(start_date[:7] + "-01", "%Y-%m-%d")
+    last = datetime.strptime(end_date[:7] + "-01", "%Y-%m-%d")
+    months = []
+    while month <= last:
+        months.append(month.strftime("%Y-%m-%d"))
+        month += relativedelta(months=1)
+    return months
+
+def _after_caida_load(asn, start_date, end_date):
+    """
+    etl_caida writes as_data and as_relationships directly, so reset the
+    state etl_lost_competitor keeps about those months and drop cached
+    responses for asn and every neighbour written alongside it.
+    """
+    months = _snapshot_months(start_date, end_date)
+    invalidate_fingerprints(months=months)
+    invalidate_months(months)
+    snapshot_store.mark_dirty(months)
+    conn = get_db_connection()
+    cursor = conn.cursor(buffered=True)
+    cursor.execute("""
+        SELECT provider_asn, customer_asn FROM as_relationships
+        WHERE (provider_asn=%s OR customer_asn=%s)
+          AND snapshot_date BETWEEN %s AND %s
+    """, (asn, asn, months[0], months[-1]))
+    written = {asn}
+    for provider_asn, customer_asn in cursor.fetchall():
+        written.update((provider_asn, customer_asn))
+    cursor.close()
+    conn.close()
+    invalidate_responses(written)
+
+def _update_data_steps(asn, params):
+    start_date = params["start_date"]
+    end_date = params["end_date"]
+    return [
+        ("CAIDA ETL", lambda: load_caida_data(asn, start_date, end_date), True),
+        ("Reset ETL state", lambda: _after_caida_load(asn, start_date, end_date), False),
+        ("Lost customers and competitor gains", lambda: compute_lost_competitor_data(asn), False),
+        ("PeeringDB ETL", lambda: maybe_update_peeringdb(asn), True),
+        ("ETL metadata", lambda: _record_manual_etl(asn, start_date, end_date), False),
+        ("Invalidate cached responses", lambda: invalidate_asn(asn), False),
+    ]
+
+def _dynamic_update_and_check(asn):
+    date_range = pending_update_range(asn)
+    dynamic_update(asn)
+    if date_range is not None:
+        _after_caida_load(asn, *date_range)
+    invalidate_asn(asn)
+    conn = get_db_connection()
+    cursor = conn.cursor(buffered=True)
+    cursor.execute("SELECT 1 FROM as_data WHERE asn=%s LIMIT 1", (asn,))
+    found = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    if not found:
+        return NO_CAIDA_DATA
+    compute_lost_competitor_data(asn)
+
+def _dynamic_update_steps(asn, params):
+    return [("Dynamic update", lambda: _dynamic_update_and_check(asn), True)]
+
+register_job_kind("update_data", _update_data_steps)
+register_job_kind("dynamic_update", _dynamic_update_steps)
+# Runs in every WSGI worker, not only under __main__: resumes jobs left by
+# dead workers and heartbeats this process's own.
+start_job_monitor()
+
 @app.route('/api/update_data', methods=['POST'])
 def update_data():
     data = request.json
@@ -239,31 +516,86 @@ def update_data():
     if not asn or not start_date or not end_date:
         return jsonify({"error": "Missing parameters: asn, start_date, and end_date are required."}), 400
     try:
-        load_caida_data(asn, start_date, end_date)
-    except Exception as e:
-        logging.error("CAIDA ETL failed for ASN %s: %s", asn, traceback.format_exc())
-        return jsonify({"error": f"CAIDA ETL failed: {str(e)}"}), 500
-    try:
-        fill_lost_customers_simple(asn)
-    except Exception as e:
-        logging.error("Error filling lost customers for ASN %s: %s", asn, traceback.format_exc())
-    try:
-        maybe_update_peeringdb(asn)
+        job_id = submit_job("update_data", asn, {"start_date": start_date, "end_date": end_date})
+    except JobLockTimeout as e:
+        logging.warning("Update for ASN %s not queued: %s", asn, e)
+        return jsonify({"error": "An update for this ASN is being queued, please retry."}), 503
     except Exception as e:
-        logging.error("PeeringDB ETL failed for ASN %s: %s", asn, traceback.format_exc())
-        return jsonify({"error": f"PeeringDB ETL failed: {str(e)}"}), 500
+        logging.error("Could not queue update for ASN %s: %s", asn, traceback.format_exc())
+        return jsonify({"error": f"Could not queue update: {str(e)}"}), 500
+    return jsonify({
+        "message": f"Manual update queued for ASN {asn} from {start_date} to {end_date}.",
+        "job_id": job_id,
+        "status_url": f"/api/jobs/{job_id}"
+    }), 202
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def job_status(job_id):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        sql = "INSERT INTO etl_metadata (process_name, status, details) VALUES (%s, %s, %s)"
-        params = (f"Manual_ETL for ASN {asn}", "successful", f"Manual update for ASN {asn} from {start_date} to {end_date}")
-        cursor.execute(sql, params)
-        conn.commit()
-        cursor.close()
-        conn.close()
+        job = get_job(job_id)
     except Exception as e:
-        logging.error("Error inserting ETL metadata: %s", traceback.format_exc())
-    return jsonify({"message": f"Manual update triggered for ASN {asn} from {start_date} to {end_date}."})
+        logging.error("Error in job_status: %s", traceback.format_exc())
+        return jsonify({"error": "Error retrieving job", "details": str(e)}), 500
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+_dashboard_executor = ThreadPoolExecutor(max_workers=DASHBOARD_WORKERS, thread_name_prefix="dashboard")
+
+def _run_dashboard_section(view, path, query, view_args):
+    """
+    Run an existing endpoint in its own request context (so its response
+    cache and error handling apply) and return (status, parsed JSON).
+    """
+    with app.test_request_context(path, query_string=query):
+        response = app.make_response(view(**view_args))
+        return response.status_code, response.get_json(silent=True)
+
+@app.route('/api/dashboard', methods=['GET'])
+def dashboard():
+    """
+    Everything index.html needs for one ASN and date range in one response:
+    summary, snapshots, history, competitor analysis and PeeringDB, gathered
+    concurrently and gzip-compressed when the client accepts it.
+    """
+    asn = request.args.get('asn')
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    if not asn or not start_date or not end_date:
+        return jsonify({"error": "asn, start_date, and end_date are required"}), 400
+    if len(start_date) == 7:
+        start_date = start_date + "-01"
+    if len(end_date) == 7:
+        end_date = end_date + "-01"
+    sections = {
+        "summary": (get_as_data, f"/api/as/{asn}", {}, {"asn": asn}),
+        "snapshots": (available_snapshots, "/api/available_snapshots", {"asn": asn}, {}),
+        "historical": (historical_data, "/api/historical",
+                       {"asn": asn, "start_date": start_date, "end_date": end_date}, {}),
+        "competitor_analysis": (competitor_analysis, "/api/competitor_analysis",
+                                {"requestor_asn": asn, "start_date": start_date, "end_date": end_date}, {}),
+        "peeringdb": (get_peeringdb, f"/api/peeringdb/{asn}", {}, {"asn": asn}),
+    }
+    # Each section runs in a copy of this context so its SQL counts towards
+    # this request's metrics.
+    futures = {name: _dashboard_executor.submit(contextvars.copy_context().run, _run_dashboard_section, *spec)
+               for name, spec in sections.items()}
+    payload = {"asn": asn, "start_date": start_date, "end_date": end_date}
+    for name, future in futures.items():
+        try:
+            status, data = future.result()
+        except Exception as e:
+            logging.error("Dashboard section %s failed: %s", name, traceback.format_exc())
+            status, data = 500, {"error": str(e)}
+        payload[name] = {"status": status, "data": data}
+
+    body = json.dumps(payload, default=str).encode("utf-8")
+    response = Response(body, mimetype="application/json")
+    if len(body) >= DASHBOARD_GZIP_MIN_BYTES and "gzip" in request.headers.get("Accept-Encoding", ""):
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
 
 # --- Competitor Analysis Functions ---
 
@@ -273,14 +605,11 @@ def find_competitors(requestor_asn, lost_asn, lostDate):
         lostDate = lostDate.date()
 
     # Entire window: from (lostDate - 3 months) to (lostDate + 3 months)
-    full_start = (lostDate - relativedelta(months=3)).replace(day=1)
-    full_end   = (lostDate + relativedelta(months=3)).replace(day=1)
+    full_start = (lostDate - relativedelta(months=COMPETITOR_WINDOW_MONTHS)).replace(day=1)
+    full_end   = (lostDate + relativedelta(months=COMPETITOR_WINDOW_MONTHS)).replace(day=1)
 
-    # Define baseline and current boundaries:
-    baseline_start = full_start          # Baseline: from (lostDate - 3 months)...
-    baseline_end   = lostDate             # ...up to lostDate (exclusive)
-    current_start  = lostDate             # Current: from lostDate...
-    current_end    = full_end             # ...up to (lostDate + 3 months) (exclusive)
+    if USE_GRAPH_INDEX:
+        return summarize_competitors(graph_provider_rows(lost_asn, full_start, full_end), lostDate)
 
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True, buffered=True)
@@ -306,6 +635,49 @@ def find_competitors(requestor_asn, lost_asn, lostDate):
     cursor.close()
     conn.close()
 
+    return summarize_competitors(entire_range_rows, lostDate)
+
+def graph_provider_rows(lost_asn, start, end):
+    """
+    Provider rows for lost_asn in [start, end) from the graph index, with
+    provider names filled in by a single as_data lookup.
+    """
+    rows = get_graph_index().provider_rows(lost_asn, start, end)
+    if not rows:
+        return rows
+    pairs = sorted({(r["provider_asn"], r["snapshot_date"].strftime("%Y-%m-%d")) for r in rows})
+    conn = get_db_connection()
+    cursor = conn.cursor(buffered=True)
+    cursor.execute(
+        "SELECT asn, snapshot_date, asn_name FROM as_data WHERE (asn, snapshot_date) IN ("
+        + ", ".join(["(%s, %s)"] * len(pairs)) + ")",
+        [v for pair in pairs for v in pair]
+    )
+    names = {(str(a), d.strftime("%Y-%m-%d")): n for a, d, n in cursor.fetchall()}
+    cursor.close()
+    conn.close()
+    for r in rows:
+        r["provider_name"] = names.get((r["provider_asn"], r["snapshot_date"].strftime("%Y-%m-%d")))
+    return rows
+
+def summarize_competitors(entire_range_rows, lostDate):
+    """
+    Reduce provider rows (provider_asn, snapshot_date, provider_name) for one
+    lost ASN to (comp_asn, comp_org, comp_date). Rows outside the ±3-month
+    window around lostDate are ignored, so callers may pass a wider range.
+    """
+    if hasattr(lostDate, "date"):
+        lostDate = lostDate.date()
+
+    full_start = (lostDate - relativedelta(months=COMPETITOR_WINDOW_MONTHS)).replace(day=1)
+    full_end   = (lostDate + relativedelta(months=COMPETITOR_WINDOW_MONTHS)).replace(day=1)
+
+    # Define baseline and current boundaries:
+    baseline_start = full_start          # Baseline: from (lostDate - 3 months)...
+    baseline_end   = lostDate             # ...up to lostDate (exclusive)
+    current_start  = lostDate             # Current: from lostDate...
+    current_end    = full_end             # ...up to (lostDate + 3 months) (exclusive)
+
     # Build dictionaries and sets.
     earliest_date_map = {}  # Maps provider_asn -> earliest snapshot_date in window.
     provider_name_map = {}  # Maps provider_asn -> provider name.
@@ -318,6 +690,8 @@ def find_competitors(requestor_asn, lost_asn, lostDate):
         # Convert snapshot_date to a date if it is a datetime.
         if hasattr(pdate, "date"):
             pdate = pdate.date()
+        if not (full_start <= pdate < full_end):
+            continue
         pname = row["provider_name"] if row["provider_name"] else "N/A"
 
         # Track the earliest date for this provider.
@@ -349,6 +723,7 @@ def find_competitors(requestor_asn, lost_asn, lostDate):
     return comp_asn, comp_org, comp_date
 
 @app.route('/api/competitor_analysis', methods=['GET'])
+@cached_endpoint('requestor_asn')
 def competitor_analysis():
     try:
         asn = request.args.get('requestor_asn')
@@ -393,11 +768,12 @@ def competitor_analysis():
             grouped[key].append(row)
         monthlyStats = []
         totalLostCount = len(lost_rows)
+        cone_map, rel_map, competitor_map = resolve_competitor_batch(asn, grouped)
         for mKey in sorted(grouped.keys()):
             dt = datetime.combine(mKey, datetime.min.time())
             prevMonth = dt - relativedelta(months=1)
-            prevCone = getCone(asn, prevMonth)
-            currCone = getCone(asn, dt)
+            prevCone = cone_map.get(prevMonth.date().replace(day=1))
+            currCone = cone_map.get(mKey.replace(day=1))
             prevConeVal = prevCone if prevCone is not None else "N/A"
             currConeVal = currCone if currCone is not None else "N/A"
             if isinstance(prevConeVal, int) and isinstance(currConeVal, int):
@@ -406,8 +782,9 @@ def competitor_analysis():
                 coneChanges = "N/A"
             lostEvents = []
             for row in grouped[mKey]:
-                relationship_cm = find_relationship_cm(asn, row["lost_asn"], dt)
-                comp_asn, comp_org, comp_date = find_competitors(asn, row["lost_asn"], dt)
+                relationship_cm = rel_map.get((str(row["lost_asn"]), mKey.replace(day=1)), "none")
+                comp_asn, comp_org, comp_date = competitor_map.get(
+                    (str(row["lost_asn"]), mKey), ([], [], None))
                 lostEvents.append({
                     "lost_asn": row["lost_asn"],
                     "lost_org": row["lost_org"],
@@ -432,33 +809,126 @@ def competitor_analysis():
         logging.error("Error in competitor_analysis endpoint: %s", traceback.format_exc())
         return jsonify({"error": "Competitor analysis failed", "details": str(e)}), 500
 
-def getCone(asn, dateObj):
-    dateStr = dateObj.replace(day=1).strftime("%Y-%m-%d")
-    val = queryCone(asn, dateStr)
-    return val
+def _in_clause(values):
+    return ", ".join(["%s"] * len(values))
 
-def queryCone(asn, dateStr):
-    conn = get_db_connection()
-    cursor = conn.cursor(buffered=True)
-    cursor.execute("SELECT cone_asn_count FROM as_data WHERE asn=%s AND snapshot_date=%s", (asn, dateStr))
-    row = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    return row[0] if row else None
+def resolve_competitor_batch(asn, grouped):
+    """
+    Fetch everything competitor_analysis needs for all lost events at once:
+      - cone_map: {month: cone_asn_count} for asn, for every lost month and the month
+        before, from computed_cones where CAIDA gave no cone size
+      - rel_map: {(lost_asn, month): relationship_type} of asn -> lost_asn
+      - competitor_map: {(lost_asn, lost_month): (comp_asn, comp_org, comp_date)}
+    At most four queries regardless of how many lost customers there are. With
+    USE_COMPETITOR_GAINS the competitors are read from competitor_gains and
+    only events without gains rows fall back to the per-window computation;
+    otherwise provider rows for every window are fetched and summarized here.
+    """
+    months = sorted({m.replace(day=1) for m in grouped})
+    cone_months = sorted(set(months) | {m - relativedelta(months=1) for m in months})
+    lost_asns = sorted({str(row["lost_asn"]) for rows in grouped.values() for row in rows})
 
-def find_relationship_cm(requestor_asn, lost_asn, dateObj):
-    dateStr = dateObj.replace(day=1).strftime("%Y-%m-%d")
     conn = get_db_connection()
-    cursor = conn.cursor(buffered=True)
-    cursor.execute("""
-      SELECT relationship_type
-      FROM as_relationships
-      WHERE provider_asn=%s AND customer_asn=%s AND snapshot_date=%s
-    """, (requestor_asn, lost_asn, dateStr))
-    row = cursor.fetchone()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+
+    cursor.execute(
+        f"SELECT d.snapshot_date, COALESCE(d.cone_asn_count, cc.cone_asn_count) AS cone_asn_count "
+        f"FROM as_data d LEFT JOIN computed_cones cc "
+        f"ON cc.asn = d.asn AND cc.snapshot_date = d.snapshot_date "
+        f"WHERE d.asn=%s AND d.snapshot_date IN ({_in_clause(cone_months)})",
+        [asn] + [m.strftime("%Y-%m-%d") for m in cone_months]
+    )
+    cone_map = {}
+    for r in cursor.fetchall():
+        d = r["snapshot_date"]
+        cone_map[d.date() if hasattr(d, "date") else d] = r["cone_asn_count"]
+
+    cursor.execute(
+        f"""
+        SELECT customer_asn, snapshot_date, relationship_type
+        FROM as_relationships
+        WHERE provider_asn=%s
+          AND customer_asn IN ({_in_clause(lost_asns)})
+          AND snapshot_date IN ({_in_clause(months)})
+        """,
+        [asn] + lost_asns + [m.strftime("%Y-%m-%d") for m in months]
+    )
+    rel_map = {}
+    for r in cursor.fetchall():
+        d = r["snapshot_date"]
+        key = (str(r["customer_asn"]), d.date() if hasattr(d, "date") else d)
+        rel_map.setdefault(key, r["relationship_type"])
+
+    if USE_COMPETITOR_GAINS:
+        competitor_map = _read_competitor_gains(cursor, lost_asns, months)
+        missing = {}
+        for mKey, rows in grouped.items():
+            unmatched = [row for row in rows if (str(row["lost_asn"]), mKey) not in competitor_map]
+            if unmatched:
+                missing[mKey] = unmatched
+        if missing:
+            missing_asns = sorted({str(row["lost_asn"]) for rows in missing.values() for row in rows})
+            missing_months = sorted({m.replace(day=1) for m in missing})
+            competitor_map.update(_compute_competitors(cursor, missing, missing_asns, missing_months))
+    else:
+        competitor_map = _compute_competitors(cursor, grouped, lost_asns, months)
+
     cursor.close()
     conn.close()
-    return row[0] if row else "none"
+    return cone_map, rel_map, competitor_map
+
+def _read_competitor_gains(cursor, lost_asns, months):
+    cursor.execute(
+        f"""
+        SELECT lost_asn, lost_month, provider_asn, provider_name, first_seen_month
+        FROM competitor_gains
+        WHERE lost_asn IN ({_in_clause(lost_asns)})
+          AND lost_month IN ({_in_clause(months)})
+          AND window_months = %s
+        """,
+        lost_asns + [m.strftime("%Y-%m-%d") for m in months] + [COMPETITOR_WINDOW_MONTHS]
+    )
+    gains = {}
+    for r in cursor.fetchall():
+        m = r["lost_month"]
+        key = (str(r["lost_asn"]), m.date() if hasattr(m, "date") else m)
+        gains.setdefault(key, []).append(r)
+    competitor_map = {}
+    for key, rows in gains.items():
+        first_seen = min(r["first_seen_month"] for r in rows)
+        competitor_map[key] = (
+            [r["provider_asn"] for r in rows],
+            [r["provider_name"] or "N/A" for r in rows],
+            first_seen.strftime("%b-%Y")
+        )
+    return competitor_map
+
+def _compute_competitors(cursor, grouped, lost_asns, months):
+    window_start = months[0] - relativedelta(months=COMPETITOR_WINDOW_MONTHS)
+    window_end = months[-1] + relativedelta(months=COMPETITOR_WINDOW_MONTHS)
+    cursor.execute(
+        f"""
+        SELECT r.customer_asn, r.provider_asn, r.snapshot_date, d.asn_name AS provider_name
+        FROM as_relationships r
+        LEFT JOIN as_data d
+          ON d.asn = r.provider_asn
+         AND d.snapshot_date = r.snapshot_date
+        WHERE r.customer_asn IN ({_in_clause(lost_asns)})
+          AND r.relationship_type = 'provider'
+          AND r.snapshot_date >= %s
+          AND r.snapshot_date < %s
+        """,
+        lost_asns + [window_start.strftime("%Y-%m-%d"), window_end.strftime("%Y-%m-%d")]
+    )
+    provider_rows = {}
+    for r in cursor.fetchall():
+        provider_rows.setdefault(str(r["customer_asn"]), []).append(r)
+    competitor_map = {}
+    for mKey, rows in grouped.items():
+        for row in rows:
+            lost_asn = str(row["lost_asn"])
+            competitor_map[(lost_asn, mKey)] = summarize_competitors(provider_rows.get(lost_asn, []), mKey)
+    return competitor_map
 
 @app.route('/api/run_lost_competitor_etl', methods=['POST'])
 def run_lost_competitor_etl():
@@ -467,7 +937,6 @@ def run_lost_competitor_etl():
     if not asn:
         return jsonify({"error": "ASN is required"}), 400
     try:
-        from etl_lost_competitor import compute_lost_competitor_data
         compute_lost_competitor_data(asn)
         return jsonify({"message": f"Lost competitor ETL triggered for ASN {asn}."})
     except Exception as e:
@@ -477,35 +946,29 @@ def run_lost_competitor_etl():
 # NEW: Excel export endpoint for raw data download and consolidated views
 @app.route('/api/download_raw_data', methods=['GET'])
 def download_raw_data():
+    """
+    Multi-sheet export of everything stored for an ASN, streamed to the client.
+    format=xlsx (default) builds a constant-memory workbook; format=csv streams
+    a zip with one CSV per sheet as rows are read.
+    """
     asn = request.args.get('asn')
     if not asn:
         return jsonify({"error": "ASN parameter is required"}), 400
+    export_format = request.args.get('format', 'xlsx').lower()
+    if export_format == 'csv':
+        body = stream_csv_zip(asn)
+        filename = f"raw_data_{asn}.zip"
+        mimetype = 'application/zip'
+    elif export_format == 'xlsx':
+        body = stream_xlsx(asn)
+        filename = f"raw_data_{asn}.xlsx"
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    else:
+        return jsonify({"error": "format must be xlsx or csv"}), 400
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    })
 
-    conn = get_db_connection()
-
-    # Query raw data for each sheet
-    hist_df = pd.read_sql("SELECT * FROM as_data WHERE asn = %s ORDER BY snapshot_date ASC", conn, params=(asn,))
-    lost_df = pd.read_sql("SELECT * FROM lost_customers WHERE requestor_asn = %s ORDER BY lost_month ASC", conn, params=(asn,))
-    rel_df = pd.read_sql("SELECT * FROM as_relationships WHERE provider_asn = %s OR customer_asn = %s ORDER BY snapshot_date ASC", conn, params=(asn, asn))
-    net_df = pd.read_sql("SELECT * FROM peeringdb_networks WHERE asn = %s", conn, params=(asn,))
-    ix_df = pd.read_sql("SELECT * FROM peeringdb_ix WHERE asn = %s", conn, params=(asn,))
-    fac_df = pd.read_sql("SELECT * FROM peeringdb_fac WHERE asn = %s", conn, params=(asn,))
-    conn.close()
-
-    # Create a multi-sheet Excel file
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        hist_df.to_excel(writer, index=False, sheet_name="Historical AS Data")
-        lost_df.to_excel(writer, index=False, sheet_name="Lost Customers")
-        rel_df.to_excel(writer, index=False, sheet_name="AS Relationships")
-        net_df.to_excel(writer, index=False, sheet_name="PeeringDB Networks")
-        ix_df.to_excel(writer, index=False, sheet_name="PeeringDB Exchanges")
-        fac_df.to_excel(writer, index=False, sheet_name="PeeringDB Facilities")
-    output.seek(0)
-    filename = f"raw_data_{asn}.xlsx"
-    return send_file(output, attachment_filename=filename,
-                     as_attachment=True,
-                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
 if __name__ == '__main__':
     app.run(debug=True)
 
@@ -0,0 +1,280 @@
+import json
+import time
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from db import get_db_connection
+
+# Background ETL jobs: a local thread pool plus the etl_jobs table, which holds
+# status and progress so any worker process can answer status requests.
+JOB_WORKERS = 2
+# Seconds to wait for the per-(kind, asn) submission lock.
+JOB_LOCK_TIMEOUT = 5
+# Each process bumps updated_at on the jobs it owns this often; a queued or
+# running job not bumped for JOB_STALE_SECONDS belongs to a dead worker.
+JOB_HEARTBEAT_SECONDS = 30
+JOB_STALE_SECONDS = 300
+
+_executor = None
+_executor_lock = threading.Lock()
+_job_kinds = {}
+_owned_jobs = set()
+_owned_lock = threading.Lock()
+_heartbeat_thread = None
+
+
+class JobLockTimeout(Exception):
+    pass
+
+
+def register_job_kind(kind, build_steps):
+    """
+    build_steps(asn, params) -> [(label, callable, required), ...]
+    A failing required step fails the job; an optional one is logged and skipped.
+    A step returning a string sets the job's final message (its result code).
+    """
+    _job_kinds[kind] = build_steps
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="etl-job")
+    return _executor
+
+
+def _update_job(job_id, **fields):
+    sets = ", ".join(f"{name}=%s" for name in fields)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"UPDATE etl_jobs SET {sets}, updated_at=NOW() WHERE id=%s",
+                   list(fields.values()) + [job_id])
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def _run_job(job_id, kind, asn, params):
+    steps = _job_kinds[kind](asn, params)
+    _update_job(job_id, status="running", progress=0, message="Starting")
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE etl_jobs SET started_at=NOW() WHERE id=%s", (job_id,))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    warnings = []
+    final_message = "Done"
+    for i, (label, fn, required) in enumerate(steps):
+        _update_job(job_id, progress=int(100 * i / len(steps)), message=label)
+        try:
+            outcome = fn()
+            if isinstance(outcome, str):
+                final_message = outcome
+        except Exception as e:
+            logging.error("Job %s (%s for ASN %s) step '%s' failed: %s",
+                          job_id, kind, asn, label, traceback.format_exc())
+            if required:
+                _update_job(job_id, status="failed", message=f"{label} failed", error=str(e))
+                return
+            warnings.append(f"{label}: {e}")
+    _update_job(job_id, status="succeeded", progress=100, message=final_message,
+                error="; ".join(warnings) or None)
+
+
+def _run_job_safely(job_id, kind, asn, params):
+    try:
+        _run_job(job_id, kind, asn, params)
+    except Exception as e:
+        logging.error("Job %s crashed: %s", job_id, traceback.format_exc())
+        try:
+            _update_job(job_id, status="failed", error=str(e))
+        except Exception:
+            pass
+    finally:
+        with _owned_lock:
+            _owned_jobs.discard(job_id)
+
+
+def _dispatch(job_id, kind, asn, params):
+    with _owned_lock:
+        _owned_jobs.add(job_id)
+    _get_executor().submit(_run_job_safely, job_id, kind, asn, params)
+
+
+def _touch_owned_jobs():
+    with _owned_lock:
+        owned = list(_owned_jobs)
+    if not owned:
+        return
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        UPDATE etl_jobs SET updated_at=NOW()
+        WHERE id IN ({", ".join(["%s"] * len(owned))}) AND status IN ('queued', 'running')
+    """, owned)
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+        try:
+            _touch_owned_jobs()
+            resume_pending_jobs()
+        except Exception:
+            logging.warning("Job heartbeat failed: %s", traceback.format_exc())
+
+
+def start_job_monitor():
+    """
+    Resume jobs orphaned by dead workers and start this process's heartbeat
+    thread, which keeps its own jobs fresh and keeps picking up stale ones.
+    Safe to call from every worker process; repeat calls are no-ops.
+    """
+    global _heartbeat_thread
+    with _owned_lock:
+        if _heartbeat_thread is not None:
+            return
+        _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name="etl-job-heartbeat", daemon=True)
+        _heartbeat_thread.start()
+    try:
+        resume_pending_jobs()
+    except Exception:
+        logging.warning("Could not resume pending jobs: %s", traceback.format_exc())
+
+
+def submit_job(kind, asn, params=None):
+    """
+    Queue a job and return its id straight away. An identical job (same kind,
+    ASN and params) that is still queued or running is reused instead of
+    duplicated, unless its heartbeat is older than JOB_STALE_SECONDS: such a
+    job is marked failed and a new one queued. A MySQL named lock makes the
+    check-then-insert single-flight across threads and worker processes.
+    Raises JobLockTimeout if the lock cannot be taken within JOB_LOCK_TIMEOUT
+    seconds.
+    """
+    if kind not in _job_kinds:
+        raise ValueError(f"Unknown job kind: {kind}")
+    params = params or {}
+    params_json = json.dumps(params, sort_keys=True)
+    lock_name = f"etl_job:{kind}:{asn}"
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (lock_name, JOB_LOCK_TIMEOUT))
+    locked = cursor.fetchone()[0]
+    if locked != 1:
+        # 0 is a timeout, NULL an error; either way we do not hold the lock.
+        cursor.close()
+        conn.close()
+        raise JobLockTimeout(f"Could not lock {lock_name} within {JOB_LOCK_TIMEOUT}s")
+    try:
+        cursor.execute("""
+            UPDATE etl_jobs SET status='failed', error='Worker lost (no heartbeat)', updated_at=NOW()
+            WHERE kind=%s AND asn=%s AND status IN ('queued', 'running')
+              AND updated_at < NOW() - INTERVAL %s SECOND
+        """, (kind, asn, JOB_STALE_SECONDS))
+        conn.commit()
+        cursor.execute("""
+            SELECT id FROM etl_jobs
+            WHERE kind=%s AND asn=%s AND params=%s AND status IN ('queued', 'running')
+            ORDER BY id DESC LIMIT 1
+        """, (kind, asn, params_json))
+        row = cursor.fetchone()
+        if row:
+            return row[0]
+        cursor.execute("""
+            INSERT INTO etl_jobs (kind, asn, params, status, progress, created_at, updated_at)
+            VALUES (%s, %s, %s, 'queued', 0, NOW(), NOW())
+        """, (kind, asn, params_json))
+        job_id = cursor.lastrowid
+        conn.commit()
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+        cursor.fetchone()
+        cursor.close()
+        conn.close()
+    _dispatch(job_id, kind, asn, params)
+    return job_id
+
+
+def wait_for_job(job_id, timeout, interval=0.5):
+    """
+    Block up to `timeout` seconds for a job to finish; returns the last job record.
+    """
+    deadline = time.monotonic() + timeout
+    job = get_job(job_id)
+    while job and job["status"] in ("queued", "running") and time.monotonic() < deadline:
+        time.sleep(interval)
+        job = get_job(job_id)
+    return job
+
+
+def recent_job_result(kind, asn, message, within_seconds):
+    """
+    Most recent finished job of this kind for asn that ended with `message`
+    in the last within_seconds, or None.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    cursor.execute("""
+        SELECT id, updated_at FROM etl_jobs
+        WHERE kind=%s AND asn=%s AND status='succeeded' AND message=%s
+          AND updated_at >= NOW() - INTERVAL %s SECOND
+        ORDER BY id DESC LIMIT 1
+    """, (kind, asn, message, int(within_seconds)))
+    row = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return row
+
+
+def get_job(job_id):
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    cursor.execute("""
+        SELECT id, kind, asn, status, progress, message, error,
+               created_at, started_at, updated_at
+        FROM etl_jobs WHERE id=%s
+    """, (job_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return row
+
+
+def resume_pending_jobs():
+    """
+    Re-queue jobs left queued or running by a dead worker, i.e. whose
+    heartbeat is older than JOB_STALE_SECONDS. Each job is claimed with a
+    conditional UPDATE, so only one process resumes it. Returns the count.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, kind, asn, params FROM etl_jobs
+        WHERE status IN ('queued', 'running') AND updated_at < NOW() - INTERVAL %s SECOND
+    """, (JOB_STALE_SECONDS,))
+    rows = cursor.fetchall()
+    resumed = 0
+    for job_id, kind, asn, params in rows:
+        if kind not in _job_kinds:
+            _update_job(job_id, status="failed", error=f"Unknown job kind: {kind}")
+            continue
+        cursor.execute("""
+            UPDATE etl_jobs SET status='queued', message='Resumed after restart', updated_at=NOW()
+            WHERE id=%s AND status IN ('queued', 'running') AND updated_at < NOW() - INTERVAL %s SECOND
+        """, (job_id, JOB_STALE_SECONDS))
+        conn.commit()
+        if cursor.rowcount != 1:
+            continue
+        _dispatch(job_id, kind, asn, json.loads(params or "{}"))
+        resumed += 1
+    cursor.close()
+    conn.close()
+    return resumed
@@ -0,0 +1,199 @@
+import time
+import bisect
+import functools
+import threading
+import contextvars
+
+# In-process latency histograms and counters, rendered in the Prometheus text
+# exposition format by /metrics. Each worker process keeps its own series.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_lock = threading.Lock()
+_histograms = {}
+_help = {}
+
+
+class _Series:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+
+def describe(name, help_text, buckets=DEFAULT_BUCKETS):
+    _help[name] = (help_text, buckets)
+
+
+def observe(name, value, **labels):
+    """
+    Add one observation to histogram `name` for the given label values.
+    """
+    buckets = _help.get(name, (None, DEFAULT_BUCKETS))[1]
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = _Series(buckets)
+        series.counts[bisect.bisect_left(buckets, value)] += 1
+        series.total += value
+        series.count += 1
+
+
+class timer:
+    """
+    Context manager and decorator recording elapsed seconds into a histogram.
+    """
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self._started,
+                outcome="error" if exc_type else "ok", **self.labels)
+        return False
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(self.name, **self.labels):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+# --- Per-request SQL accounting ---
+
+class RequestStats:
+    """
+    SQL statements and time spent in them during one request. Shared by any
+    worker threads the request fans out to (see copy_context in /api/dashboard).
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.queries += 1
+            self.sql_seconds += seconds
+
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def _statement_kind(sql):
+    head = sql.lstrip().split(None, 1)
+    return head[0].upper() if head else "EMPTY"
+
+
+class InstrumentedCursor:
+    """
+    Cursor proxy timing execute/executemany into sql_query_seconds and the
+    current request's RequestStats. Everything else is passed through.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _timed(self, method, operation, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(operation, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            observe("sql_query_seconds", elapsed, statement=_statement_kind(operation))
+            stats = current_request.get()
+            if stats is not None:
+                stats.add(elapsed)
+
+    def execute(self, operation, *args, **kwargs):
+        return self._timed(self._cursor.execute, operation, *args, **kwargs)
+
+    def executemany(self, operation, *args, **kwargs):
+        return self._timed(self._cursor.executemany, operation, *args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """
+    Connection proxy whose cursors are InstrumentedCursors.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+# --- Prometheus text format ---
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels:
+        v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_bound(bound):
+    return repr(float(bound))
+
+
+def render(gauges=None, counters=None):
+    """
+    All histograms plus optional {name: (help, {label tuple: value})} gauges
+    and counters. Counters are values that only go up (names end in _total).
+    """
+    with _lock:
+        snapshot = [(name, labels, list(s.counts), s.total, s.count, s.buckets)
+                    for (name, labels), s in _histograms.items()]
+    lines = []
+    seen = set()
+    for name, labels, counts, total, count, buckets in sorted(snapshot, key=lambda x: (x[0], x[1])):
+        if name not in seen:
+            seen.add(name)
+            help_text = _help.get(name, (name,))[0]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, n in zip(buckets, counts):
+            cumulative += n
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_bound(bound)),))} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    for kind, series in (("gauge", gauges), ("counter", counters)):
+        for name, (help_text, values) in sorted((series or {}).items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in values.items():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+describe("http_request_seconds", "Flask request latency by endpoint, method and status.")
+describe("http_request_queries", "SQL statements issued per request.", QUERY_COUNT_BUCKETS)
+describe("sql_query_seconds", "SQL statement latency by statement kind.")
+describe("caida_fetch_seconds", "CAIDA GraphQL request latency.")
+describe("peeringdb_load_seconds", "PeeringDB ETL latency.")
@@ -0,0 +1,418 @@
+import sys
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from db import get_db_connection
+
+# Versioned schema for every table the app and ETL use. Applied versions are
+# recorded in schema_migrations; run `python migrations.py` to bring a
+# database up to date (existing, hand-made tables are adopted, not dropped).
+#
+# as_relationships key layout, chosen for the hot queries:
+#   PRIMARY (snapshot_date, provider_asn, customer_asn, relationship_type)
+#       month scans (graph index, snapshot export, dataset import). The type
+#       is part of the key because both endpoints' views of a p2c link share
+#       (provider, customer, month) and differ only in type.
+#   idx_rel_provider (provider_asn, snapshot_date, relationship_type)
+#       fill_lost_customers_* and the relationship lookups
+#   idx_rel_customer (customer_asn, relationship_type, snapshot_date)
+#       find_competitors and fill_competitor_gains
+# InnoDB appends the primary key to secondary indexes, so both secondaries
+# also cover the other ASN column and the queries never touch the rows.
+
+SQL_MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT NOT NULL PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        applied_at DATETIME NOT NULL
+    )
+"""
+
+MIGRATION_1_BASE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS as_data (
+        asn INT UNSIGNED NOT NULL,
+        snapshot_date DATE NOT NULL,
+        asn_name VARCHAR(255),
+        org_name VARCHAR(255),
+        country_iso CHAR(2),
+        country_name VARCHAR(128),
+        country_capital VARCHAR(128),
+        country_population BIGINT,
+        country_continent VARCHAR(64),
+        as_rank INT,
+        cone_asn_count INT,
+        cone_prefix_count INT,
+        cone_address_count BIGINT,
+        customer_degree INT,
+        peer_degree INT,
+        transit_degree INT,
+        provider_degree INT,
+        last_update DATETIME,
+        PRIMARY KEY (asn, snapshot_date)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS as_relationships (
+        provider_asn INT UNSIGNED NOT NULL,
+        customer_asn INT UNSIGNED NOT NULL,
+        relationship_type VARCHAR(16) NOT NULL,
+        snapshot_date DATE NOT NULL,
+        path_count INT,
+        last_update DATETIME,
+        PRIMARY KEY (snapshot_date, provider_asn, customer_asn, relationship_type)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS lost_customers (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        requestor_asn INT UNSIGNED NOT NULL,
+        snapshot_date DATE NOT NULL,
+        lost_asn INT UNSIGNED NOT NULL,
+        lost_month DATE NOT NULL,
+        lost_org VARCHAR(255),
+        lost_cust_cone INT,
+        created_at DATETIME,
+        updated_at DATETIME,
+        UNIQUE KEY uq_lost (requestor_asn, lost_month, lost_asn)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS peeringdb_networks (
+        asn INT UNSIGNED NOT NULL PRIMARY KEY,
+        network_name VARCHAR(255),
+        irr_as_set VARCHAR(255),
+        peering_policy VARCHAR(64),
+        ix_count INT,
+        fac_count INT,
+        last_update DATETIME
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS peeringdb_ix (
+        asn INT UNSIGNED NOT NULL,
+        ix_id INT NOT NULL,
+        name VARCHAR(255),
+        ipaddr4 VARCHAR(45),
+        port_size VARCHAR(32),
+        discovered_date DATE,
+        KEY idx_ix_asn (asn, ix_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS peeringdb_fac (
+        asn INT UNSIGNED NOT NULL,
+        fac_id INT NOT NULL,
+        name VARCHAR(255),
+        city VARCHAR(128),
+        country VARCHAR(64),
+        discovered_date DATE,
+        KEY idx_fac_asn (asn, fac_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS etl_metadata (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        process_name VARCHAR(255) NOT NULL,
+        status VARCHAR(32) NOT NULL,
+        details TEXT,
+        run_time DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+MIGRATION_2_ETL_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS as_data_fingerprints (
+        asn INT UNSIGNED NOT NULL,
+        snapshot_date DATE NOT NULL,
+        fingerprint CHAR(40) NOT NULL,
+        last_update DATETIME,
+        PRIMARY KEY (snapshot_date, asn)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS lost_customers_progress (
+        requestor_asn INT UNSIGNED NOT NULL PRIMARY KEY,
+        last_month DATE,
+        months_processed INT,
+        updated_at DATETIME
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS competitor_gains (
+        lost_asn INT UNSIGNED NOT NULL,
+        lost_month DATE NOT NULL,
+        window_months TINYINT UNSIGNED NOT NULL,
+        provider_asn INT UNSIGNED NOT NULL,
+        first_seen_month DATE NOT NULL,
+        provider_name VARCHAR(255),
+        updated_at DATETIME,
+        PRIMARY KEY (lost_asn, lost_month, window_months, provider_asn)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS computed_cones (
+        asn INT UNSIGNED NOT NULL,
+        snapshot_date DATE NOT NULL,
+        cone_asn_count INT NOT NULL,
+        last_update DATETIME,
+        PRIMARY KEY (asn, snapshot_date)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS etl_jobs (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        kind VARCHAR(64) NOT NULL,
+        asn VARCHAR(16) NOT NULL,
+        params TEXT,
+        status VARCHAR(16) NOT NULL,
+        progress TINYINT UNSIGNED NOT NULL DEFAULT 0,
+        message VARCHAR(255),
+        error TEXT,
+        created_at DATETIME,
+        started_at DATETIME,
+        updated_at DATETIME,
+        KEY idx_jobs_lookup (kind, asn, status),
+        KEY idx_jobs_status (status)
+    )
+    """,
+]
+
+# (table, index name, columns) added to tables that predate this module.
+HOT_QUERY_INDEXES = [
+    ("as_relationships", "idx_rel_provider", "provider_asn, snapshot_date, relationship_type"),
+    ("as_relationships", "idx_rel_customer", "customer_asn, relationship_type, snapshot_date"),
+    ("as_data", "idx_as_data_month", "snapshot_date"),
+    ("lost_customers", "idx_lost_requestor_month", "requestor_asn, lost_month"),
+]
+
+AS_RELATIONSHIPS_PK = ["snapshot_date", "provider_asn", "customer_asn", "relationship_type"]
+
+
+def _index_exists(cursor, table, name):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (table, name))
+    return cursor.fetchone() is not None
+
+
+def _column_exists(cursor, table, name):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        LIMIT 1
+    """, (table, name))
+    return cursor.fetchone() is not None
+
+
+def _primary_key_columns(cursor, table):
+    cursor.execute("""
+        SELECT column_name FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = 'PRIMARY'
+        ORDER BY seq_in_index
+    """, (table,))
+    return [r[0].lower() for r in cursor.fetchall()]
+
+
+def _migration_3_hot_query_indexes(cursor):
+    if _primary_key_columns(cursor, "as_relationships") != AS_RELATIONSHIPS_PK:
+        print("[INFO] Rebuilding as_relationships primary key (this can take a while on large tables).")
+        has_pk = bool(_primary_key_columns(cursor, "as_relationships"))
+        cursor.execute(
+            "ALTER TABLE as_relationships "
+            + ("DROP PRIMARY KEY, " if has_pk else "")
+            + f"ADD PRIMARY KEY ({', '.join(AS_RELATIONSHIPS_PK)})"
+        )
+    for table, name, columns in HOT_QUERY_INDEXES:
+        if not _index_exists(cursor, table, name):
+            print(f"[INFO] Adding index {name} on {table} ({columns}).")
+            cursor.execute(f"ALTER TABLE {table} ADD INDEX {name} ({columns})")
+
+
+def _migration_4_gains_build_time(cursor):
+    # When fill_competitor_gains last rebuilt a requestor's gains, so windows
+    # whose lost ASN received provider rows afterwards can be found.
+    if not _column_exists(cursor, "lost_customers_progress", "gains_updated_at"):
+        cursor.execute("ALTER TABLE lost_customers_progress ADD COLUMN gains_updated_at DATETIME NULL")
+
+
+def _migration_5_lost_asn_index(cursor):
+    # invalidate_responses looks up the requestors that lost an ingested ASN.
+    if not _index_exists(cursor, "lost_customers", "idx_lost_lost_asn"):
+        cursor.execute("ALTER TABLE lost_customers ADD INDEX idx_lost_lost_asn (lost_asn)")
+
+
+# (version, name, list of statements or callable(cursor)), applied in order.
+MIGRATIONS = [
+    (1, "base tables", MIGRATION_1_BASE_TABLES),
+    (2, "etl support tables", MIGRATION_2_ETL_TABLES),
+    (3, "hot query indexes", _migration_3_hot_query_indexes),
+    (4, "competitor gains build time", _migration_4_gains_build_time),
+    (5, "lost_customers lost_asn index", _migration_5_lost_asn_index),
+]
+
+
+def applied_versions(cursor):
+    cursor.execute(SQL_MIGRATIONS_TABLE)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {r[0] for r in cursor.fetchall()}
+
+
+def migrate(target=None):
+    """
+    Apply pending migrations up to `target` (default: latest). DDL commits
+    implicitly in MySQL, so each version is recorded right after it runs.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(buffered=True)
+    done = applied_versions(cursor)
+    applied = []
+    for version, name, step in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        print(f"[INFO] Applying migration {version}: {name}")
+        if callable(step):
+            step(cursor)
+        else:
+            for statement in step:
+                cursor.execute(statement)
+        cursor.execute(
+            "INSERT INTO schema_migrations (version, name, applied_at) VALUES (%s, %s, NOW())",
+            (version, name)
+        )
+        conn.commit()
+        applied.append(version)
+    cursor.close()
+    conn.close()
+    if not applied:
+        print("[INFO] Schema is up to date.")
+    return applied
+
+
+def _partition_name(month):
+    return "p" + month.strftime("%Y%m")
+
+
+def _partition_clause(month):
+    upper = (month + relativedelta(months=1)).strftime("%Y-%m-%d")
+    return f"PARTITION {_partition_name(month)} VALUES LESS THAN ('{upper}')"
+
+
+def partition_as_relationships(start_month, end_month):
+    """
+    Optional: range-partition as_relationships by snapshot month, one
+    partition per month in [start_month, end_month] plus a catch-all. Month
+    scans then prune to one partition and old months can be dropped cheaply.
+    Rebuilds the table, so run it in a maintenance window.
+    """
+    month = datetime.strptime(start_month[:7] + "-01", "%Y-%m-%d").date()
+    last = datetime.strptime(end_month[:7] + "-01", "%Y-%m-%d").date()
+    first_bound = month.strftime("%Y-%m-%d")
+    parts = [f"PARTITION p_old VALUES LESS THAN ('{first_bound}')"]
+    while month <= last:
+        parts.append(_partition_clause(month))
+        month += relativedelta(months=1)
+    parts.append("PARTITION p_future VALUES LESS THAN (MAXVALUE)")
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "ALTER TABLE as_relationships PARTITION BY RANGE COLUMNS(snapshot_date) ("
+        + ", ".join(parts) + ")"
+    )
+    cursor.close()
+    conn.close()
+    print(f"[INFO] Partitioned as_relationships into {len(parts)} partitions.")
+
+
+def add_month_partition(month_str):
+    """
+    Split the catch-all partition so `month_str` gets its own partition.
+    """
+    month = datetime.strptime(month_str[:7] + "-01", "%Y-%m-%d").date()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "ALTER TABLE as_relationships REORGANIZE PARTITION p_future INTO ("
+        + _partition_clause(month)
+        + ", PARTITION p_future VALUES LESS THAN (MAXVALUE))"
+    )
+    cursor.close()
+    conn.close()
+
+
+# Queries that must be served by an index: (name, sql). Parameters are
+# filled from a sample row so the optimizer sees realistic values.
+HOT_QUERIES = [
+    ("lost_customers months",
+     "SELECT DISTINCT snapshot_date FROM as_relationships WHERE provider_asn = %(asn)s"),
+    ("lost_customers month customers",
+     "SELECT customer_asn FROM as_relationships WHERE provider_asn = %(asn)s "
+     "AND snapshot_date = %(month)s AND relationship_type = 'customer'"),
+    ("find_competitors providers",
+     "SELECT provider_asn, snapshot_date FROM as_relationships WHERE customer_asn = %(asn)s "
+     "AND relationship_type = 'provider' AND snapshot_date >= %(month)s AND snapshot_date < %(month)s + INTERVAL 3 MONTH"),
+    ("graph index month",
+     "SELECT provider_asn, customer_asn, relationship_type FROM as_relationships "
+     "WHERE snapshot_date = %(month)s AND relationship_type IN ('customer', 'provider')"),
+    ("as_data latest",
+     "SELECT * FROM as_data WHERE asn = %(asn)s ORDER BY snapshot_date DESC LIMIT 1"),
+    ("as_data history",
+     "SELECT snapshot_date, cone_asn_count FROM as_data WHERE asn = %(asn)s "
+     "AND snapshot_date >= %(month)s AND snapshot_date <= %(month)s + INTERVAL 12 MONTH"),
+    ("lost_customers by requestor",
+     "SELECT * FROM lost_customers WHERE requestor_asn = %(asn)s AND lost_month >= %(month)s ORDER BY lost_month"),
+    ("competitor_gains lookup",
+     "SELECT provider_asn FROM competitor_gains WHERE lost_asn = %(asn)s AND lost_month = %(month)s AND window_months = 3"),
+    ("requestors that lost an ASN",
+     "SELECT DISTINCT requestor_asn FROM lost_customers WHERE lost_asn = %(asn)s"),
+]
+
+# Plans estimated below this many rows are not flagged: on small tables the
+# optimizer may legitimately prefer a scan.
+EXPLAIN_MIN_ROWS = 1000
+
+
+def check_hot_queries(min_rows=EXPLAIN_MIN_ROWS):
+    """
+    EXPLAIN each hot query and return [(name, table, access type, rows)] for
+    plans that scan a whole table or index (type ALL / index).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    cursor.execute("SELECT provider_asn, snapshot_date FROM as_relationships LIMIT 1")
+    sample = cursor.fetchone()
+    params = {
+        "asn": sample["provider_asn"] if sample else 0,
+        "month": sample["snapshot_date"] if sample else "2024-01-01",
+    }
+    failures = []
+    for name, sql in HOT_QUERIES:
+        cursor.execute("EXPLAIN " + sql, params)
+        for row in cursor.fetchall():
+            access = (row.get("type") or "").upper()
+            rows = row.get("rows") or 0
+            if access in ("ALL", "INDEX") and rows >= min_rows:
+                failures.append((name, row.get("table"), access, rows))
+    cursor.close()
+    conn.close()
+    return failures
+
+
+if __name__ == "__main__":
+    # Usage: python migrations.py                       apply pending migrations
+    #        python migrations.py --partition 2020-01 2026-12
+    #        python migrations.py --check              EXPLAIN the hot queries
+    args = sys.argv[1:]
+    if args[:1] == ["--partition"] and len(args) == 3:
+        partition_as_relationships(args[1], args[2])
+    elif args[:1] == ["--check"]:
+        problems = check_hot_queries()
+        for name, table, access, rows in problems:
+            print(f"[ERROR] {name}: full {access} scan on {table} (~{rows} rows)")
+        if problems:
+            sys.exit(1)
+        print("[INFO] All hot queries use indexes.")
+    else:
+        migrate()
@@ -0,0 +1,170 @@
+import os
+import re
+import sys
+import time
+import cProfile
+import functools
+import threading
+from collections import Counter
+
+# Opt-in profiling. Everything is off by default; when off, the hooks cost a
+# couple of attribute checks per request.
+#   ASRANK_PROFILE=1              cProfile every request
+#   ASRANK_PROFILE_QUERY_FLAG=1   cProfile requests carrying ?profile=1
+#   ASRANK_PROFILE_ETL=1          cProfile every dynamic_update run
+#   ASRANK_SLOW_SECONDS=<s>       sample the stack of any request or ETL run
+#                                 still going after <s> seconds
+# Profiles go to ASRANK_PROFILE_DIR: .prof files (open with pstats/snakeviz)
+# and .collapsed stack samples (flamegraph.pl / speedscope format).
+PROFILE_DIR = os.environ.get(
+    "ASRANK_PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".profiles"))
+PROFILE_REQUESTS = os.environ.get("ASRANK_PROFILE") == "1"
+PROFILE_QUERY_FLAG = os.environ.get("ASRANK_PROFILE_QUERY_FLAG") == "1"
+PROFILE_ETL = os.environ.get("ASRANK_PROFILE_ETL") == "1"
+SLOW_SECONDS = float(os.environ.get("ASRANK_SLOW_SECONDS", 0))
+# Stack sampling period once a run has crossed SLOW_SECONDS.
+SAMPLE_INTERVAL = float(os.environ.get("ASRANK_SAMPLE_INTERVAL", 0.01))
+
+
+def _profile_path(label, suffix):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_")[:80] or "run"
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return os.path.join(PROFILE_DIR, f"{stamp}-{os.getpid()}-{threading.get_ident()}-{safe}{suffix}")
+
+
+def start_profile():
+    """
+    Start cProfile on the current thread; None if another profiler is active.
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None
+    return profiler
+
+
+def save_profile(profiler, label, elapsed=None):
+    profiler.disable()
+    path = _profile_path(label, ".prof")
+    try:
+        profiler.dump_stats(path)
+    except OSError as e:
+        print(f"[WARN] Could not save profile {path}: {e}")
+        return None
+    took = f" ({elapsed:.2f}s)" if elapsed is not None else ""
+    print(f"[INFO] Profile for {label}{took} saved to {path}")
+    return path
+
+
+class SlowSampler:
+    """
+    One background thread that samples, every SAMPLE_INTERVAL, the stacks of
+    registered threads that have been running longer than `threshold`.
+    Fast runs are never sampled, so the cost is a dict insert/remove per run.
+    """
+
+    def __init__(self, threshold, interval=SAMPLE_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="slow-sampler", daemon=True)
+                    self._thread.start()
+
+    def begin(self, label):
+        """
+        Track the current thread; False if it is already tracked (nested run).
+        """
+        self._ensure_thread()
+        entry = {"label": label, "started": time.perf_counter(), "samples": Counter()}
+        with self._lock:
+            if threading.get_ident() in self._active:
+                return False
+            self._active[threading.get_ident()] = entry
+        return True
+
+    def end(self):
+        """
+        Stop tracking the current thread; save and return the sample file path
+        if the run crossed the threshold.
+        """
+        with self._lock:
+            entry = self._active.pop(threading.get_ident(), None)
+        if entry is None or not entry["samples"]:
+            return None
+        elapsed = time.perf_counter() - entry["started"]
+        path = _profile_path(entry["label"], ".collapsed")
+        try:
+            with open(path, "w", encoding="utf-8") as fh:
+                fh.write(f"# {entry['label']} took {elapsed:.3f}s; sampled every "
+                         f"{self.interval * 1000:.0f}ms after {self.threshold}s\n")
+                for stack, count in entry["samples"].most_common():
+                    fh.write(f"{stack} {count}\n")
+        except OSError as e:
+            print(f"[WARN] Could not save slow-run samples {path}: {e}")
+            return None
+        print(f"[WARN] Slow run {entry['label']} ({elapsed:.2f}s), stack samples saved to {path}")
+        return path
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self._lock:
+                due = [(tid, e) for tid, e in self._active.items() if now - e["started"] >= self.threshold]
+            if not due:
+                continue
+            frames = sys._current_frames()
+            for tid, entry in due:
+                frame = frames.get(tid)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                with self._lock:
+                    if self._active.get(tid) is entry:
+                        entry["samples"][";".join(reversed(stack))] += 1
+
+
+slow_sampler = SlowSampler(SLOW_SECONDS) if SLOW_SECONDS > 0 else None
+
+
+def profiled(label, enabled=lambda: PROFILE_ETL):
+    """
+    Decorator for ETL entry points: cProfile the call when enabled() is true,
+    otherwise sample it only if it runs past ASRANK_SLOW_SECONDS.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            run_label = f"{label}-{'-'.join(str(a) for a in args[:1])}"
+            if enabled():
+                profiler = start_profile()
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    if profiler is not None:
+                        save_profile(profiler, run_label, time.perf_counter() - started)
+            if slow_sampler is None:
+                return fn(*args, **kwargs)
+            if not slow_sampler.begin(run_label):
+                return fn(*args, **kwargs)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                slow_sampler.end()
+        return wrapper
+    return decorator
@@ -0,0 +1,147 @@
+import os
+import csv
+import io
+import zipfile
+import tempfile
+import xlsxwriter
+from db import get_db_connection
+
+# Streaming exports: rows come off an unbuffered (server-side) cursor in
+# chunks and go straight into the output, so memory stays flat no matter how
+# many relationships an ASN has.
+EXPORT_FETCH_SIZE = 5000
+# Chunk size used when streaming the finished xlsx file to the client.
+EXPORT_READ_SIZE = 256 * 1024
+# Excel's row limit, header included; longer sheets continue on "<name> (2)".
+XLSX_MAX_ROWS = 1048576
+
+RAW_DATA_SHEETS = [
+    ("Historical AS Data",
+     "SELECT * FROM as_data WHERE asn = %s ORDER BY snapshot_date ASC", 1),
+    ("Lost Customers",
+     "SELECT * FROM lost_customers WHERE requestor_asn = %s ORDER BY lost_month ASC", 1),
+    ("AS Relationships",
+     "SELECT * FROM as_relationships WHERE provider_asn = %s OR customer_asn = %s ORDER BY snapshot_date ASC", 2),
+    ("PeeringDB Networks", "SELECT * FROM peeringdb_networks WHERE asn = %s", 1),
+    ("PeeringDB Exchanges", "SELECT * FROM peeringdb_ix WHERE asn = %s", 1),
+    ("PeeringDB Facilities", "SELECT * FROM peeringdb_fac WHERE asn = %s", 1),
+]
+
+
+def iter_sheet_rows(cursor, sql, params, fetch_size=EXPORT_FETCH_SIZE):
+    """
+    Yield the column names, then each row, fetching fetch_size rows at a time.
+    """
+    cursor.execute(sql, params)
+    yield [d[0] for d in cursor.description]
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield row
+
+
+def _iter_sheets(asn, sheets):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        for name, sql, n_params in sheets:
+            yield name, iter_sheet_rows(cursor, sql, (asn,) * n_params)
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def stream_xlsx(asn, sheets=RAW_DATA_SHEETS):
+    """
+    Build the workbook with xlsxwriter's constant_memory mode (each row is
+    flushed to a temp file as it is written), then stream the file in chunks.
+    An xlsx is a zip whose directory is written last, so the bytes can only be
+    sent once the workbook is closed; memory stays constant either way.
+    """
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        workbook = xlsxwriter.Workbook(path, {
+            "constant_memory": True,
+            "default_date_format": "yyyy-mm-dd",
+            "strings_to_numbers": False,
+        })
+        for name, rows in _iter_sheets(asn, sheets):
+            header = next(rows)
+            part = 1
+            worksheet = workbook.add_worksheet(name)
+            worksheet.write_row(0, 0, header)
+            row_idx = 1
+            for row in rows:
+                if row_idx >= XLSX_MAX_ROWS:
+                    part += 1
+                    worksheet = workbook.add_worksheet(f"{name[:26]} ({part})")
+                    worksheet.write_row(0, 0, header)
+                    row_idx = 1
+                worksheet.write_row(row_idx, 0, row)
+                row_idx += 1
+        workbook.close()
+        with open(path, "rb") as fh:
+            while True:
+                chunk = fh.read(EXPORT_READ_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Write-only, non-seekable file object that collects bytes for a generator
+    to drain; zipfile falls back to data descriptors for such streams.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+        self.buffered = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._pos += len(data)
+        self.buffered += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self):
+        out = b"".join(self._chunks)
+        self._chunks = []
+        self.buffered = 0
+        return out
+
+
+def stream_csv_zip(asn, sheets=RAW_DATA_SHEETS):
+    """
+    Stream a zip of one CSV per sheet while the rows are still being read.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, rows in _iter_sheets(asn, sheets):
+            filename = name.lower().replace(" ", "_") + ".csv"
+            with zf.open(filename, "w", force_zip64=True) as member:
+                text = io.TextIOWrapper(member, encoding="utf-8", newline="")
+                writer = csv.writer(text)
+                for row in rows:
+                    writer.writerow(row)
+                    if sink.buffered >= EXPORT_READ_SIZE:
+                        yield sink.drain()
+                text.flush()
+                text.detach()
+            yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,96 @@
+import os
+import time
+import threading
+
+# Shared API response cache. Entries live in flask_caching's FileSystemCache
+# under RESPONSE_CACHE_DIR so every worker process sees them. Invalidation is
+# by generation: each ASN has a small file holding a version stamp that is
+# part of every cache key for that ASN, so bumping it orphans the old entries
+# (they age out with the timeout/threshold) without scanning the cache.
+RESPONSE_CACHE_DIR = os.environ.get(
+    "RESPONSE_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".response_cache"))
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get("RESPONSE_CACHE_TIMEOUT", 300))
+# Max number of entries before FileSystemCache starts pruning.
+RESPONSE_CACHE_THRESHOLD = int(os.environ.get("RESPONSE_CACHE_THRESHOLD", 5000))
+
+_GENERATION_DIR = os.path.join(RESPONSE_CACHE_DIR, "generations")
+_ALL = "_all"
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+
+
+def flask_cache_config():
+    return {
+        "CACHE_TYPE": "FileSystemCache",
+        "CACHE_DIR": os.path.join(RESPONSE_CACHE_DIR, "entries"),
+        "CACHE_DEFAULT_TIMEOUT": RESPONSE_CACHE_TIMEOUT,
+        "CACHE_THRESHOLD": RESPONSE_CACHE_THRESHOLD,
+    }
+
+
+def _generation(name):
+    try:
+        with open(os.path.join(_GENERATION_DIR, name), encoding="utf-8") as fh:
+            return fh.read().strip() or "0"
+    except OSError:
+        return "0"
+
+
+def _bump(name):
+    os.makedirs(_GENERATION_DIR, exist_ok=True)
+    path = os.path.join(_GENERATION_DIR, name)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(str(time.time_ns()))
+    os.replace(tmp, path)
+    with _stats_lock:
+        _stats["invalidations"] += 1
+
+
+def invalidate_asn(asn):
+    """
+    Drop cached responses for one ASN. Called by the ETL after it commits.
+    """
+    try:
+        _bump(str(asn))
+    except OSError as e:
+        print(f"[WARN] Could not invalidate response cache for ASN {asn}: {e}")
+
+
+def invalidate_all():
+    """
+    Drop every cached response, e.g. after a full-month dataset import.
+    """
+    try:
+        _bump(_ALL)
+    except OSError as e:
+        print(f"[WARN] Could not invalidate response cache: {e}")
+
+
+def cache_key(endpoint, asn, args):
+    """
+    Key over the endpoint, every query parameter, and the current generations
+    of the ASN and of the whole cache.
+    """
+    query = "&".join(f"{k}={v}" for k, v in sorted(args.items(multi=True)))
+    return f"{endpoint}:{asn}:{_generation(_ALL)}:{_generation(str(asn))}:{query}"
+
+
+def record(hit, stored=False):
+    with _stats_lock:
+        _stats["hits" if hit else "misses"] += 1
+        if stored:
+            _stats["stores"] += 1
+
+
+def cache_stats():
+    """
+    Hit/miss counters for this process since start.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
@@ -0,0 +1,301 @@
+import os
+import sys
+import time
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from db import get_db_connection
+
+try:
+    import pyarrow as pa  # optional, only needed for the columnar store
+    import pyarrow.ipc as ipc
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+# Columnar copy of as_data / as_relationships for multi-month analytics, one
+# uncompressed Arrow IPC file per table and snapshot month:
+#   <STORE_DIR>/<table>/month=YYYY-MM-01/part.arrow
+# Uncompressed IPC files can be memory-mapped and read without copying, so a
+# range scan only touches the pages of the columns it uses.
+STORE_DIR = os.environ.get(
+    "SNAPSHOT_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".snapshot_store"))
+EXPORT_CHUNK_ROWS = 50000
+
+if pa is not None:
+    TABLE_SCHEMAS = {
+        "as_data": pa.schema([
+            ("asn", pa.string()),
+            ("snapshot_date", pa.date32()),
+            ("asn_name", pa.string()),
+            ("org_name", pa.string()),
+            ("country_iso", pa.string()),
+            ("as_rank", pa.int64()),
+            ("cone_asn_count", pa.int64()),
+            ("cone_prefix_count", pa.int64()),
+            ("cone_address_count", pa.int64()),
+            ("customer_degree", pa.int64()),
+            ("peer_degree", pa.int64()),
+            ("transit_degree", pa.int64()),
+            ("provider_degree", pa.int64()),
+        ]),
+        "as_relationships": pa.schema([
+            ("provider_asn", pa.string()),
+            ("customer_asn", pa.string()),
+            ("relationship_type", pa.string()),
+            ("snapshot_date", pa.date32()),
+            ("path_count", pa.int64()),
+        ]),
+    }
+else:
+    TABLE_SCHEMAS = {}
+
+_STRING_COLUMNS = {"asn", "provider_asn", "customer_asn"}
+# Export-time column expressions; cone sizes CAIDA did not provide come from
+# computed_cones, as in the MySQL read paths.
+_EXPORT_COLUMNS = {"cone_asn_count": "COALESCE(t.cone_asn_count, cc.cone_asn_count)"}
+_EXPORT_JOINS = {
+    "as_data": "LEFT JOIN computed_cones cc ON cc.asn = t.asn AND cc.snapshot_date = t.snapshot_date",
+}
+
+
+def available():
+    return pa is not None
+
+
+def _require():
+    if pa is None:
+        raise ImportError("the snapshot store requires the pyarrow package")
+
+
+def _month(value):
+    if hasattr(value, "strftime"):
+        return value.strftime("%Y-%m-01")
+    return str(value)[:7] + "-01"
+
+
+def months_between(start, end):
+    month = datetime.strptime(_month(start), "%Y-%m-%d")
+    last = datetime.strptime(_month(end), "%Y-%m-%d")
+    months = []
+    while month <= last:
+        months.append(month.strftime("%Y-%m-%d"))
+        month += relativedelta(months=1)
+    return months
+
+
+def _partition_path(table, month):
+    return os.path.join(STORE_DIR, table, f"month={_month(month)}", "part.arrow")
+
+
+def _dirty_path(month):
+    return os.path.join(STORE_DIR, "_dirty", _month(month))
+
+
+def mark_dirty(months):
+    """
+    Record months whose MySQL rows changed since they were last exported.
+    Cheap enough to call from every ingest; compact() picks them up.
+    """
+    for month in months:
+        path = _dirty_path(month)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a"):
+                os.utime(path, None)
+        except OSError as e:
+            print(f"[WARN] Could not mark snapshot month {month} dirty: {e}")
+
+
+def dirty_months():
+    try:
+        return sorted(os.listdir(os.path.join(STORE_DIR, "_dirty")))
+    except FileNotFoundError:
+        return []
+
+
+def export_month(table, month):
+    """
+    Rewrite one month partition of `table` from MySQL. Rows are read in
+    chunks from an unbuffered cursor and appended as record batches; the file
+    is swapped in atomically so readers never see a partial partition.
+    """
+    _require()
+    schema = TABLE_SCHEMAS[table]
+    month = _month(month)
+    path = _partition_path(table, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    join = _EXPORT_JOINS.get(table, "")
+    columns = ", ".join(_EXPORT_COLUMNS[n] if join and n in _EXPORT_COLUMNS else f"t.{n}"
+                        for n in schema.names)
+    rows_written = 0
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT {columns} FROM {table} t {join} WHERE t.snapshot_date = %s", (month,))
+        with pa.OSFile(tmp, "wb") as sink, ipc.new_file(sink, schema) as writer:
+            while True:
+                rows = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+                if not rows:
+                    break
+                arrays = []
+                for i, field in enumerate(schema):
+                    values = [r[i] for r in rows]
+                    if field.name in _STRING_COLUMNS:
+                        values = [None if v is None else str(v) for v in values]
+                    arrays.append(pa.array(values, type=field.type))
+                writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+                rows_written += len(rows)
+        os.replace(tmp, path)
+    finally:
+        cursor.close()
+        conn.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return rows_written
+
+
+def compact(months=None):
+    """
+    Export the given months (default: every dirty month) for both tables.
+    A dirty marker is only cleared if nothing re-marked it during the export.
+    """
+    _require()
+    months = [_month(m) for m in months] if months else dirty_months()
+    for month in months:
+        started = time.time()
+        counts = {table: export_month(table, month) for table in TABLE_SCHEMAS}
+        marker = _dirty_path(month)
+        try:
+            if os.path.getmtime(marker) < started:
+                os.remove(marker)
+        except OSError:
+            pass
+        print(f"[INFO] Snapshot store: {month} exported "
+              + ", ".join(f"{t}={n} rows" for t, n in counts.items()))
+    return months
+
+
+def _mysql_has_month(table, month):
+    conn = get_db_connection()
+    cursor = conn.cursor(buffered=True)
+    cursor.execute(f"SELECT 1 FROM {table} WHERE snapshot_date = %s LIMIT 1", (month,))
+    found = cursor.fetchone() is not None
+    cursor.close()
+    conn.close()
+    return found
+
+
+def stale_months(table, start, end):
+    """
+    Months in [start, end] the store cannot answer: marked dirty, or without
+    a partition while MySQL has rows for them (ingested, never compacted).
+    """
+    stale = []
+    dirty = set(dirty_months())
+    for month in months_between(start, end):
+        if month in dirty:
+            stale.append(month)
+        elif not os.path.exists(_partition_path(table, month)) and _mysql_has_month(table, month):
+            stale.append(month)
+    return stale
+
+
+def covers(table, start, end):
+    """
+    True when the store can answer [start, end] on its own: something has
+    been exported and no month in the range is stale (see stale_months).
+    """
+    if pa is None:
+        return False
+    try:
+        exported = any(d.startswith("month=") for d in os.listdir(os.path.join(STORE_DIR, table)))
+    except FileNotFoundError:
+        return False
+    return exported and not stale_months(table, start, end)
+
+
+def read_month(table, month, columns=None):
+    """
+    Memory-map one partition; returns None when the month was never exported.
+    """
+    _require()
+    path = _partition_path(table, month)
+    if not os.path.exists(path):
+        return None
+    source = pa.memory_map(path, "r")
+    result = ipc.open_file(source).read_all()
+    return result.select(columns) if columns else result
+
+
+def scan(table, start, end, columns=None, predicate=None):
+    """
+    Concatenate the month partitions in [start, end], optionally filtered by
+    predicate(table) -> boolean mask, evaluated per partition.
+    """
+    _require()
+    parts = []
+    for month in months_between(start, end):
+        part = read_month(table, month, columns)
+        if part is None:
+            continue
+        if predicate is not None:
+            part = part.filter(predicate(part))
+        parts.append(part)
+    if not parts:
+        return TABLE_SCHEMAS[table].empty_table().select(columns) if columns else TABLE_SCHEMAS[table].empty_table()
+    return pa.concat_tables(parts)
+
+
+def historical_series(asn, start, end):
+    """
+    The /api/historical payload computed from the store.
+    """
+    columns = ["asn", "snapshot_date", "as_rank", "cone_asn_count", "customer_degree",
+               "transit_degree", "peer_degree", "provider_degree"]
+    result = scan("as_data", start, end, columns, lambda t: pc.equal(t["asn"], str(asn)))
+    result = result.sort_by("snapshot_date")
+    return {
+        "labels": [d.strftime("%Y-%m-%d") for d in result["snapshot_date"].to_pylist()],
+        "coneSizes": result["cone_asn_count"].to_pylist(),
+        "customerQuantity": result["customer_degree"].to_pylist(),
+        "transitDegree": result["transit_degree"].to_pylist(),
+        "peerQuantity": result["peer_degree"].to_pylist(),
+        "providerQuantity": result["provider_degree"].to_pylist(),
+        "ranks": result["as_rank"].to_pylist(),
+    }
+
+
+def customer_churn(asn, start, end):
+    """
+    Month-over-month customer churn for asn from provider->customer rows:
+    [{month, customers, gained, lost, gap}], with gained/lost as ASN lists.
+    A month without a partition is reported with gap=True and customers None,
+    and the month after it is not diffed across the gap. Callers should check
+    stale_months() first so a gap means "no snapshot", not "not compacted yet".
+    """
+    asn = str(asn)
+    out = []
+    previous = None
+    for month in months_between(start, end):
+        part = read_month("as_relationships", month, ["provider_asn", "customer_asn", "relationship_type"])
+        if part is None:
+            out.append({"month": month, "customers": None, "gained": [], "lost": [], "gap": True})
+            previous = None
+            continue
+        mask = pc.and_(pc.equal(part["provider_asn"], asn),
+                       pc.equal(part["relationship_type"], "customer"))
+        current = pc.unique(part.filter(mask)["customer_asn"])
+        entry = {"month": month, "customers": len(current), "gained": [], "lost": [], "gap": False}
+        if previous is not None:
+            entry["gained"] = current.filter(pc.invert(pc.is_in(current, value_set=previous))).to_pylist()
+            entry["lost"] = previous.filter(pc.invert(pc.is_in(previous, value_set=current))).to_pylist()
+        out.append(entry)
+        previous = current
+    return out
+
+
+if __name__ == "__main__":
+    # Usage: python snapshot_store.py [YYYY-MM ...]   (default: all dirty months)
+    compact(sys.argv[1:] or None)
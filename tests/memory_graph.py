@@ -0,0 +1,54 @@
+"""
+In-memory relationship data for the as_graph / as_cone tests.
+"""
+from as_graph import ASGraphIndex
+
+REL_TYPES = ("customer", "provider", "peer")
+
+
+class MemoryGraphIndex(ASGraphIndex):
+    """
+    ASGraphIndex that builds months from {month: rows} instead of as_relationships.
+    """
+
+    def __init__(self, rows_by_month, max_bytes=None):
+        super().__init__(max_bytes)
+        self.rows_by_month = rows_by_month
+        self.loads = 0
+
+    def _load(self, month):
+        self.loads += 1
+        return self.build_month(month, self.rows_by_month.get(month, []))
+
+
+def random_rows(rng, asns, edges):
+    """
+    (provider_asn, customer_asn, relationship_type) rows over ASNs "1".."asns",
+    loops and duplicates included.
+    """
+    return [
+        (str(rng.randint(1, asns)), str(rng.randint(1, asns)), rng.choice(REL_TYPES))
+        for _ in range(edges)
+    ]
+
+
+def expected_children(rows):
+    """
+    provider -> customers, from both the 'customer' and the 'provider' rows.
+    """
+    children = {}
+    for provider, customer, rel in rows:
+        if rel in ("customer", "provider"):
+            children.setdefault(provider, set()).add(customer)
+    return children
+
+
+def brute_cone(children, asn):
+    seen = {asn}
+    todo = [asn]
+    while todo:
+        for child in children.get(todo.pop(), ()):
+            if child not in seen:
+                seen.add(child)
+                todo.append(child)
+    return seen
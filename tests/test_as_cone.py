@@ -0,0 +1,92 @@
+import random
+from datetime import date
+import pytest
+import as_cone
+from as_cone import compute_cones, month_cones, cone_loss
+from memory_graph import MemoryGraphIndex, random_rows, expected_children, brute_cone
+
+JAN = date(2024, 1, 1)
+FEB = date(2024, 2, 1)
+
+
+def _present(rows):
+    return {a for p, c, rel in rows if rel in ("customer", "provider") for a in (p, c)}
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_cones_match_brute_force(seed):
+    rng = random.Random(seed)
+    rows = random_rows(rng, asns=rng.randint(2, 30), edges=rng.randint(1, 80))
+    cones = compute_cones(JAN, MemoryGraphIndex({JAN: rows}))
+    children = expected_children(rows)
+    for asn in _present(rows):
+        expected = brute_cone(children, asn)
+        assert cones.members(asn) == expected
+        assert cones.count(asn) == len(expected)
+    assert cones.counts() == {asn: len(brute_cone(children, asn)) for asn in children}
+
+
+def test_cycle_shares_one_cone():
+    rows = [("1", "2", "customer"), ("2", "3", "customer"), ("3", "1", "customer"), ("3", "4", "customer")]
+    cones = compute_cones(JAN, MemoryGraphIndex({JAN: rows}))
+    assert [cones.count(a) for a in "1234"] == [4, 4, 4, 1]
+
+
+def test_absent_asns_have_empty_cones():
+    index = MemoryGraphIndex({
+        JAN: [("1", "2", "customer"), ("1", "3", "peer")],
+        FEB: [("4", "5", "customer")],
+    })
+    index.month(FEB)  # interns 4 and 5, which are absent from January
+    cones = compute_cones(JAN, index)
+    assert cones.count("2") == 1
+    assert "2" in cones
+    for asn in ("3", "4", "5", "999"):
+        assert asn not in cones
+        assert cones.count(asn) == 0
+        assert cones.members(asn) == set()
+
+
+def test_month_cones_cached_until_month_invalidated():
+    index = MemoryGraphIndex({JAN: [("1", "2", "customer")]})
+    first = month_cones(JAN, index)
+    assert month_cones(JAN, index) is first
+    index.invalidate(JAN)
+    assert month_cones(JAN, index) is not first
+
+
+def test_month_cones_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(as_cone, "CONE_CACHE_MONTHS", 1)
+    index = MemoryGraphIndex({JAN: [("1", "2", "customer")], FEB: [("1", "3", "customer")]})
+    first = month_cones(JAN, index)
+    month_cones(FEB, index)
+    assert month_cones(JAN, index) is not first
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_cone_loss_matches_brute_force(seed):
+    rng = random.Random(seed)
+    rows = {m: random_rows(rng, asns=15, edges=30) for m in (JAN, FEB)}
+    index = MemoryGraphIndex(rows)
+    before = expected_children(rows[JAN])
+    after = expected_children(rows[FEB])
+    present_before = _present(rows[JAN])
+    present_after = _present(rows[FEB])
+    for asn in [str(a) for a in range(1, 16)]:
+        for lost in [str(a) for a in range(1, 16)]:
+            cone_before = brute_cone(before, asn) if asn in present_before else set()
+            cone_after = brute_cone(after, asn) if asn in present_after else set()
+            lost_cone = brute_cone(before, lost) if lost in present_before else set()
+            assert cone_loss(asn, lost, JAN, FEB, index) == (cone_before - cone_after) & lost_cone
+
+
+def test_invalidate_months_drops_graph_and_cones():
+    rows = {JAN: [("1", "2", "customer")], FEB: [("1", "3", "customer")]}
+    index = MemoryGraphIndex(rows)
+    assert month_cones(JAN, index).count("1") == 2
+    feb = month_cones(FEB, index)
+    rows[JAN].append(("2", "4", "customer"))
+    as_cone.invalidate_months(["2024-01-01"], index)
+    assert (id(index), JAN) not in as_cone._cone_cache
+    assert month_cones(FEB, index) is feb
+    assert month_cones(JAN, index).count("1") == 3
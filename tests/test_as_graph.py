@@ -0,0 +1,62 @@
+import random
+from datetime import date
+import pytest
+from memory_graph import MemoryGraphIndex, random_rows
+
+JAN = date(2024, 1, 1)
+FEB = date(2024, 2, 1)
+MAR = date(2024, 3, 1)
+
+
+def _random_index(seed):
+    rng = random.Random(seed)
+    rows = {m: random_rows(rng, asns=25, edges=60) for m in (JAN, FEB)}
+    return MemoryGraphIndex(rows), rows
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_csr_neighbours_match_rows(seed):
+    index, rows = _random_index(seed)
+    for month, month_rows in rows.items():
+        for asn in [str(a) for a in range(1, 27)]:
+            customers = {c for p, c, rel in month_rows if p == asn and rel == "customer"}
+            providers = {p for p, c, rel in month_rows if c == asn and rel == "provider"}
+            assert index.customers(asn, month) == customers
+            assert index.providers(asn, month) == providers
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_lost_customers_is_month_difference(seed):
+    index, rows = _random_index(seed)
+    for asn in [str(a) for a in range(1, 26)]:
+        before = {c for p, c, rel in rows[JAN] if p == asn and rel == "customer"}
+        after = {c for p, c, rel in rows[FEB] if p == asn and rel == "customer"}
+        assert index.lost_customers(asn, JAN, FEB) == before - after
+
+
+def test_provider_rows_cover_half_open_range():
+    index = MemoryGraphIndex({
+        JAN: [("10", "1", "provider")],
+        FEB: [("11", "1", "provider"), ("12", "1", "customer")],
+        MAR: [("13", "1", "provider")],
+    })
+    assert sorted((r["provider_asn"], r["snapshot_date"]) for r in index.provider_rows("1", JAN, MAR)) == [
+        ("10", JAN), ("11", FEB)]
+
+
+def test_months_load_once_until_invalidated():
+    index = MemoryGraphIndex({JAN: [("1", "2", "customer")]})
+    index.customers("1", JAN)
+    index.customers("1", "2024-01-15")
+    assert index.loads == 1
+    index.invalidate(JAN)
+    index.customers("1", JAN)
+    assert index.loads == 2
+
+
+def test_eviction_keeps_most_recent_month():
+    index = MemoryGraphIndex({JAN: [("1", "2", "customer")], FEB: [("1", "3", "customer")]}, max_bytes=1)
+    index.month(JAN)
+    index.month(FEB)
+    assert list(index._months) == [FEB]
+    assert index.customers("1", JAN) == {"2"}
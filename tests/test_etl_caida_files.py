@@ -0,0 +1,110 @@
+import os
+import etl_caida_files
+from etl_caida_files import iter_month_file_rows, load_caida_month_files, snapshot_from_filename
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+AS_REL = os.path.join(FIXTURES, "20240101.as-rel2.txt")
+PPDC = os.path.join(FIXTURES, "20240101.ppdc-ases.txt")
+MONTH = "2024-01-01"
+
+
+def _rows(ppdc_path=PPDC):
+    rows = {"as_relationships": [], "as_data": []}
+    for table, params in iter_month_file_rows(AS_REL, ppdc_path, MONTH):
+        rows[table].append(params)
+    return rows
+
+
+def test_snapshot_month_from_filename():
+    assert snapshot_from_filename(AS_REL) == MONTH
+
+
+def test_relationship_rows_cover_both_views():
+    assert sorted(_rows()["as_relationships"]) == sorted([
+        # p2c lines: the provider's and the customer's view
+        ("1", "2", "customer", MONTH), ("1", "2", "provider", MONTH),
+        ("1", "3", "customer", MONTH), ("1", "3", "provider", MONTH),
+        ("2", "4", "customer", MONTH), ("2", "4", "provider", MONTH),
+        # p2p lines: both directions
+        ("2", "3", "peer", MONTH), ("3", "2", "peer", MONTH),
+        ("5", "1", "peer", MONTH), ("1", "5", "peer", MONTH),
+    ])
+
+
+def test_as_data_rows_carry_degrees_and_cones():
+    # (asn, snapshot_date, cone_asn_count, customer, peer, provider degree)
+    assert sorted(_rows()["as_data"]) == [
+        ("1", MONTH, 4, 2, 1, 0),
+        ("2", MONTH, 2, 1, 1, 1),
+        ("3", MONTH, 1, 0, 1, 1),
+        ("4", MONTH, 1, 0, 0, 1),
+        ("5", MONTH, 1, 0, 1, 0),
+        ("8", MONTH, 1, 0, 0, 0),
+    ]
+
+
+def test_cone_is_null_without_ppdc_file():
+    assert all(row[2] is None for row in _rows(ppdc_path=None)["as_data"])
+
+
+class _FakeCursor:
+    def __init__(self, executed):
+        self.executed = executed
+
+    def executemany(self, sql, rows):
+        self.executed.extend(rows)
+
+    def close(self):
+        pass
+
+
+class _FakeConnection:
+    def __init__(self):
+        self.executed = []
+        self.committed = False
+
+    def cursor(self):
+        return _FakeCursor(self.executed)
+
+    def commit(self):
+        self.committed = True
+
+    def close(self):
+        pass
+
+
+def test_load_writes_rows_and_resets_month_state(monkeypatch):
+    conn = _FakeConnection()
+    calls = []
+    monkeypatch.setattr(etl_caida_files, "get_db_connection", lambda: conn)
+    monkeypatch.setattr(etl_caida_files, "invalidate_fingerprints",
+                        lambda **kwargs: calls.append(("fingerprints", kwargs)))
+    monkeypatch.setattr(etl_caida_files, "invalidate_all", lambda: calls.append(("responses", {})))
+    monkeypatch.setattr(etl_caida_files.snapshot_store, "mark_dirty",
+                        lambda months: calls.append(("snapshot_store", list(months))))
+    monkeypatch.setattr(etl_caida_files, "fill_computed_cones",
+                        lambda month: calls.append(("computed_cones", month)))
+
+    stats = load_caida_month_files(AS_REL, PPDC, batch_size=4)
+
+    assert conn.committed
+    assert stats["as_relationships"]["rows"] == 10
+    assert stats["as_data"]["rows"] == 6
+    assert len(conn.executed) == 16
+    assert ("fingerprints", {"months": [MONTH]}) in calls
+    assert ("responses", {}) in calls
+    assert ("snapshot_store", [MONTH]) in calls
+    assert not [c for c in calls if c[0] == "computed_cones"]
+
+
+def test_load_without_ppdc_computes_cones(monkeypatch):
+    calls = []
+    monkeypatch.setattr(etl_caida_files, "get_db_connection", _FakeConnection)
+    monkeypatch.setattr(etl_caida_files, "invalidate_fingerprints", lambda **kwargs: None)
+    monkeypatch.setattr(etl_caida_files, "invalidate_all", lambda: None)
+    monkeypatch.setattr(etl_caida_files.snapshot_store, "mark_dirty", lambda months: None)
+    monkeypatch.setattr(etl_caida_files, "fill_computed_cones", calls.append)
+
+    load_caida_month_files(AS_REL, None, batch_size=4)
+
+    assert calls == [MONTH]
@@ -0,0 +1,33 @@
+import caida_cache
+import etl_lost_competitor
+from etl_lost_competitor import fetch_caida_batch_cached, fetch_caida_data_cached
+
+
+def edge(asn, month):
+    return {"node": {"asn": asn, "date": month}}
+
+
+def test_batch_reads_cached_months_and_fetches_only_the_rest(tmp_path, monkeypatch):
+    monkeypatch.setattr(caida_cache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(etl_lost_competitor, "RESPONSE_CACHE_ENABLED", True)
+    requests = []
+
+    def fake_batch(asns, start, end, max_bytes=None):
+        requests.append((sorted(asns), start, end))
+        months = [m for m in ("2020-01-01", "2020-02-01") if start <= m <= end]
+        return {a: [edge(a, m) for m in months] for a in asns}
+
+    monkeypatch.setattr(etl_lost_competitor, "fetch_caida_batch", fake_batch)
+    caida_cache.put("1", "2020-01-01", [edge("1", "2020-01-01")])
+
+    routed = fetch_caida_batch_cached(["1", "2"], "2020-01-01", "2020-02-29")
+    assert requests == [(["1"], "2020-02-01", "2020-02-29"), (["2"], "2020-01-01", "2020-02-29")]
+    assert routed["1"] == [edge("1", "2020-01-01"), edge("1", "2020-02-01")]
+    assert routed["2"] == [edge("2", "2020-01-01"), edge("2", "2020-02-01")]
+
+    requests.clear()
+    again = fetch_caida_batch_cached(["1", "2"], "2020-01-01", "2020-02-29")
+    assert requests == []
+    assert again == routed
+    single = fetch_caida_data_cached("2", "2020-01-01", "2020-02-29")
+    assert single["data"]["asns"]["edges"] == routed["2"]
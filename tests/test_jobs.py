@@ -0,0 +1,92 @@
+import jobs
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rowcount = 0
+        self.lastrowid = None
+        self._result = []
+
+    def execute(self, sql, params=()):
+        sql = " ".join(sql.split())
+        self.db.executed.append(sql)
+        self._result = []
+        if sql.startswith("SELECT GET_LOCK") or sql.startswith("SELECT RELEASE_LOCK"):
+            self._result = [(1,)]
+        elif sql.startswith("UPDATE etl_jobs SET status='failed'"):
+            for job in self.db.jobs.values():
+                if job["status"] in ("queued", "running") and job["stale"]:
+                    job["status"] = "failed"
+        elif sql.startswith("SELECT id FROM etl_jobs"):
+            live = [i for i, j in self.db.jobs.items() if j["status"] in ("queued", "running")]
+            self._result = [(max(live),)] if live else []
+        elif sql.startswith("INSERT INTO etl_jobs"):
+            self.lastrowid = max(self.db.jobs, default=0) + 1
+            self.db.jobs[self.lastrowid] = {"status": "queued", "stale": False}
+        elif sql.startswith("SELECT id, kind, asn, params FROM etl_jobs"):
+            self._result = [(i, "k", "1", "{}") for i, j in self.db.jobs.items()
+                            if j["status"] in ("queued", "running") and j["stale"]]
+        elif sql.startswith("UPDATE etl_jobs SET status='queued'"):
+            job = self.db.jobs[params[0]]
+            self.rowcount = 1 if job["stale"] and not self.db.claimed_elsewhere else 0
+            if self.rowcount:
+                job["stale"] = False
+
+    def fetchone(self):
+        return self._result[0] if self._result else None
+
+    def fetchall(self):
+        return self._result
+
+    def close(self):
+        pass
+
+
+class FakeDB:
+    def __init__(self, jobs_by_id):
+        self.jobs = jobs_by_id
+        self.executed = []
+        self.claimed_elsewhere = False
+
+    def cursor(self, **kwargs):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _setup(monkeypatch, jobs_by_id):
+    db = FakeDB(jobs_by_id)
+    dispatched = []
+    monkeypatch.setattr(jobs, "get_db_connection", lambda: db)
+    monkeypatch.setattr(jobs, "_dispatch", lambda *args: dispatched.append(args))
+    monkeypatch.setitem(jobs._job_kinds, "k", lambda asn, params: [])
+    return db, dispatched
+
+
+def test_submit_reuses_live_job(monkeypatch):
+    db, dispatched = _setup(monkeypatch, {7: {"status": "running", "stale": False}})
+    assert jobs.submit_job("k", "1") == 7
+    assert dispatched == []
+
+
+def test_submit_replaces_job_without_heartbeat(monkeypatch):
+    db, dispatched = _setup(monkeypatch, {7: {"status": "running", "stale": True}})
+    job_id = jobs.submit_job("k", "1")
+    assert job_id == 8
+    assert db.jobs[7]["status"] == "failed"
+    assert dispatched == [(8, "k", "1", {})]
+
+
+def test_resume_only_dispatches_claimed_stale_jobs(monkeypatch):
+    db, dispatched = _setup(monkeypatch, {3: {"status": "running", "stale": True},
+                                          4: {"status": "running", "stale": False}})
+    assert jobs.resume_pending_jobs() == 1
+    assert dispatched == [(3, "k", "1", {})]
+    db.jobs[3]["stale"] = True
+    db.claimed_elsewhere = True
+    assert jobs.resume_pending_jobs() == 0
@@ -0,0 +1,8 @@
+import metrics
+
+
+def test_render_types_counters_and_gauges():
+    text = metrics.render(gauges={"pool_in_use": ("In use.", {(): 3})},
+                          counters={"lookups_total": ("Lookups.", {(("result", "hit"),): 2})})
+    assert "# TYPE pool_in_use gauge\npool_in_use 3" in text
+    assert '# TYPE lookups_total counter\nlookups_total{result="hit"} 2' in text
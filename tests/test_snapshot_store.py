@@ -0,0 +1,59 @@
+import datetime
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+from pyarrow import ipc
+
+import snapshot_store
+
+
+def write_partition(table, month, rows):
+    schema = snapshot_store.TABLE_SCHEMAS[table]
+    path = snapshot_store._partition_path(table, month)
+    snapshot_store.os.makedirs(snapshot_store.os.path.dirname(path), exist_ok=True)
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    arrays = [pa.array(list(col), type=field.type) for col, field in zip(columns, schema)]
+    with pa.OSFile(path, "wb") as sink, ipc.new_file(sink, schema) as writer:
+        writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+
+
+def rel(provider, customer, month):
+    return (provider, customer, "customer", datetime.date.fromisoformat(month), 1)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot_store, "STORE_DIR", str(tmp_path))
+    in_mysql = set()
+    monkeypatch.setattr(snapshot_store, "_mysql_has_month", lambda table, month: month in in_mysql)
+    return in_mysql
+
+
+def test_covers_rejects_months_past_newest_partition_with_mysql_data(store):
+    write_partition("as_relationships", "2024-01-01", [rel("1", "2", "2024-01-01")])
+    assert snapshot_store.covers("as_relationships", "2024-01-01", "2024-02-01")
+    store.add("2024-02-01")
+    assert not snapshot_store.covers("as_relationships", "2024-01-01", "2024-02-01")
+    assert snapshot_store.stale_months("as_relationships", "2024-01-01", "2024-02-01") == ["2024-02-01"]
+
+
+def test_covers_rejects_dirty_months(store):
+    write_partition("as_relationships", "2024-01-01", [rel("1", "2", "2024-01-01")])
+    snapshot_store.mark_dirty(["2024-01-01"])
+    assert not snapshot_store.covers("as_relationships", "2024-01-01", "2024-01-01")
+
+
+def test_covers_false_when_nothing_exported(store):
+    assert not snapshot_store.covers("as_relationships", "2024-01-01", "2024-01-01")
+
+
+def test_customer_churn_does_not_diff_across_gaps(store):
+    write_partition("as_relationships", "2024-01-01", [rel("1", "2", "2024-01-01"), rel("1", "3", "2024-01-01")])
+    write_partition("as_relationships", "2024-03-01", [rel("1", "3", "2024-03-01"), rel("1", "4", "2024-03-01")])
+    write_partition("as_relationships", "2024-04-01", [rel("1", "4", "2024-04-01")])
+    churn = snapshot_store.customer_churn("1", "2024-01-01", "2024-04-01")
+    assert [e["gap"] for e in churn] == [False, True, False, False]
+    assert churn[1]["customers"] is None
+    assert churn[2]["lost"] == [] and churn[2]["gained"] == []
+    assert churn[3]["lost"] == ["3"] and churn[3]["gained"] == []